@@ -0,0 +1,60 @@
+"""
+Helpers shared by the benchmark scripts.
+Every script runs the real Flask app against a throw-away SQLite database (or the database in
+BENCH_DATABASE_URL) so it never touches the DATABASE_URL of the developer.
+"""
+import atexit
+import os
+import sys
+import tempfile
+import time
+
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+
+
+def load_app():
+    """ Imports src/app.py pointing to a fresh database and creates the tables """
+    database_url = os.getenv('BENCH_DATABASE_URL')
+    if database_url is None:
+        handle, path = tempfile.mkstemp(prefix='bench-', suffix='.db')
+        os.close(handle)
+        atexit.register(os.remove, path)
+        database_url = 'sqlite:///' + path
+    os.environ['DATABASE_URL'] = database_url
+    os.environ.setdefault('JWT_SECRET_KEY', 'benchmark secret key')
+    os.environ.setdefault('LIFECYCLE_INTERVAL', '0')  # No background writes to the trips while measuring
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')  # The log line of every request would mix with the results
+    sys.path.insert(0, os.path.abspath(SRC_DIR))
+    from app import app
+    from api.models import db
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+    return app
+
+
+def seed_trips(count, host_count=100, **options):
+    """ Inserts host_count users and count trips (see api/seed.py), must run inside an app context """
+    from api.seed import DatasetGenerator
+    options.setdefault('travelers_per_trip', 0)
+    options.setdefault('favorites_per_user', 0)
+    options.setdefault('notifications_per_user', 0)
+    return DatasetGenerator(users=host_count, trips=count, **options).run()
+
+
+def best_of(function, repeat=5):
+    """ Runs function `repeat` times and returns the fastest wall time in seconds """
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def print_table(title, rows, headers):
+    print(f'\n{title}')
+    widths = [max(len(str(value)) for value in column) for column in zip(headers, *rows)]
+    for row in [headers] + list(rows):
+        print('  '.join(str(value).ljust(width) for value, width in zip(row, widths)))
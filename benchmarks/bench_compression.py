@@ -0,0 +1,66 @@
+"""
+CPU cost against bytes saved of the response compression (api/compression.py) on the real
+payloads of the API: a page of GET /api/trips, the whole GET /api/users and the NDJSON export
+of GET /api/trips?stream=1 compressed chunk by chunk. gzip is always measured, br and zstd
+when the brotli and zstandard packages are installed.
+
+    $ python benchmarks/bench_compression.py [users] [trips]
+"""
+import os
+import sys
+from _common import load_app, seed_trips, best_of, print_table
+
+
+LEVELS = {'gzip': (1, 6, 9), 'br': (1, 4, 11), 'zstd': (1, 3, 19)}
+
+
+def main(users=2000, trips=10000):
+    os.environ['RATE_LIMIT_ENABLED'] = '0'
+    app = load_app()
+    from api.compression import compressor, CODINGS, DEFAULT_LEVELS
+
+    with app.app_context():
+        seed_trips(trips, host_count=users)
+    client = app.test_client()
+    identity = {'Accept-Encoding': 'identity'}
+    payloads = [('GET /api/trips?limit=100', client.get('/api/trips?limit=100', headers=identity).get_data()),
+                ('GET /api/users', client.get('/api/users', headers=identity).get_data())]
+    export = client.get('/api/trips?stream=1', headers=identity)
+    chunks = list(export.response)
+    payloads.append(('GET /api/trips?stream=1 (chunks)', b''.join(chunks)))
+
+    codings = [coding(level) for name, (coding, available) in CODINGS.items() if available()
+               for level in LEVELS[name]]
+    rows = []
+    for title, body in payloads:
+        streamed = title.endswith('(chunks)')
+        for coding in codings:
+            if streamed:
+                def run():
+                    return b''.join(coding.stream(iter(chunks)))
+            else:
+                def run():
+                    return coding.compress(body)
+            size = len(run())
+            seconds = best_of(run)
+            default = ' (default)' if coding.level == DEFAULT_LEVELS[coding.name] else ''
+            rows.append((title, f'{coding.name} {coding.level}{default}', f'{len(body) / 1024:.0f} KB',
+                         f'{size / 1024:.1f} KB', f'{size / len(body):.1%}', f'{seconds * 1000:.2f} ms',
+                         f'{len(body) / seconds / 2 ** 20:.0f} MB/s',
+                         f'{(len(body) - size) / 1024 / (seconds * 1000):.0f} KB/ms'))
+    print_table(f'{users} users, {trips} trips (Accept-Encoding decides the coding, levels in COMPRESS_LEVEL_*)',
+                rows, ('payload', 'coding', 'original', 'compressed', 'ratio', 'cpu', 'speed', 'saved per cpu ms'))
+
+    # Whole request through Flask, default levels
+    accept = {'Accept-Encoding': ', '.join(coding.name for coding in compressor.codings)}
+    plain = best_of(lambda: client.get('/api/users', headers=identity), repeat=10)
+    compressed = best_of(lambda: client.get('/api/users', headers=accept), repeat=10)
+    response = client.get('/api/users', headers=accept)
+    print_table('GET /api/users through the app', [
+        ('identity', f'{plain * 1000:.2f} ms', len(payloads[1][1])),
+        (response.headers.get('Content-Encoding'), f'{compressed * 1000:.2f} ms', len(response.get_data()))],
+        ('coding', 'best of 10', 'bytes sent'))
+
+
+if __name__ == '__main__':
+    main(*(int(value) for value in sys.argv[1:3]))
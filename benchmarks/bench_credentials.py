@@ -0,0 +1,54 @@
+"""
+Logins per second per core for every available password hasher and cost setting.
+Use it to pick PASSWORD_HASHER / PASSWORD_HASH_COST: a login costs one verification.
+
+    $ python benchmarks/bench_credentials.py
+"""
+import time
+from _common import load_app, print_table
+
+
+COSTS = {'scrypt': (12, 13, 14, 15, 16), 'bcrypt': (10, 11, 12, 13, 14), 'argon2': (1, 2, 3, 4)}
+
+
+def logins_per_second(hasher, minimum_time=1.0):
+    encoded = hasher.hash('correct horse battery staple')
+    count = 0
+    started = time.perf_counter()
+    while time.perf_counter() - started < minimum_time or count < 3:
+        hasher.verify('correct horse battery staple', encoded)
+        count += 1
+    return count / (time.perf_counter() - started)
+
+
+def main():
+    app = load_app()
+    from api.credentials import HASHERS
+
+    rows = []
+    with app.app_context():
+        for name, costs in COSTS.items():
+            for cost in costs:
+                try:
+                    hasher = HASHERS[name](cost)
+                except RuntimeError as error:
+                    rows.append((name, cost, '-', str(error)))
+                    break
+                rate = logins_per_second(hasher)
+                rows.append((name, cost, f'{1000 / rate:.1f} ms', f'{rate:.1f}'))
+
+        # End to end: POST /api/login with the configured hasher, includes the rehash-free path
+        client = app.test_client()
+        client.post('/api/register', json={'email': 'bench@bench.com', 'password': 'secret'})
+        count = 20
+        started = time.perf_counter()
+        for _ in range(count):
+            client.post('/api/login', json={'email': 'bench@bench.com', 'password': 'secret'})
+        elapsed = time.perf_counter() - started
+        rows.append(('POST /api/login', 'configured', f'{elapsed * 1000 / count:.1f} ms', f'{count / elapsed:.1f}'))
+
+    print_table('Password verification, single thread', rows, ('hasher', 'cost', 'per login', 'logins/s/core'))
+
+
+if __name__ == '__main__':
+    main()
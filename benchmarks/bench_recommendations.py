@@ -0,0 +1,58 @@
+"""
+Measures the recommendations: build of the candidate matrix, scoring + top-k for users with
+and without favorites, an incremental refresh after trip changes, and the whole endpoint.
+
+    $ python benchmarks/bench_recommendations.py [trips]
+"""
+import random
+import sys
+import time
+from _common import load_app, seed_trips, best_of, print_table
+
+
+def main(trips=140000):
+    app = load_app()
+    from flask import current_app
+    from flask_jwt_extended import create_access_token
+    from api.models import db, Trips
+    from api.recommendations import candidate_matrix, user_profile
+    from api.signals import trip_changed
+
+    with app.app_context():
+        seed_trips(trips, host_count=5000, favorites_per_user=5, travelers_per_trip=2)
+        started = time.perf_counter()
+        candidate_matrix.ensure_ready()
+        build = time.perf_counter() - started
+        open_trips = int(candidate_matrix.arrays['alive'][:candidate_matrix.size].sum())
+
+        rng = random.Random(1)
+        profiles = [user_profile(user_id, {}) for user_id in rng.sample(range(1, 5001), 50)]
+        windowed = [user_profile(user_id, {'date_from': '2026-12-01', 'date_to': '2027-01-31', 'budget': '1500'})
+                    for user_id in rng.sample(range(1, 5001), 50)]
+
+        rows = []
+        for name, group in (('favorites profile', profiles), ('dates + budget', windowed)):
+            seconds = best_of(lambda: [candidate_matrix.top(profile, 10) for profile in group]) / len(group)
+            rows.append((f'top 10, {name}', f'{seconds * 1000:.2f} ms'))
+
+        changed = rng.sample(range(1, trips + 1), 1000)
+        db.session.execute(db.update(Trips).where(Trips.id.in_(changed)).values(available_seats=Trips.available_seats + 1)
+                           .execution_options(synchronize_session=False))
+        db.session.commit()
+        for trip_id in changed:
+            trip_changed.send(current_app._get_current_object(), trip_id=trip_id, change='updated')
+        started = time.perf_counter()
+        candidate_matrix.ensure_ready()
+        rows.append(('refresh 1000 changed trips', f'{(time.perf_counter() - started) * 1000:.1f} ms'))
+        token = create_access_token(identity='user1@test.com', additional_claims={'user_id': 1})
+
+    client = app.test_client()
+    headers = {'Authorization': 'Bearer ' + token}
+    seconds = best_of(lambda: client.get('/api/recommendations?limit=10', headers=headers), repeat=20)
+    rows.append(('GET /api/recommendations', f'{seconds * 1000:.2f} ms'))
+
+    print_table(f'{open_trips} open trips of {trips}, matrix built in {build:.2f}s', rows, ('operation', 'time'))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 140000)
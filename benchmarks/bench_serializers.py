@@ -0,0 +1,45 @@
+"""
+Compares the ORM serialize() path against the column projected Schema serializers.
+
+    $ python benchmarks/bench_serializers.py [rows]
+"""
+import json
+import sys
+from _common import load_app, seed_trips, best_of, print_table
+
+
+def main(rows=10000):
+    app = load_app()
+    from api.models import db, Trips
+    from api.serializers import dumps, orjson
+
+    with app.app_context():
+        seed_trips(rows)
+
+        def orm_serialize():
+            db.session.expire_all()
+            trips = Trips.query.all()
+            json.dumps([trip.serialize() for trip in trips])
+
+        def projected_all_fields():
+            rows = db.session.execute(db.select(*Trips.schema.columns()))
+            dumps(Trips.schema.dump_rows(rows))
+
+        fields = ('id', 'destination', 'start_date')
+
+        def projected_three_fields():
+            rows = db.session.execute(db.select(*Trips.schema.columns(fields)))
+            dumps(Trips.schema.dump_rows(rows, fields))
+
+        baseline = best_of(orm_serialize)
+        results = [('Model.serialize() + json', baseline)]
+        results.append(('Schema, all fields', best_of(projected_all_fields)))
+        results.append(('Schema, ?fields=' + ','.join(fields), best_of(projected_three_fields)))
+
+    print_table(f'{rows} trips, JSON backend: {"orjson" if orjson else "json"}',
+                [(name, f'{seconds * 1000:.1f} ms', f'{baseline / seconds:.2f}x') for name, seconds in results],
+                ('path', 'best of 5', 'speedup'))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
@@ -0,0 +1,63 @@
+"""
+Compares the text search of GET /api/trips/search against the full scan it replaces
+(download every trip and filter the text in the browser, here in Python) and a LIKE '%text%'
+scan in SQL. Without BENCH_DATABASE_URL it measures the in memory index used with SQLite.
+
+    $ python benchmarks/bench_text_search.py [trips]
+"""
+import sys
+import time
+from _common import load_app, seed_trips, best_of, print_table
+
+
+QUERIES = ('madrid', 'barcelna', 'buceo cusco', 'ciudad mexico', 'playa bali', 'viaje')
+
+
+def main(trips=100000):
+    app = load_app()
+    from api.models import db, Trips
+    from api.text_search import text_index, text_search, tokenize
+
+    with app.app_context():
+        seed_trips(trips, host_count=1000)
+        dialect = db.session.get_bind().dialect.name
+
+        started = time.perf_counter()
+        if dialect != 'postgresql':
+            text_index.ensure_ready()
+        build = time.perf_counter() - started
+
+        rows = []
+        for query in QUERIES:
+            words = tokenize(query)
+
+            def full_scan():
+                trips_found = []
+                for trip_id, destination, description in db.session.execute(
+                        db.select(Trips.id, Trips.destination, Trips.description)):
+                    text = ' '.join(tokenize(f'{destination} {description}'))
+                    if all(word in text for word in words):
+                        trips_found.append(trip_id)
+                return trips_found
+
+            def like_scan():
+                conditions = [db.or_(db.func.lower(Trips.destination).like(f'%{word}%'),
+                                     db.func.lower(Trips.description).like(f'%{word}%')) for word in words]
+                return db.session.execute(db.select(Trips.id).where(*conditions).order_by(Trips.id).limit(21)).all()
+
+            def search():
+                return text_search({'q': query})
+
+            found, _ = search()
+            baseline = best_of(full_scan, repeat=3)
+            like = best_of(like_scan, repeat=3)
+            indexed = best_of(search)
+            rows.append((query, len(full_scan()), len(found), f'{baseline * 1000:.1f} ms', f'{like * 1000:.1f} ms',
+                         f'{indexed * 1000:.2f} ms', f'{baseline / indexed:.0f}x'))
+
+    print_table(f'{trips} trips on {dialect}, index built in {build:.2f}s',
+                rows, ('q', 'scan matches', 'page', 'full scan', "LIKE '%q%'", 'search', 'speedup'))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,89 @@
+"""
+Throughput of the bulk trip endpoints against the single-item ones, through the Flask test client:
+N trips created with N POST /api/trips against POST /api/trips/batch in chunks of up to 500, and
+N trips edited with N PUT /api/trips/<id> against PATCH /api/trips/batch.
+On SQLite every single request pays its own commit (fsync); set BENCH_DATABASE_URL to compare
+against PostgreSQL, where the batch also saves the round trips.
+
+    $ python benchmarks/bench_trip_batch.py [trips]
+"""
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+from _common import load_app, seed_trips, print_table
+
+
+def trip(index, start):
+    begin = start + timedelta(days=index % 300)
+    return {'destination': f'Destino {index % 40}', 'start_date': begin.strftime('%Y-%m-%d'),
+            'end_date': (begin + timedelta(days=7)).strftime('%Y-%m-%d'), 'available_seats': 6,
+            'description': 'Viaje del benchmark', 'budget': 500 + index % 1000, 'budget_currency': 'EUR',
+            'age_min': 18, 'age_max': 60}
+
+
+def timed(function):
+    started = time.perf_counter()
+    function()
+    return time.perf_counter() - started
+
+
+def main(count=2000):
+    os.environ['RATE_LIMIT_ENABLED'] = '0'
+    app = load_app()
+    from flask_jwt_extended import create_access_token
+    from api.models import db, Users, Trips
+    from api.trip_batch import MAX_BATCH_SIZE
+    with app.app_context():
+        seed_trips(0, host_count=1)
+        host_id, email = db.session.execute(db.select(Users.id, Users.email)).first()
+        token = create_access_token(identity=email, additional_claims={'user_id': host_id})
+    client = app.test_client()
+    headers = {'Authorization': f'Bearer {token}'}
+    start = datetime.utcnow() + timedelta(days=30)
+    items = [trip(index, start) for index in range(count)]
+    chunks = [items[index:index + MAX_BATCH_SIZE] for index in range(0, count, MAX_BATCH_SIZE)]
+
+    def single_create():
+        for item in items:
+            assert client.post('/api/trips', json=dict(item, host_id=host_id)).status_code == 200
+
+    created = []
+
+    def batch_create():
+        for chunk in chunks:
+            response = client.post('/api/trips/batch', json={'trips': chunk}, headers=headers)
+            assert response.status_code == 200, response.json
+            created.extend(result['id'] for result in response.json['results'])
+
+    timings = {'N x POST /api/trips': timed(single_create), 'POST /api/trips/batch': timed(batch_create)}
+
+    def single_edit():
+        for index, trip_id in enumerate(created):
+            response = client.put(f'/api/trips/{trip_id}', json={'budget': index, 'status': 'ongoing'}, headers=headers)
+            assert response.status_code == 200, response.json
+
+    def batch_edit():
+        changes = [{'id': trip_id, 'budget': index + 1, 'status': 'planning'} for index, trip_id in enumerate(created)]
+        for offset in range(0, len(changes), MAX_BATCH_SIZE):
+            response = client.patch('/api/trips/batch', json={'trips': changes[offset:offset + MAX_BATCH_SIZE]},
+                                    headers=headers)
+            assert response.status_code == 200, response.json
+
+    timings['N x PUT /api/trips/<id>'] = timed(single_edit)
+    timings['PATCH /api/trips/batch'] = timed(batch_edit)
+    with app.app_context():
+        assert db.session.execute(db.select(db.func.count(Trips.id))).scalar() == 2 * count
+
+    results = []
+    for single, batch in (('N x POST /api/trips', 'POST /api/trips/batch'),
+                          ('N x PUT /api/trips/<id>', 'PATCH /api/trips/batch')):
+        for name in (single, batch):
+            results.append((name, f'{timings[name]:.2f} s', f'{count / timings[name]:,.0f}',
+                            f'{timings[single] / timings[name]:.1f}x'))
+    print_table(f'{count} trips, {app.config["SQLALCHEMY_DATABASE_URI"].split(":")[0]}', results,
+                ('endpoint', 'time', 'trips/s', 'speedup'))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
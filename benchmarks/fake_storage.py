@@ -0,0 +1,110 @@
+"""
+Local stand-in of the photo storage (STORAGE_URL): PUT /<key> writes the body to a directory,
+with Content-Length or chunked, without keeping it in memory; GET /<key> returns it. --delay
+waits that many seconds before answering a PUT, like a slow storage.
+
+    $ python benchmarks/fake_storage.py [--port 9000] [--directory /tmp/fake-storage] [--delay 0]
+    $ STORAGE_URL=http://localhost:9000 pipenv run start
+
+start_server() runs it in a thread of another script and returns the server and its URL.
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+CHUNK_SIZE = 64 * 1024
+
+
+class StorageHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # Keep-alive, the client of the API reuses connections
+    directory = None
+    delay = 0
+
+    def _path(self):
+        key = self.path.split('?')[0].lstrip('/')
+        path = os.path.realpath(os.path.join(self.directory, key))
+        return path if key and path.startswith(os.path.realpath(self.directory) + os.sep) else None
+
+    def _chunks(self):
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            while True:
+                size = int(self.rfile.readline().split(b';')[0].strip(), 16)
+                if size == 0:
+                    self.rfile.readline()
+                    return
+                yield self.rfile.read(size)
+                self.rfile.readline()
+        remaining = int(self.headers.get('Content-Length', 0))
+        while remaining:
+            chunk = self.rfile.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                return
+            remaining -= len(chunk)
+            yield chunk
+
+    def _answer(self, status, body=b'', content_type='text/plain'):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_PUT(self):
+        path = self._path()
+        if path is None:
+            return self._answer(400, b'Invalid key')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        size = 0
+        with open(path, 'wb') as file:
+            for chunk in self._chunks():
+                file.write(chunk)
+                size += len(chunk)
+        if self.delay:
+            time.sleep(self.delay)
+        self._answer(201, f'{size}'.encode())
+
+    def do_GET(self):
+        path = self._path()
+        if path is None or not os.path.isfile(path):
+            return self._answer(404, b'Not found')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(os.path.getsize(path)))
+        self.end_headers()
+        with open(path, 'rb') as file:
+            shutil.copyfileobj(file, self.wfile, CHUNK_SIZE)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server(directory=None, port=0, delay=0):
+    """ Starts the server in a daemon thread, returns (server, base URL) """
+    handler = type('Handler', (StorageHandler,), {'directory': directory or tempfile.mkdtemp(prefix='fake-storage-'),
+                                                  'delay': delay})
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fake object storage for STORAGE_URL')
+    parser.add_argument('--port', type=int, default=9000)
+    parser.add_argument('--directory', default=os.path.join(tempfile.gettempdir(), 'fake-storage'))
+    parser.add_argument('--delay', type=float, default=0, help='Seconds to wait before answering a PUT')
+    args = parser.parse_args()
+    server, url = start_server(args.directory, args.port, args.delay)
+    print(f'Fake storage on {url}, files in {args.directory}')
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,427 @@
+"""
+Load test of the /api endpoints: seeds a dataset (api/seed.py), sends --requests requests to
+every endpoint from --concurrency threads, one endpoint after the other, and reports the
+throughput and the p50/p95/p99 latency of each one. Results can be saved as JSON and compared
+with a previous run: an endpoint whose p95 grew more than --threshold (and more than 2 ms) is a
+regression and the script exits with status 1, so it can run in CI.
+
+    $ python benchmarks/load_test.py --users 1000 --trips 5000 --output baseline.json
+    ... change the code ...
+    $ python benchmarks/load_test.py --users 1000 --trips 5000 --baseline baseline.json
+
+By default the requests go through the Flask test client in this process (no server, no
+network). With --url http://localhost:3001 they go over HTTP to a running server, which has to
+use the same database (BENCH_DATABASE_URL), JWT_SECRET_KEY and METRICS_TOKEN (the /api/_health/*
+endpoints) as this script. The rate limiter
+is disabled, it would answer 429 long before the database or the CPU are the limit.
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+from _common import load_app, print_table
+
+
+MIN_REGRESSION_MS = 2.0  # Differences below this are noise of the machine
+SCENARIOS = []
+
+
+def scenario(name, expected=(200,), share=1.0):
+    """ Registers a function (dataset, rng) → (method, path, options of the request). share scales
+    --requests for that endpoint, password hashing makes register and login much slower """
+    def decorator(function):
+        SCENARIOS.append((name, function, expected, share))
+        return function
+    return decorator
+
+
+class Dataset:
+    """ Ids of the seeded rows and the tokens of a pool of users, shared by the threads """
+
+    def __init__(self, app, token_users=500):
+        from api.models import db, Users, Trips
+        self.app = app
+        with app.app_context():
+            self.user_ids = db.session.execute(db.select(Users.id).where(Users.is_active.is_(True))
+                                               .order_by(Users.id).limit(token_users)).scalars().all()
+            # Hosts that can authenticate, approvals of a deactivated host would answer 401
+            self.planning = db.session.execute(db.select(Trips.id, Trips.host_id).join(Users, Users.id == Trips.host_id)
+                                               .where(Trips.status == 'planning', Users.is_active.is_(True))).all()
+            self.trip_ids = db.session.execute(db.select(Trips.id)).scalars().all()
+            self.next_trip_id = itertools.count(db.session.execute(db.select(db.func.max(Trips.id))).scalar() + 1)
+        self.next_email = itertools.count(1)
+        self.monitoring = {'Authorization': f'Bearer {app.config["METRICS_TOKEN"]}'}
+        self.created = []  # (trip_id, host_id) of POST /api/trips, removed by DELETE /api/trips/<id>
+        self.joined = []  # (trip_id, host_id, user_id) of POST /join, approved by /travelers/approve
+        self._tokens = {}
+        self._lock = threading.Lock()
+
+    def token(self, user_id, fresh=False):
+        from flask_jwt_extended import create_access_token
+        with self._lock:
+            if fresh or user_id not in self._tokens:
+                with self.app.app_context():
+                    token = create_access_token(identity=f'user{user_id}@test.com', additional_claims={'user_id': user_id})
+                if fresh:
+                    return token
+                self._tokens[user_id] = token
+            return self._tokens[user_id]
+
+    def auth(self, user_id, fresh=False):
+        return {'Authorization': 'Bearer ' + self.token(user_id, fresh)}
+
+    def user(self, rng):
+        user_id = rng.choice(self.user_ids)
+        return user_id, self.auth(user_id)
+
+
+@scenario('GET /api/hello')
+def hello(data, rng):
+    return 'GET', '/api/hello', {}
+
+
+@scenario('GET /api/_health/db')
+def health_db(data, rng):
+    return 'GET', '/api/_health/db', {'headers': data.monitoring}
+
+
+@scenario('GET /api/_health/notifications')
+def health_notifications(data, rng):
+    return 'GET', '/api/_health/notifications', {'headers': data.monitoring}
+
+
+@scenario('POST /api/register', share=0.25)
+def register(data, rng):
+    return 'POST', '/api/register', {'json': {'email': f'load{next(data.next_email)}-{time.time_ns()}@test.com',
+                                              'password': '123456'}}
+
+
+@scenario('POST /api/login', share=0.25)
+def login(data, rng):
+    return 'POST', '/api/login', {'json': {'email': f'user{rng.choice(data.user_ids)}@test.com', 'password': '123456'}}
+
+
+@scenario('GET /api/users', share=0.25)
+def users(data, rng):
+    return 'GET', '/api/users', {}
+
+
+@scenario('GET /api/users/<id>')
+def user_detail(data, rng):
+    return 'GET', f'/api/users/{rng.choice(data.user_ids)}', {}
+
+
+@scenario('PUT /api/users')
+def edit_user(data, rng):
+    user_id, headers = data.user(rng)
+    return 'PUT', '/api/users', {'json': {'biography': f'Biografía {rng.random()}'}, 'headers': headers}
+
+
+@scenario('GET /api/trips')
+def trips(data, rng):
+    from api.seed import DESTINATIONS
+    query = rng.choice(('limit=20', 'limit=100', 'status=planning&limit=20', f'destination={rng.choice(DESTINATIONS)}',
+                        'budget_min=500&budget_max=1500&fields=id,destination,budget'))
+    return 'GET', f'/api/trips?{query}', {}
+
+
+@scenario('GET /api/trips (token)')
+def trips_with_token(data, rng):
+    user_id, headers = data.user(rng)
+    return 'GET', '/api/trips?status=planning&limit=20', {'headers': headers}
+
+
+@scenario('GET /api/trips/<id>', expected=(200, 404))
+def trip_detail(data, rng):
+    return 'GET', f'/api/trips/{rng.choice(data.trip_ids)}?expand=host,travelers_count,favorites_count', {}
+
+
+@scenario('GET /api/trips/search')
+def trip_search(data, rng):
+    from api.seed import DESTINATIONS, ACTIVITIES
+    return 'GET', '/api/trips/search', {'query_string': {'q': f'{rng.choice(DESTINATIONS)} {rng.choice(ACTIVITIES)}'}}
+
+
+@scenario('POST /api/trips')
+def create_trip(data, rng):
+    from api.seed import DESTINATIONS
+    trip_id, host_id = next(data.next_trip_id), rng.choice(data.user_ids)
+    start = datetime.utcnow() + timedelta(days=rng.randint(10, 300))
+    data.created.append((trip_id, host_id))
+    return 'POST', '/api/trips', {'json': {
+        'id': trip_id, 'destination': rng.choice(DESTINATIONS), 'start_date': start.strftime('%Y-%m-%d'),
+        'end_date': (start + timedelta(days=7)).strftime('%Y-%m-%d'), 'available_seats': 6,
+        'description': 'Viaje de la prueba de carga', 'budget': 900, 'budget_currency': 'EUR',
+        'age_min': 18, 'age_max': 60, 'status': 'planning', 'host_id': host_id}}
+
+
+@scenario('PUT /api/trips/<id>')
+def edit_trip(data, rng):
+    trip_id, host_id = rng.choice(data.created)
+    return 'PUT', f'/api/trips/{trip_id}', {'json': {'budget': rng.randint(300, 3000), 'available_seats': rng.randint(2, 8)},
+                                            'headers': data.auth(host_id)}
+
+
+@scenario('PUT /api/trips/<id>/status')
+def trip_status(data, rng):
+    trip_id, host_id = rng.choice(data.created)
+    return 'PUT', f'/api/trips/{trip_id}/status', {'json': {'status': rng.choice(('planning', 'ongoing'))},
+                                                  'headers': data.auth(host_id)}
+
+
+@scenario('POST /api/trips/<id>/join', expected=(200, 201, 409))
+def join(data, rng):
+    trip_id, host_id = rng.choice(data.planning)
+    user_id = rng.choice([user_id for user_id in rng.sample(data.user_ids, 2) if user_id != host_id])
+    data.joined.append((trip_id, host_id, user_id))
+    return 'POST', f'/api/trips/{trip_id}/join', {'headers': data.auth(user_id)}
+
+
+@scenario('POST /api/trips/<id>/travelers/approve')
+def approve(data, rng):
+    trip_id, host_id, user_id = data.joined.pop() if data.joined else (*rng.choice(data.planning), 0)
+    return 'POST', f'/api/trips/{trip_id}/travelers/approve', {'json': {'traveler_ids': [user_id]},
+                                                               'headers': data.auth(host_id)}
+
+
+@scenario('PUT /api/trips/<id>/favorite', expected=(200, 201))
+def add_favorite(data, rng):
+    user_id, headers = data.user(rng)
+    return 'PUT', f'/api/trips/{rng.choice(data.trip_ids)}/favorite', {'headers': headers}
+
+
+@scenario('DELETE /api/trips/<id>/favorite')
+def remove_favorite(data, rng):
+    user_id, headers = data.user(rng)
+    return 'DELETE', f'/api/trips/{rng.choice(data.trip_ids)}/favorite', {'headers': headers}
+
+
+@scenario('GET /api/favorites/lookup')
+def favorites_lookup(data, rng):
+    user_id, headers = data.user(rng)
+    trip_ids = ','.join(str(trip_id) for trip_id in rng.sample(data.trip_ids, min(20, len(data.trip_ids))))
+    return 'GET', f'/api/favorites/lookup?trip_ids={trip_ids}', {'headers': headers}
+
+
+@scenario('GET /api/recommendations')
+def recommendations(data, rng):
+    user_id, headers = data.user(rng)
+    return 'GET', '/api/recommendations?limit=10', {'headers': headers}
+
+
+@scenario('GET /api/notifications')
+def notifications(data, rng):
+    user_id, headers = data.user(rng)
+    return 'GET', '/api/notifications?limit=20', {'headers': headers}
+
+
+@scenario('GET /api/notifications/unread-count')
+def unread_count(data, rng):
+    user_id, headers = data.user(rng)
+    return 'GET', '/api/notifications/unread-count', {'headers': headers}
+
+
+@scenario('PUT /api/notifications/read')
+def read_notifications(data, rng):
+    user_id, headers = data.user(rng)
+    return 'PUT', '/api/notifications/read', {'json': {'ids': [rng.randint(1, 1000)]}, 'headers': headers}
+
+
+@scenario('POST /api/notifications/read-all')
+def read_all(data, rng):
+    user_id, headers = data.user(rng)
+    return 'POST', '/api/notifications/read-all', {'headers': headers}
+
+
+@scenario('DELETE /api/trips/<id>')
+def delete_trip(data, rng):
+    trip_id, host_id = data.created.pop()
+    return 'DELETE', f'/api/trips/{trip_id}', {'headers': data.auth(host_id)}
+
+
+@scenario('POST /api/logout')
+def logout(data, rng):
+    return 'POST', '/api/logout', {'headers': data.auth(rng.choice(data.user_ids), fresh=True)}
+
+
+class TestClientTarget:
+    def __init__(self, app):
+        self.app = app
+
+    def session(self):
+        return self.app.test_client()
+
+    def send(self, client, method, path, options):
+        return client.open(path, method=method, **options).status_code
+
+
+class HTTPTarget:
+    def __init__(self, url):
+        self.url = url.rstrip('/')
+
+    def session(self):
+        import requests
+        return requests.Session()
+
+    def send(self, session, method, path, options):
+        options = dict(options)
+        if 'query_string' in options:
+            options['params'] = options.pop('query_string')
+        return session.request(method, self.url + path, **options).status_code
+
+
+def percentile(ordered, fraction):
+    """ Nearest rank percentile of a sorted list """
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, max(0, round(fraction * len(ordered) + 0.5) - 1))]
+
+
+def run_scenario(target, data, function, expected, requests, concurrency, seed):
+    latencies = []
+    errors = []
+    per_thread = [requests // concurrency + (1 if number < requests % concurrency else 0)
+                  for number in range(concurrency)]
+
+    def worker(number):
+        rng = random.Random(seed * 1000 + number)
+        session = target.session()
+        own = []
+        for _ in range(per_thread[number]):
+            method, path, options = function(data, rng)  # Building the request (tokens...) is not measured
+            started = time.perf_counter()
+            try:
+                status = target.send(session, method, path, options)
+            except Exception as error:
+                status = type(error).__name__
+            own.append(time.perf_counter() - started)
+            if status not in expected:
+                errors.append(status)
+        latencies.extend(own)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(number,)) for number in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {'requests': len(latencies), 'errors': len(errors),
+            'error_statuses': sorted({str(status) for status in errors}),
+            'throughput': round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+            'mean_ms': round(sum(latencies) / len(latencies) * 1000, 3) if latencies else 0.0,
+            'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+            'p95_ms': round(percentile(latencies, 0.95) * 1000, 3),
+            'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+            'max_ms': round(latencies[-1] * 1000, 3) if latencies else 0.0}
+
+
+def compare(results, baseline, threshold):
+    """ Returns the table rows of the comparison and the names of the endpoints that regressed """
+    rows, regressions = [], []
+    for name, current in results['endpoints'].items():
+        previous = baseline['endpoints'].get(name)
+        if previous is None:
+            rows.append((name, '-', f'{current["p95_ms"]:.2f}', '-', 'new'))
+            continue
+        change = (current['p95_ms'] - previous['p95_ms']) / previous['p95_ms'] if previous['p95_ms'] else 0.0
+        regressed = ((change > threshold and current['p95_ms'] - previous['p95_ms'] > MIN_REGRESSION_MS)
+                     or current['errors'] > previous['errors'])
+        if regressed:
+            regressions.append(name)
+        rows.append((name, f'{previous["p95_ms"]:.2f}', f'{current["p95_ms"]:.2f}', f'{change:+.0%}',
+                     'REGRESSION' if regressed else 'ok'))
+    return rows, regressions
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0],
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=1000, help='Users of the seeded dataset')
+    parser.add_argument('--trips', type=int, default=5000, help='Trips of the seeded dataset')
+    parser.add_argument('--requests', type=int, default=200, help='Requests per endpoint')
+    parser.add_argument('--concurrency', type=int, default=4, help='Threads sending requests')
+    parser.add_argument('--warmup', type=int, default=5, help='Unmeasured requests per GET endpoint first')
+    parser.add_argument('--only', help='Comma separated substrings of the endpoints to run, e.g. trips,login')
+    parser.add_argument('--url', help='Base URL of a running server instead of the test client')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='Save the results to this JSON file')
+    parser.add_argument('--baseline', help='JSON of a previous run to compare with')
+    parser.add_argument('--threshold', type=float, default=0.25, help='Allowed growth of p95 (0.25 = 25%%)')
+    args = parser.parse_args()
+
+    os.environ['RATE_LIMIT_ENABLED'] = '0'
+    os.environ.setdefault('METRICS_TOKEN', 'load-test')
+    app = load_app()
+    from api.models import db
+    from api.seed import DatasetGenerator
+    started = time.perf_counter()
+    with app.app_context():
+        DatasetGenerator(users=args.users, trips=args.trips, seed=args.seed).run()
+        dialect = db.engine.dialect.name
+    print(f'Seeded {args.users} users and {args.trips} trips in {time.perf_counter() - started:.1f}s ({dialect})')
+
+    data = Dataset(app)
+    target = HTTPTarget(args.url) if args.url else TestClientTarget(app)
+    selected = [item for item in SCENARIOS
+                if not args.only or any(part.strip() in item[0] for part in args.only.split(','))]
+    endpoints = {}
+    for number, (name, function, expected, share) in enumerate(selected):
+        rng = random.Random(args.seed + number)
+        # Only reads, building a write request already takes ids from the dataset
+        for _ in range(args.warmup if name.startswith('GET ') else 0):
+            target.send(target.session(), *function(data, rng))
+        requests = max(args.concurrency, int(args.requests * share))
+        endpoints[name] = run_scenario(target, data, function, expected, requests, args.concurrency,
+                                       args.seed + number)
+        result = endpoints[name]
+        print(f'{name}: {result["throughput"]:.0f} req/s, p95 {result["p95_ms"]:.2f} ms'
+              + (f', {result["errors"]} errors {result["error_statuses"]}' if result['errors'] else ''))
+
+    results = {'meta': {'date': datetime.utcnow().isoformat(timespec='seconds'), 'commit': git_commit(),
+                        'python': platform.python_version(), 'database': dialect,
+                        'target': args.url or 'test client', 'users': args.users, 'trips': args.trips,
+                        'requests': args.requests, 'concurrency': args.concurrency, 'seed': args.seed},
+               'endpoints': endpoints}
+    print_table(f'{args.users} users, {args.trips} trips, {args.concurrency} threads ({results["meta"]["target"]})',
+                [(name, result['requests'], result['errors'], f'{result["throughput"]:.0f}',
+                  f'{result["p50_ms"]:.2f}', f'{result["p95_ms"]:.2f}', f'{result["p99_ms"]:.2f}')
+                 for name, result in endpoints.items()],
+                ('endpoint', 'requests', 'errors', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms'))
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+        print(f'\nResults saved to {args.output}')
+
+    failed = any(result['errors'] for result in endpoints.values())
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        rows, regressions = compare(results, baseline, args.threshold)
+        print_table(f'p95 against {args.baseline} (commit {baseline["meta"].get("commit")}, '
+                    f'threshold {args.threshold:.0%})', rows, ('endpoint', 'baseline', 'now', 'change', ''))
+        if regressions:
+            print(f'\n{len(regressions)} endpoints regressed: {", ".join(regressions)}')
+            failed = True
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""
+Concurrency stress test of the seat reservations: many threads approve overlapping groups of
+pending travelers of the same trips at the same time. Checks that no trip is oversold and
+reports approvals per second.
+
+    $ python benchmarks/stress_seats.py [threads] [trips] [seats] [applicants]
+"""
+import random
+import sys
+import threading
+import time
+from _common import load_app
+
+
+def main(threads=16, trips=4, seats=25, applicants=200):
+    app = load_app()
+    from flask_jwt_extended import create_access_token
+    from api.models import db, Trips, Travelers
+    from api.seed import DatasetGenerator, insert_rows
+
+    with app.app_context():
+        DatasetGenerator(users=applicants + trips, trips=0, notifications_per_user=0).run()
+        now = DatasetGenerator().now
+        insert_rows(Trips, ({'id': trip_id, 'destination': 'Stress', 'start_date': now, 'end_date': now,
+                             'available_seats': seats, 'description': 'stress test', 'budget': 100,
+                             'budget_currency': 'EUR', 'age_min': 18, 'age_max': 99, 'status': 'planning',
+                             'host_id': trip_id} for trip_id in range(1, trips + 1)))
+        applicant_ids = list(range(trips + 1, trips + applicants + 1))
+        insert_rows(Travelers, ({'trip_id': trip_id, 'traveler_id': user_id, 'status': 'pending', 'created_at': now}
+                                for trip_id in range(1, trips + 1) for user_id in applicant_ids))
+        tokens = {trip_id: create_access_token(identity=f'host{trip_id}', additional_claims={'user_id': trip_id})
+                  for trip_id in range(1, trips + 1)}
+
+    errors = []
+    approvals = []
+
+    def worker(number):
+        rng = random.Random(number)
+        client = app.test_client()
+        for _ in range(applicants // 10):
+            trip_id = rng.randint(1, trips)
+            group = rng.sample(applicant_ids, 10)
+            response = client.post(f'/api/trips/{trip_id}/travelers/approve', json={'traveler_ids': group},
+                                   headers={'Authorization': 'Bearer ' + tokens[trip_id]})
+            if response.status_code != 200:
+                errors.append(response.status_code)
+                continue
+            approvals.extend(user_id for user_id, result in response.json['results'].items() if result == 'approved')
+
+    started = time.perf_counter()
+    pool = [threading.Thread(target=worker, args=(number,)) for number in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    oversold = False
+    with app.app_context():
+        for trip_id in range(1, trips + 1):
+            left = db.session.get(Trips, trip_id).available_seats
+            approved = db.session.execute(db.select(db.func.count(Travelers.id))
+                                          .where(Travelers.trip_id == trip_id, Travelers.status == 'approved')).scalar()
+            ok = left >= 0 and approved + left == seats
+            oversold = oversold or not ok
+            print(f'trip {trip_id}: {approved} approved, {left} seats left, {"ok" if ok else "OVERSOLD"}')
+    requests = threads * (applicants // 10)
+    print(f'{requests} approval requests from {threads} threads in {elapsed:.2f}s '
+          f'({requests / elapsed:.0f} requests/s, {len(approvals) / elapsed:.0f} approvals/s), {len(errors)} errors')
+    if oversold or len(approvals) > trips * seats:
+        sys.exit('Oversell detected')
+
+
+if __name__ == '__main__':
+    main(*(int(value) for value in sys.argv[1:]))
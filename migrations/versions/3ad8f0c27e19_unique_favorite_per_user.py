@@ -0,0 +1,31 @@
+"""unique favorite per user and trip
+
+Revision ID: 3ad8f0c27e19
+Revises: 9f2e6b1c8d45
+Create Date: 2026-10-18 13:02:16.552470
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '3ad8f0c27e19'
+down_revision = '9f2e6b1c8d45'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Remove repeated and incomplete favorites before adding the constraint
+    op.execute('DELETE FROM favorites WHERE user_id IS NULL OR trip_id IS NULL OR id NOT IN '
+               '(SELECT keep_id FROM (SELECT MIN(id) AS keep_id FROM favorites GROUP BY user_id, trip_id) AS oldest)')
+
+    with op.batch_alter_table('favorites', schema=None) as batch_op:
+        batch_op.create_unique_constraint('uq_favorites_user_trip', ['user_id', 'trip_id'])
+        batch_op.create_index('ix_favorites_trip_id', ['trip_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('favorites', schema=None) as batch_op:
+        batch_op.drop_index('ix_favorites_trip_id')
+        batch_op.drop_constraint('uq_favorites_user_trip', type_='unique')
@@ -0,0 +1,45 @@
+"""photo content hash of users and trips
+
+Revision ID: 4e6a2f9d1b37
+Revises: d27b4f81c6a3
+Create Date: 2026-10-18 19:02:11.518204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4e6a2f9d1b37'
+down_revision = 'd27b4f81c6a3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # GET /api/media/<hash>/<size> looks the photo up by its hash (api/media.py)
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('photo_hash', sa.String(length=64), nullable=True))
+        batch_op.create_index('ix_users_photo_hash', ['photo_hash'], unique=False)
+
+    with op.batch_alter_table('trips', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('photo_hash', sa.String(length=64), nullable=True))
+        batch_op.create_index('ix_trips_photo_hash', ['photo_hash'], unique=False)
+
+
+def downgrade():
+    # SQLite drops the column by copying the table, which loses the expression index of e8a79278984b
+    sqlite = op.get_bind().dialect.name == 'sqlite'
+    if sqlite:
+        op.drop_index('ix_trips_destination_lower', table_name='trips')
+
+    with op.batch_alter_table('trips', schema=None) as batch_op:
+        batch_op.drop_index('ix_trips_photo_hash')
+        batch_op.drop_column('photo_hash')
+
+    if sqlite:
+        op.create_index('ix_trips_destination_lower', 'trips', [sa.text('lower(destination)')], unique=False)
+
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.drop_index('ix_users_photo_hash')
+        batch_op.drop_column('photo_hash')
@@ -0,0 +1,43 @@
+"""trip text search indexes
+
+Revision ID: 7c5e1d3a9b20
+Revises: 3ad8f0c27e19
+Create Date: 2026-10-18 13:41:07.208315
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '7c5e1d3a9b20'
+down_revision = '3ad8f0c27e19'
+branch_labels = None
+depends_on = None
+
+
+# Same expression as api/text_search.py SEARCH_VECTOR
+SEARCH_VECTOR = ("setweight(to_tsvector('simple', trips_search_unaccent(coalesce(destination, ''))), 'A') || "
+                 "setweight(to_tsvector('simple', trips_search_unaccent(coalesce(description, ''))), 'B')")
+
+
+def upgrade():
+    # Only PostgreSQL, other databases use the index in memory of api/text_search.py
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute('CREATE EXTENSION IF NOT EXISTS unaccent')
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    # unaccent() is not IMMUTABLE and can't be used in an index, this wrapper with a fixed dictionary can
+    op.execute("CREATE OR REPLACE FUNCTION trips_search_unaccent(text) RETURNS text "
+               "LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT "
+               "AS $$ SELECT public.unaccent('public.unaccent'::regdictionary, $1) $$")
+    op.execute(f'CREATE INDEX ix_trips_search_vector ON trips USING gin (({SEARCH_VECTOR}))')
+    op.execute('CREATE INDEX ix_trips_destination_trgm ON trips '
+               'USING gin ((trips_search_unaccent(lower(destination))) gin_trgm_ops)')
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute('DROP INDEX IF EXISTS ix_trips_destination_trgm')
+    op.execute('DROP INDEX IF EXISTS ix_trips_search_vector')
+    op.execute('DROP FUNCTION IF EXISTS trips_search_unaccent(text)')
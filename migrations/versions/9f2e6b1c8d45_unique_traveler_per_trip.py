@@ -0,0 +1,29 @@
+"""unique traveler per trip
+
+Revision ID: 9f2e6b1c8d45
+Revises: c41d7a9e0b62
+Create Date: 2026-10-18 12:21:48.119734
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '9f2e6b1c8d45'
+down_revision = 'c41d7a9e0b62'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Keep the oldest request when a user applied more than once to the same trip
+    op.execute('DELETE FROM travelers WHERE id NOT IN '
+               '(SELECT keep_id FROM (SELECT MIN(id) AS keep_id FROM travelers GROUP BY trip_id, traveler_id) AS oldest)')
+
+    with op.batch_alter_table('travelers', schema=None) as batch_op:
+        batch_op.create_unique_constraint('uq_travelers_trip_traveler', ['trip_id', 'traveler_id'])
+
+
+def downgrade():
+    with op.batch_alter_table('travelers', schema=None) as batch_op:
+        batch_op.drop_constraint('uq_travelers_trip_traveler', type_='unique')
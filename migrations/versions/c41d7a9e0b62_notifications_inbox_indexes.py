@@ -0,0 +1,39 @@
+"""notifications inbox indexes and unread counter
+
+Revision ID: c41d7a9e0b62
+Revises: 5b0c3e2f91d7
+Create Date: 2026-10-18 11:37:05.840219
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c41d7a9e0b62'
+down_revision = '5b0c3e2f91d7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('unread_notifications', sa.Integer(), server_default='0', nullable=False))
+
+    with op.batch_alter_table('notifications', schema=None) as batch_op:
+        batch_op.create_index('ix_notifications_user_date_id', ['user_id', 'date', 'id'], unique=False)
+        batch_op.create_index('ix_notifications_unread', ['user_id', 'date', 'id'], unique=False,
+                              postgresql_where=sa.text('NOT read'), sqlite_where=sa.text('read = 0'))
+
+    # Start the counters from the existing rows
+    op.execute('UPDATE users SET unread_notifications = '
+               '(SELECT COUNT(*) FROM notifications WHERE notifications.user_id = users.id AND notifications.read = false)')
+
+
+def downgrade():
+    with op.batch_alter_table('notifications', schema=None) as batch_op:
+        batch_op.drop_index('ix_notifications_unread')
+        batch_op.drop_index('ix_notifications_user_date_id')
+
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.drop_column('unread_notifications')
@@ -0,0 +1,25 @@
+"""travelers by user index
+
+Revision ID: d27b4f81c6a3
+Revises: 7c5e1d3a9b20
+Create Date: 2026-10-18 15:31:44.870129
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'd27b4f81c6a3'
+down_revision = '7c5e1d3a9b20'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('travelers', schema=None) as batch_op:
+        batch_op.create_index('ix_travelers_traveler_id', ['traveler_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('travelers', schema=None) as batch_op:
+        batch_op.drop_index('ix_travelers_traveler_id')
@@ -0,0 +1,44 @@
+"""add trip search indexes
+
+Revision ID: e8a79278984b
+Revises: e8add0c5d448
+Create Date: 2026-10-18 09:12:31.514203
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e8a79278984b'
+down_revision = 'e8add0c5d448'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('trips', schema=None) as batch_op:
+        batch_op.create_index('ix_trips_start_date_id', ['start_date', 'id'], unique=False)
+        batch_op.create_index('ix_trips_status_start_date_id', ['status', 'start_date', 'id'], unique=False)
+        batch_op.create_index('ix_trips_budget', ['budget'], unique=False)
+        batch_op.create_index('ix_trips_age_band', ['age_min', 'age_max'], unique=False)
+        batch_op.create_index('ix_trips_available_seats', ['available_seats'], unique=False)
+        batch_op.create_index('ix_trips_host_id', ['host_id'], unique=False)
+
+    # varchar_pattern_ops lets PostgreSQL use the index for LIKE 'prefix%' with any collation
+    if op.get_bind().dialect.name == 'postgresql':
+        op.create_index('ix_trips_destination_lower', 'trips', [sa.text('lower(destination) varchar_pattern_ops')], unique=False)
+    else:
+        op.create_index('ix_trips_destination_lower', 'trips', [sa.text('lower(destination)')], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_trips_destination_lower', table_name='trips')
+
+    with op.batch_alter_table('trips', schema=None) as batch_op:
+        batch_op.drop_index('ix_trips_host_id')
+        batch_op.drop_index('ix_trips_available_seats')
+        batch_op.drop_index('ix_trips_age_band')
+        batch_op.drop_index('ix_trips_budget')
+        batch_op.drop_index('ix_trips_status_start_date_id')
+        batch_op.drop_index('ix_trips_start_date_id')
@@ -0,0 +1,198 @@
+"""
+Authentication layer around JWTManager.
+
+Every @jwt_required request resolves the principal of the token (id, email, is_admin,
+is_active of the user). The principal is cached per token jti for AUTH_PRINCIPAL_TTL seconds,
+so authenticated requests don't read the users table; edits of the user bump a generation that
+makes its cached principals stale at once.
+
+Revocation: a token is rejected when its jti was revoked (logout) or it was issued before the
+user was revoked (deactivated, email, password or permissions changed). PUT /api/users answers
+the user's own change of email or password with a new access_token, issued after the cutoff;
+the token of that request and every other session of the user stop working. Both checks are dictionary
+lookups in the process and, when CACHE_URL=redis://... is set, GETs on Redis shared by all the
+workers, so a revocation in one worker applies to every worker immediately.
+"""
+import time
+from datetime import timedelta
+from flask import current_app, jsonify
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+from api.cache import MemoryBackend, RedisBackend
+from api.instrumentation import unbudgeted
+from api.models import db, Users
+from api.signals import user_changed
+
+
+# Changes of these columns revoke every token of the user, except the rehash of the same password
+# on login (session.info['rehashed_users'], set by api/credentials.py)
+REVOKING_CHANGES = ('is_active', 'is_admin', 'password', 'email')
+
+
+class Principal:
+    """ What the views need to know about the authenticated user, without an ORM instance """
+    __slots__ = ('id', 'email', 'is_admin', 'is_active')
+
+    def __init__(self, id, email, is_admin, is_active):
+        self.id = id
+        self.email = email
+        self.is_admin = is_admin
+        self.is_active = is_active
+
+
+class RevocationList:
+    def __init__(self, shared=None, user_ttl=None, max_entries=100000):
+        self.shared = shared
+        self.user_ttl = user_ttl  # Lifetime of the tokens, older revocations don't matter
+        self.max_entries = max_entries
+        self._tokens = {}  # jti → expiration (epoch seconds)
+        self._users = {}  # user_id → tokens issued before this second are revoked
+
+    def revoke_token(self, jti, expires=None):
+        """ expires is the exp claim, None for tokens that never expire """
+        expires = expires or float('inf')
+        ttl = max(int(expires - time.time()), 1) if expires != float('inf') else None
+        if len(self._tokens) >= self.max_entries:
+            now = time.time()
+            self._tokens = {key: value for key, value in self._tokens.items() if value > now}
+        self._tokens[jti] = expires
+        if self.shared is not None:
+            self.shared.set(f'token:{jti}', expires, ttl)
+
+    def revoke_user(self, user_id):
+        # Whole seconds like the iat claim, a token issued later in the same second stays valid
+        cutoff = int(time.time())
+        self._users[user_id] = cutoff
+        if self.shared is not None:
+            self.shared.set(f'user:{user_id}', cutoff, self.user_ttl)
+
+    def is_revoked(self, jti, user_id, issued_at):
+        if jti in self._tokens:
+            return True
+        cutoff = self._users.get(user_id)
+        if cutoff is not None and issued_at < cutoff:
+            return True
+        if self.shared is None:
+            return False
+        expires = self.shared.get(f'token:{jti}')
+        if expires is not None:
+            self._tokens[jti] = expires
+            return True
+        cutoff = self.shared.get(f'user:{user_id}')
+        if cutoff is not None:
+            self._users[user_id] = max(cutoff, self._users.get(user_id, 0))
+            return issued_at < cutoff
+        return False
+
+
+class PrincipalCache:
+    def __init__(self, ttl=60, max_entries=10000):
+        self.ttl = ttl
+        self.backend = MemoryBackend(max_entries)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, jti):
+        entry = self.backend.get(jti)
+        if entry is not None and entry[0] == self.backend.counter(f'user:{entry[1].id}'):
+            self.hits += 1
+            return entry[1]
+        return None
+
+    def set(self, jti, principal):
+        self.misses += 1
+        self.backend.set(jti, (self.backend.counter(f'user:{principal.id}'), principal), self.ttl)
+
+    def invalidate_user(self, user_id):
+        self.backend.incr(f'user:{user_id}')
+
+
+principals = PrincipalCache()
+revocations = RevocationList()
+
+
+def load_principal(user_id=None, email=None):
+    query = db.select(Users.id, Users.email, Users.is_admin, Users.is_active)
+    query = query.where(Users.id == user_id) if user_id is not None else query.where(Users.email == email)
+    row = db.session.execute(query).first()
+    return None if row is None else Principal(row.id, row.email, row.is_admin, row.is_active)
+
+
+def revoke_user(user_id):
+    """ Every token of the user issued until now stops working, in every worker """
+    principals.invalidate_user(user_id)
+    revocations.revoke_user(user_id)
+
+
+def revokes_tokens(user):
+    """ True when the pending changes of the user revoke its tokens at the next commit """
+    state = inspect(user)
+    rehashed = user.id in state.session.info.get('rehashed_users', ()) if state.session else False
+    return any(state.attrs[name].history.has_changes() for name in REVOKING_CHANGES
+               if not (rehashed and name == 'password'))
+
+
+def _user_changed(mapper, connection, target):
+    # Applied after the commit, a request that reads the user before it would cache the old row
+    state = inspect(target)
+    revoke = revokes_tokens(target)
+    changed = state.session.info.setdefault('auth_changed_users', {})
+    changed[target.id] = changed.get(target.id, False) or revoke
+
+
+def _after_commit(session):
+    session.info.pop('rehashed_users', None)
+    for user_id, revoke in session.info.pop('auth_changed_users', {}).items():
+        if revoke:
+            revoke_user(user_id)
+        else:
+            principals.invalidate_user(user_id)
+        # The caches with profile data of the user (trip details with host or travelers)
+        user_changed.send(current_app._get_current_object(), user_id=user_id)
+
+
+def _after_rollback(session):
+    session.info.pop('auth_changed_users', None)
+    session.info.pop('rehashed_users', None)
+
+
+def setup_auth(app, jwt):
+    """ Registers the loaders of JWTManager, call it after JWTManager(app) """
+    principals.ttl = app.config.get('AUTH_PRINCIPAL_TTL', principals.ttl)
+    expires = app.config.get('JWT_ACCESS_TOKEN_EXPIRES')
+    if isinstance(expires, timedelta):
+        expires = expires.total_seconds()
+    revocations.user_ttl = int(expires) if expires else None
+    url = app.config.get('CACHE_URL')
+    if url and url.startswith(('redis://', 'rediss://')):
+        revocations.shared = RedisBackend(url, prefix='auth:')
+    # Any change of a user (API, admin, commands) goes through the ORM flush
+    event.listen(Users, 'after_update', _user_changed)
+    event.listen(Session, 'after_commit', _after_commit)
+    event.listen(Session, 'after_rollback', _after_rollback)
+
+    @jwt.token_in_blocklist_loader
+    def token_revoked(jwt_header, jwt_payload):
+        return revocations.is_revoked(jwt_payload['jti'], jwt_payload.get('user_id'), jwt_payload.get('iat', 0))
+
+    @jwt.user_lookup_loader
+    def user_lookup(jwt_header, jwt_payload):
+        jti = jwt_payload['jti']
+        principal = principals.get(jti)
+        if principal is None:
+            # A cache miss (new token, TTL, edited user) is not part of the work of the view
+            with unbudgeted():
+                principal = load_principal(jwt_payload.get('user_id'), jwt_payload['sub'])
+            if principal is None:
+                return None
+            principals.set(jti, principal)
+        # None makes flask_jwt_extended answer 401, deactivated users lose access right away
+        return principal if principal.is_active else None
+
+    @jwt.user_lookup_error_loader
+    def user_lookup_error(jwt_header, jwt_payload):
+        return jsonify(msg='User not found or inactive'), 401
+
+    @jwt.revoked_token_loader
+    def revoked_token(jwt_header, jwt_payload):
+        return jsonify(msg='Token has been revoked'), 401
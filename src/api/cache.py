@@ -0,0 +1,212 @@
+"""
+Read-through response cache for the trip endpoints.
+
+Backends:
+    MemoryBackend: LRU with TTL inside the worker process (default)
+    RedisBackend: shared by all the workers, used when CACHE_URL=redis://... (needs the redis package)
+With the memory backend every gunicorn worker has its own copy and its own generations: a write
+only invalidates the entries of the worker that made it, the other workers keep answering the
+old response for up to CACHE_TTL seconds. Set CACHE_URL when running more than one worker.
+
+Keys are built from the endpoint, the normalized query string and a generation number.
+Writes bump the generation of the listings and of the trip that changed (trip_changed signal),
+so only the entries that can contain that trip stop being used; they expire on their own.
+Views that depend on the user (cached(per_user=True)) add the user id of the JWT, if any, and
+a generation of that user's favorites to the key. Responses that embed profile data of users
+(cached(user_data=...), the trip detail with expand=host or travelers) also add a generation
+that every change of a user bumps (user_changed signal).
+Cached responses carry an ETag and answer If-None-Match with 304 Not Modified.
+"""
+import hashlib
+import logging
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from flask import make_response, request
+from flask_jwt_extended import get_jwt
+from api.signals import trip_changed, favorites_changed, user_changed
+from api.streaming import wants_stream
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+
+logger = logging.getLogger('api.cache')
+
+
+class MemoryBackend:
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._counters = {}  # Outside of the LRU, losing a generation would resurrect stale entries
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires is not None and expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._entries[key] = (value, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def counter(self, key):
+        return self._counters.get(key, 0)
+
+    def incr(self, key):
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class RedisBackend:
+    def __init__(self, url, prefix='cache:'):
+        if redis is None:
+            raise RuntimeError('CACHE_URL=redis://... requires the redis package')
+        self.prefix = prefix
+        self._client = redis.Redis.from_url(url)
+
+    def get(self, key):
+        value = self._client.get(self.prefix + key)
+        return None if value is None else pickle.loads(value)
+
+    def set(self, key, value, ttl=None):
+        self._client.set(self.prefix + key, pickle.dumps(value), ex=ttl or None)
+
+    def delete(self, key):
+        self._client.delete(self.prefix + key)
+
+    def counter(self, key):
+        return int(self._client.get(self.prefix + key) or 0)
+
+    def incr(self, key):
+        return self._client.incr(self.prefix + key)
+
+    def clear(self):
+        for key in self._client.scan_iter(self.prefix + '*'):
+            self._client.delete(key)
+
+
+def make_backend(url=None, max_entries=1024):
+    if url and url.startswith(('redis://', 'rediss://')):
+        return RedisBackend(url)
+    return MemoryBackend(max_entries)
+
+
+class ResponseCache:
+    def __init__(self, backend=None, ttl=60):
+        self.backend = backend or MemoryBackend()
+        self.ttl = ttl
+
+    def _generation(self, name):
+        return self.backend.counter('generation:' + name)
+
+    def key(self, namespace, trip_id=None, user_id=None, user_data=False):
+        # The order of the parameters and empty values do not change the response
+        args = sorted((name, value.strip()) for name, value in request.args.items(multi=True) if value.strip())
+        digest = hashlib.sha1(repr(args).encode()).hexdigest()
+        generation = self._generation('trips') if trip_id is None else self._generation(f'trip:{trip_id}')
+        if user_id is not None:
+            generation = f'{generation}:u{user_id}:{self._generation(f"favorites:{user_id}")}'
+        if user_data:
+            generation = f'{generation}:p{self._generation("users")}'
+        return f'{namespace}:{trip_id}:{generation}:{digest}'
+
+    def invalidate_favorites(self, user_id, trip_id):
+        """ The user's views and the favorites_count of the trip detail change, other listings don't """
+        self.backend.incr(f'generation:favorites:{user_id}')
+        self.backend.incr(f'generation:trip:{trip_id}')
+
+    def invalidate_users(self):
+        """ Only the responses with profile data; which trips show the user would cost a query """
+        self.backend.incr('generation:users')
+
+    def invalidate_trip(self, trip_id=None):
+        """ Listings always change; the detail of trip_id too """
+        self.backend.incr('generation:trips')
+        if trip_id is not None:
+            self.backend.incr(f'generation:trip:{trip_id}')
+
+    def cached(self, namespace, per_user=False, user_data=None):
+        """ Decorator for GET views whose response only depends on the URL (and the user with per_user,
+        place it below @jwt_required(optional=True)). user_data(request.args) is True when the
+        response embeds profile data of users """
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                if wants_stream(request):
+                    return view(*args, **kwargs)
+                user_id = get_jwt().get('user_id') if per_user else None
+                key = self.key(namespace, kwargs.get('trip_id'), user_id,
+                               user_data is not None and user_data(request.args))
+                entry = self.backend.get(key)
+                status = 'HIT'
+                if entry is None:
+                    status = 'MISS'
+                    response = make_response(view(*args, **kwargs))
+                    if response.status_code != 200 or response.is_streamed:
+                        return response
+                    body = response.get_data()
+                    entry = (body, response.mimetype, hashlib.sha1(body).hexdigest())
+                    self.backend.set(key, entry, self.ttl)
+                body, mimetype, etag = entry
+                response = make_response(body)
+                response.mimetype = mimetype
+                response.set_etag(etag)
+                response.cache_control.no_cache = True  # Clients may keep it but must revalidate with If-None-Match
+                response.headers['X-Cache'] = status
+                return response.make_conditional(request)
+            return wrapper
+        return decorator
+
+
+response_cache = ResponseCache()
+
+
+def _on_trip_changed(sender, trip_id=None, **extra):
+    response_cache.invalidate_trip(trip_id)
+
+
+def _on_favorites_changed(sender, user_id=None, trip_id=None, **extra):
+    response_cache.invalidate_favorites(user_id, trip_id)
+
+
+def _on_user_changed(sender, user_id=None, **extra):
+    response_cache.invalidate_users()
+
+
+def setup_cache(app):
+    url = app.config.get('CACHE_URL')
+    response_cache.backend = make_backend(url, app.config.get('CACHE_MAX_ENTRIES', 1024))
+    response_cache.ttl = app.config.get('CACHE_TTL', 60)
+    if isinstance(response_cache.backend, MemoryBackend) and int(os.getenv('WEB_CONCURRENCY', 1)) > 1:
+        logger.warning('Response cache in memory with %s workers: writes only invalidate the cache of their '
+                       'worker, others can answer stale data for CACHE_TTL seconds. Set CACHE_URL=redis://...',
+                       os.getenv('WEB_CONCURRENCY'))
+    trip_changed.connect(_on_trip_changed, weak=False)
+    favorites_changed.connect(_on_favorites_changed, weak=False)
+    user_changed.connect(_on_user_changed, weak=False)
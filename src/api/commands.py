@@ -4,7 +4,12 @@ Flask commands are usefull to run cronjobs or tasks outside of the API but sill
 with youy database, for example: Import the price of bitcoin every night as 12am
 """
 import click
-from api.models import db, Users
+from datetime import datetime
+from api.models import Users
+from api.credentials import hash_password
+from api.seed import DatasetGenerator, insert_rows
+from api.static_files import precompress
+from api.lifecycle import lifecycle
 
 
 def setup_commands(app):
@@ -15,18 +20,63 @@ def setup_commands(app):
     """
     @app.cli.command("insert-test-users")  # Name of our command
     @click.argument("count")  # Argument of out command
-    def insert_test_users(count):
+    @click.option("--batch-size", default=5000, help="Rows per INSERT and per transaction")
+    def insert_test_users(count, batch_size):
         print("Creating test users")
-        for x in range(1, int(count) + 1):
-            user = Users()
-            user.email = "test_user" + str(x) + "@test.com"
-            user.password = "123456"
-            user.is_active = True
-            db.session.add(user)
-            db.session.commit()
-            print("User: ", user.email, " created.")
-        print("All test users created")
+        password = hash_password("123456")  # Same password for everybody, hash it only once
+        rows = ({'email': "test_user" + str(x) + "@test.com", 'password': password, 'is_active': True,
+                 'is_admin': False, 'created_at': datetime.utcnow()} for x in range(1, int(count) + 1))
+        total = insert_rows(Users, rows, batch_size)
+        print(total, "test users created")
 
+    """
+    Fills every table with a coherent random dataset, for example to test the performance:
+    $ flask insert-test-data --users 100000 --trips 200000
+    The same --seed always generates the same data. All the users have the password 123456
+    """
     @app.cli.command("insert-test-data")
-    def insert_test_data():
-        pass
+    @click.option("--users", default=1000, help="Number of users")
+    @click.option("--trips", default=2000, help="Number of trips")
+    @click.option("--travelers-per-trip", default=3)
+    @click.option("--favorites-per-user", default=5)
+    @click.option("--notifications-per-user", default=3)
+    @click.option("--batch-size", default=5000, help="Rows per INSERT (COPY on PostgreSQL) and per transaction")
+    @click.option("--seed", default=42, help="Seed of the random generator")
+    def insert_test_data(users, trips, travelers_per_trip, favorites_per_user, notifications_per_user, batch_size, seed):
+        generator = DatasetGenerator(users=users, trips=trips, travelers_per_trip=travelers_per_trip,
+                                     favorites_per_user=favorites_per_user,
+                                     notifications_per_user=notifications_per_user, seed=seed)
+
+        def report(table, rows, seconds):
+            print(f"{table}: {rows} rows in {seconds:.2f}s ({rows / seconds if seconds else 0:.0f} rows/s)")
+        stats = generator.run(batch_size, report)
+        rows = sum(count for count, _ in stats.values())
+        seconds = sum(elapsed for _, elapsed in stats.values())
+        print(f"Total: {rows} rows in {seconds:.2f}s ({rows / seconds if seconds else 0:.0f} rows/s)")
+
+    """
+    Writes the .gz (and .br with the brotli package) versions of the front end build, served to
+    the browsers that accept them. Runs after `npm run build` in render_build.sh
+    """
+    @app.cli.command("precompress")
+    @click.argument("directory", default="public")
+    @click.option("--minimum-size", default=1024, help="Smaller files are not compressed")
+    def precompress_static(directory, minimum_size):
+        written = precompress(directory, minimum_size)
+        for name, encoding, size, compressed in written:
+            print(f"{name} ({encoding}): {size} -> {compressed} bytes ({compressed / size:.0%})")
+        print(f"{len(written)} files compressed")
+
+    """
+    Moves the trips to ongoing or finished by their dates (see api/lifecycle.py), for a cron job
+    when the in-process job is off (LIFECYCLE_INTERVAL=0): $ flask update-trip-statuses
+    """
+    @app.cli.command("update-trip-statuses")
+    @click.option("--batch-size", default=None, type=int, help="Rows per UPDATE and per transaction")
+    def update_trip_statuses(batch_size):
+        if batch_size:
+            lifecycle.batch_size = batch_size
+        result = lifecycle.run_pass()
+        for status, rows in result['changed'].items():
+            print(f"{status}: {rows} trips")
+        print(f"Done in {result['seconds']:.2f}s")
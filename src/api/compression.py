@@ -0,0 +1,168 @@
+"""
+Compression of the responses of the api blueprint.
+
+The JSON of the listings repeats the same keys and values (currencies, status...) on every row
+and compresses to a fraction of its size. The codings are chosen from Accept-Encoding, the best
+q first and, with the same q, in the order of COMPRESS_ALGORITHMS:
+    br    brotli package (optional)
+    zstd  zstandard package (optional)
+    gzip  standard library, always available
+Bodies smaller than COMPRESS_MIN_SIZE are sent as they are (the headers and the CPU cost more
+than they save). Streamed responses (NDJSON exports) are compressed chunk by chunk and flushed
+after every chunk, so the client still gets each batch as soon as it is read.
+
+The ETag of a compressed response becomes weak (W/"..."): the bytes are different from the
+uncompressed ones, but If-None-Match still matches them. Levels favor speed, the responses are
+compressed on every request; measure them with benchmarks/bench_compression.py.
+"""
+import gzip
+import zlib
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+COMPRESSIBLE_MIMETYPES = ('application/json', 'application/x-ndjson', 'text/html', 'text/plain', 'text/csv')
+DEFAULT_LEVELS = {'br': 4, 'zstd': 3, 'gzip': 6}
+
+
+class GzipCoding:
+    name = 'gzip'
+
+    def __init__(self, level):
+        self.level = level
+
+    def compress(self, data):
+        return gzip.compress(data, compresslevel=self.level, mtime=0)
+
+    def stream(self, chunks):
+        # wbits 31: zlib stream with the gzip header and trailer
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, 31)
+        for chunk in chunks:
+            data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            if data:
+                yield data
+        yield compressor.flush()
+
+
+class BrotliCoding:
+    name = 'br'
+
+    def __init__(self, level):
+        self.level = level
+
+    def compress(self, data):
+        return brotli.compress(data, quality=self.level)
+
+    def stream(self, chunks):
+        compressor = brotli.Compressor(quality=self.level)
+        for chunk in chunks:
+            data = compressor.process(chunk) + compressor.flush()
+            if data:
+                yield data
+        yield compressor.finish()
+
+
+class ZstdCoding:
+    name = 'zstd'
+
+    def __init__(self, level):
+        self.level = level
+        self._compressor = zstandard.ZstdCompressor(level=level)
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def stream(self, chunks):
+        compressor = zstandard.ZstdCompressor(level=self.level).compressobj()
+        for chunk in chunks:
+            data = compressor.compress(chunk) + compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+            if data:
+                yield data
+        yield compressor.flush()
+
+
+CODINGS = {'br': (BrotliCoding, lambda: brotli is not None),
+           'zstd': (ZstdCoding, lambda: zstandard is not None),
+           'gzip': (GzipCoding, lambda: True)}
+
+
+class Compressor:
+    def __init__(self):
+        self.enabled = True
+        self.min_size = 1024
+        self.codings = [GzipCoding(DEFAULT_LEVELS['gzip'])]
+        self.compressed = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def init_app(self, app):
+        self.enabled = app.config.get('COMPRESS_ENABLED', True)
+        self.min_size = app.config.get('COMPRESS_MIN_SIZE', 1024)
+        levels = {**DEFAULT_LEVELS, **app.config.get('COMPRESS_LEVELS', {})}
+        self.codings = []
+        for name in app.config.get('COMPRESS_ALGORITHMS', ('br', 'zstd', 'gzip')):
+            if name not in CODINGS:
+                raise ValueError(f'Unknown compression algorithm {name!r}, use one of {", ".join(CODINGS)}')
+            coding, available = CODINGS[name]
+            if available():
+                self.codings.append(coding(levels[name]))
+
+    def negotiate(self):
+        """ The coding of the best quality in Accept-Encoding, None for the identity """
+        accepted = request.accept_encodings
+        best, best_quality = None, 0
+        for coding in self.codings:
+            quality = accepted.quality(coding.name)
+            if quality > best_quality:
+                best, best_quality = coding, quality
+        return best
+
+    def compress(self, response):
+        """ after_request of the blueprint """
+        if (not self.enabled or response.mimetype not in COMPRESSIBLE_MIMETYPES or request.method == 'HEAD'
+                or response.status_code < 200 or response.status_code in (204, 206, 304)
+                or response.direct_passthrough or 'Content-Encoding' in response.headers
+                or 'no-transform' in response.headers.get('Cache-Control', '')):
+            return response
+        # Caches must keep one copy per coding even when this one goes out uncompressed
+        response.vary.add('Accept-Encoding')
+        if not response.is_streamed and response.content_length is not None and response.content_length < self.min_size:
+            return response
+        coding = self.negotiate()
+        if coding is None:
+            return response
+
+        if response.is_streamed:
+            source = response.response
+            if hasattr(source, 'close'):
+                response.call_on_close(source.close)  # Ends the query of the stream if the client goes away
+            response.response = coding.stream(source)
+            response.headers.pop('Content-Length', None)
+        else:
+            body = response.get_data()
+            data = coding.compress(body)
+            self.bytes_in += len(body)
+            self.bytes_out += len(data)
+            response.set_data(data)
+        self.compressed += 1
+        response.headers['Content-Encoding'] = coding.name
+        etag, weak = response.get_etag()
+        if etag is not None and not weak:
+            response.set_etag(etag, weak=True)
+        return response
+
+
+compressor = Compressor()
+
+
+def setup_compression(app):
+    compressor.init_app(app)
@@ -0,0 +1,212 @@
+"""
+Password hashing and verification.
+
+PASSWORD_HASHER selects the algorithm used for new hashes (scrypt by default, it comes with
+Python; bcrypt and argon2 need the `bcrypt` / `argon2-cffi` packages) and PASSWORD_HASH_COST
+its work factor:
+    scrypt: log2(N), default 14
+    bcrypt: log rounds, default 12
+    argon2: time cost, default 3 (64 MiB of memory)
+Hashes created with another algorithm or cost keep working and are upgraded the next time
+the user logs in, the same happens with the old plain text passwords.
+
+The key derivation functions release the GIL and run in a pool of PASSWORD_HASH_WORKERS
+threads. The request thread still waits for its result; the pool is a concurrency limit, so a
+burst of logins uses at most that many cores of the worker. Up to PASSWORD_HASH_QUEUE hashes
+can be in the pool at once (running or waiting), more fail at once with a 503 instead of
+piling up. A rehash on login doesn't revoke the sessions of the user, see api/auth.py.
+A stored hash that can't be checked (malformed, or bcrypt/argon2 without their package) is
+logged and counts as a wrong password.
+"""
+import base64
+import hashlib
+import hmac
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from api.models import db, Users
+from api.utils import APIException
+
+try:
+    import bcrypt
+except ImportError:
+    bcrypt = None
+
+try:
+    import argon2
+except ImportError:
+    argon2 = None
+
+
+logger = logging.getLogger('api.credentials')
+
+
+def _b64encode(raw):
+    return base64.b64encode(raw).decode().rstrip('=')
+
+
+def _b64decode(text):
+    return base64.b64decode(text + '=' * (-len(text) % 4))
+
+
+class ScryptHasher:
+    name = 'scrypt'
+    prefixes = ('$scrypt$',)
+    default_cost = 14
+
+    def __init__(self, cost=None, r=8, p=1):
+        self.cost = cost or self.default_cost
+        self.r = r
+        self.p = p
+
+    def _derive(self, password, salt, cost, r, p):
+        n = 2 ** cost
+        return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p, dklen=32,
+                              maxmem=256 * n * r * p + 1024 * 1024)
+
+    def hash(self, password):
+        salt = os.urandom(16)
+        derived = self._derive(password, salt, self.cost, self.r, self.p)
+        return f'$scrypt$ln={self.cost},r={self.r},p={self.p}${_b64encode(salt)}${_b64encode(derived)}'
+
+    def _parse(self, encoded):
+        _, _, params, salt, derived = encoded.split('$')
+        params = dict(item.split('=') for item in params.split(','))
+        return int(params['ln']), int(params['r']), int(params['p']), _b64decode(salt), _b64decode(derived)
+
+    def verify(self, password, encoded):
+        cost, r, p, salt, derived = self._parse(encoded)
+        return hmac.compare_digest(self._derive(password, salt, cost, r, p), derived)
+
+    def needs_rehash(self, encoded):
+        cost, r, p, _, _ = self._parse(encoded)
+        return (cost, r, p) != (self.cost, self.r, self.p)
+
+
+class BcryptHasher:
+    name = 'bcrypt'
+    prefixes = ('$2a$', '$2b$', '$2y$')
+    default_cost = 12
+
+    def __init__(self, cost=None):
+        if bcrypt is None:
+            raise RuntimeError('PASSWORD_HASHER=bcrypt requires the bcrypt package')
+        self.cost = cost or self.default_cost
+
+    def hash(self, password):
+        # bcrypt only uses the first 72 bytes of the password
+        return bcrypt.hashpw(password.encode()[:72], bcrypt.gensalt(self.cost)).decode()
+
+    def verify(self, password, encoded):
+        return bcrypt.checkpw(password.encode()[:72], encoded.encode())
+
+    def needs_rehash(self, encoded):
+        return int(encoded.split('$')[2]) != self.cost
+
+
+class Argon2Hasher:
+    name = 'argon2'
+    prefixes = ('$argon2',)
+    default_cost = 3
+
+    def __init__(self, cost=None):
+        if argon2 is None:
+            raise RuntimeError('PASSWORD_HASHER=argon2 requires the argon2-cffi package')
+        self.cost = cost or self.default_cost
+        self._hasher = argon2.PasswordHasher(time_cost=self.cost, memory_cost=64 * 1024, parallelism=1)
+
+    def hash(self, password):
+        return self._hasher.hash(password)
+
+    def verify(self, password, encoded):
+        try:
+            return self._hasher.verify(encoded, password)
+        except (argon2.exceptions.VerificationError, argon2.exceptions.InvalidHashError):
+            return False
+
+    def needs_rehash(self, encoded):
+        return self._hasher.check_needs_rehash(encoded)
+
+
+HASHERS = {hasher.name: hasher for hasher in (ScryptHasher, BcryptHasher, Argon2Hasher)}
+
+
+def make_hasher(name=None, cost=None):
+    name = name or os.getenv('PASSWORD_HASHER', ScryptHasher.name)
+    if name not in HASHERS:
+        raise RuntimeError(f'Unknown PASSWORD_HASHER {name}, use one of: {", ".join(HASHERS)}')
+    return HASHERS[name](cost)
+
+
+class CredentialService:
+    def __init__(self, hasher, workers=None, queue_size=None):
+        self.hasher = hasher
+        self.workers = workers or os.cpu_count() or 1
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='password-hash')
+        self._slots = threading.BoundedSemaphore(queue_size or self.workers * 4)
+        self._verifiers = {}
+        self._dummy_hash = None
+
+    def _hasher_for(self, encoded):
+        """ Returns the hasher that created `encoded`, None for plain text passwords """
+        for prefix_hasher in HASHERS.values():
+            if encoded.startswith(prefix_hasher.prefixes):
+                if isinstance(self.hasher, prefix_hasher):
+                    return self.hasher
+                if prefix_hasher.name not in self._verifiers:
+                    self._verifiers[prefix_hasher.name] = prefix_hasher()
+                return self._verifiers[prefix_hasher.name]
+        return None
+
+    def _run(self, function, *args):
+        if not self._slots.acquire(blocking=False):
+            raise APIException('Too many login attempts in progress, try again later', status_code=503)
+        try:
+            return self._executor.submit(function, *args).result()
+        finally:
+            self._slots.release()
+
+    def hash_password(self, password):
+        return self._run(self.hasher.hash, password)
+
+    def verify_password(self, password, encoded):
+        """ Returns (valid, needs_rehash). Plain text passwords are compared in constant time and always need a rehash """
+        try:
+            hasher = self._hasher_for(encoded)
+            if hasher is None:
+                return hmac.compare_digest(password.encode(), encoded.encode()), True
+            valid = self._run(hasher.verify, password, encoded)
+        except (RuntimeError, ValueError, KeyError, IndexError, TypeError):
+            # The package of the algorithm is missing or the hash is damaged: nobody can log in with it
+            logger.error('Stored password hash could not be verified', exc_info=True)
+            return False, False
+        if not valid:
+            return False, False
+        return True, hasher is not self.hasher or hasher.needs_rehash(encoded)
+
+    def authenticate(self, email, password):
+        """ Returns the active user with that email and password or None """
+        user = db.session.execute(db.select(Users).where(Users.email == email)).scalar()
+        if user is None:
+            # Spend the same time as a real verification so unknown emails can't be told apart
+            if self._dummy_hash is None:
+                self._dummy_hash = self.hash_password('dummy password')
+            self.verify_password(password, self._dummy_hash)
+            return None
+        valid, needs_rehash = self.verify_password(password, user.password)
+        if not valid or not user.is_active:
+            return None
+        if needs_rehash:
+            # Same password in a new format, the tokens of the user stay valid (api/auth.py)
+            db.session.info.setdefault('rehashed_users', set()).add(user.id)
+            user.password = self.hash_password(password)
+            db.session.commit()
+        return user
+
+
+credentials = CredentialService(make_hasher(cost=int(os.getenv('PASSWORD_HASH_COST', 0)) or None),
+                                workers=int(os.getenv('PASSWORD_HASH_WORKERS', 0)) or None,
+                                queue_size=int(os.getenv('PASSWORD_HASH_QUEUE', 0)) or None)
+hash_password = credentials.hash_password
+authenticate = credentials.authenticate
@@ -0,0 +1,56 @@
+"""
+Favorites. Adding and removing are idempotent (INSERT ... ON CONFLICT DO NOTHING on the unique
+(user_id, trip_id) index) and favorited_trip_ids() answers "which of these trips are favorites
+of the user" for a whole page of trips with one indexed query.
+"""
+from flask import current_app
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from api.models import db, Trips, Favorites
+from api.signals import favorites_changed
+from api.utils import APIException
+
+
+def _insert_ignore(values):
+    dialect = db.session.get_bind().dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+        insert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+        result = db.session.execute(insert(Favorites).values(**values)
+                                    .on_conflict_do_nothing(index_elements=['user_id', 'trip_id']))
+        return result.rowcount == 1
+    try:
+        with db.session.begin_nested():
+            db.session.execute(db.insert(Favorites).values(**values))
+    except IntegrityError:
+        return False
+    return True
+
+
+def add_favorite(user_id, trip_id):
+    """ Returns True if the favorite was created, False if it already existed """
+    if db.session.execute(db.select(Trips.id).where(Trips.id == trip_id)).scalar() is None:
+        raise APIException('Trip not found', status_code=404)
+    created = _insert_ignore({'user_id': user_id, 'trip_id': trip_id})
+    db.session.commit()
+    if created:
+        favorites_changed.send(current_app._get_current_object(), user_id=user_id, trip_id=trip_id)
+    return created
+
+
+def remove_favorite(user_id, trip_id):
+    """ Returns True if the favorite existed """
+    result = db.session.execute(db.delete(Favorites).where(Favorites.user_id == user_id, Favorites.trip_id == trip_id)
+                                .execution_options(synchronize_session=False))
+    db.session.commit()
+    if result.rowcount:
+        favorites_changed.send(current_app._get_current_object(), user_id=user_id, trip_id=trip_id)
+    return bool(result.rowcount)
+
+
+def favorited_trip_ids(user_id, trip_ids):
+    """ Set with the ids of trip_ids that are favorites of the user, one query whatever the number of ids """
+    trip_ids = list(set(trip_ids))
+    if not trip_ids:
+        return set()
+    return set(db.session.execute(db.select(Favorites.trip_id)
+                                  .where(Favorites.user_id == user_id, Favorites.trip_id.in_(trip_ids))).scalars())
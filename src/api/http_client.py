@@ -0,0 +1,66 @@
+"""
+Pooled async HTTP client (httpx) for the calls the API makes to other services (photo storage).
+
+An httpx.AsyncClient keeps its connections on the event loop that opened them, so there is one
+client per loop:
+    ASGI (src/asgi.py)  the loop of the server, the views await the calls directly
+    WSGI (src/wsgi.py)  a background loop in a daemon thread of each worker; sync views use
+                        http_clients.run(coroutine) and wait for the result
+Every client reuses up to HTTP_CLIENT_MAX_CONNECTIONS connections per worker and gives up after
+HTTP_CLIENT_TIMEOUT seconds without progress (HTTP_CLIENT_CONNECT_TIMEOUT to connect).
+"""
+import asyncio
+import threading
+import weakref
+import httpx
+
+
+class HTTPClients:
+    def __init__(self):
+        self.timeout = 30
+        self.connect_timeout = 5
+        self.max_connections = 20
+        self._clients = weakref.WeakKeyDictionary()  # event loop → httpx.AsyncClient
+        self._loop = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.timeout = app.config.get('HTTP_CLIENT_TIMEOUT', self.timeout)
+        self.connect_timeout = app.config.get('HTTP_CLIENT_CONNECT_TIMEOUT', self.connect_timeout)
+        self.max_connections = app.config.get('HTTP_CLIENT_MAX_CONNECTIONS', self.max_connections)
+
+    def client(self):
+        """ The client of the running event loop """
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None or client.is_closed:
+            client = self._clients[loop] = httpx.AsyncClient(
+                timeout=httpx.Timeout(self.timeout, connect=self.connect_timeout),
+                limits=httpx.Limits(max_connections=self.max_connections,
+                                    max_keepalive_connections=self.max_connections))
+        return client
+
+    def _background_loop(self):
+        # Started on the first use, after gunicorn forked the worker
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name='http-client-loop', daemon=True).start()
+        return self._loop
+
+    def run(self, coroutine):
+        """ Runs coroutine on the background loop and returns its result, for sync (WSGI) code """
+        return asyncio.run_coroutine_threadsafe(coroutine, self._background_loop()).result()
+
+    async def aclose(self):
+        """ Closes the client of the running loop (shutdown of the ASGI server) """
+        client = self._clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.aclose()
+
+
+http_clients = HTTPClients()
+
+
+def setup_http_client(app):
+    http_clients.init_app(app)
@@ -0,0 +1,137 @@
+"""
+Per request database instrumentation.
+Listens to the cursor events of the engines of `db` and, for every Flask request, counts the
+queries, the time spent in the database and how many times the same statement was executed
+(a statement repeated with different parameters is the signature of an N+1 query).
+The numbers are sent back in the Server-Timing header and logged as one JSON line (a sample of
+them, see api/logs.py; the requests with a possible N+1 are always logged).
+
+Query budgets: decorate a view with @query_budget(n) or set QUERY_BUDGET for all of them.
+A request over budget logs a warning, with QUERY_BUDGET_STRICT=True (use it in tests) it raises
+QueryBudgetExceeded instead. Statements run inside `with unbudgeted():` (the lookup of the user of
+the token, api/auth.py) are timed and logged but don't count against the budget of the view.
+"""
+import logging
+import time
+from collections import Counter
+from contextlib import contextmanager
+from functools import wraps
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from api.models import db
+from api.logs import log_event
+
+
+logger = logging.getLogger('api.queries')
+
+# A statement repeated this many times in one request is reported as a possible N+1
+REPEATED_STATEMENT_THRESHOLD = 5
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class QueryStats:
+    __slots__ = ('count', 'unbudgeted', 'duration', 'statements', 'started')
+
+    def __init__(self):
+        self.count = 0
+        self.unbudgeted = 0
+        self.duration = 0.0
+        self.statements = Counter()
+        self.started = time.perf_counter()
+
+    def repeated(self, threshold=2):
+        return {statement: count for statement, count in self.statements.items() if count >= threshold}
+
+
+def current_stats():
+    """ QueryStats of the current request or None outside of a request """
+    if not has_request_context():
+        return None
+    return g.get('query_stats')
+
+
+def query_budget(max_queries):
+    """ Maximum number of SQL statements the decorated view may execute """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            g.query_budget = max_queries
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def unbudgeted():
+    """ The statements executed in the block don't count against the query budget """
+    stats = current_stats()
+    before = stats.count if stats is not None else 0
+    try:
+        yield
+    finally:
+        if stats is not None:
+            stats.unbudgeted += stats.count - before
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info['query_started'].pop()
+    stats = current_stats()
+    if stats is not None:
+        stats.count += 1
+        stats.duration += time.perf_counter() - started
+        stats.statements[statement] += 1
+
+
+def _handle_error(context):
+    if context.connection is not None and context.connection.info.get('query_started'):
+        context.connection.info['query_started'].pop()
+
+
+def _start_request():
+    g.query_stats = QueryStats()
+
+
+def _finish_request(response):
+    stats = g.pop('query_stats', None)
+    if stats is None:
+        return response
+    elapsed = time.perf_counter() - stats.started
+    response.headers.add('Server-Timing', f'db;dur={stats.duration * 1000:.2f};desc="{stats.count} queries"')
+    response.headers.add('Server-Timing', f'app;dur={elapsed * 1000:.2f}')
+
+    repeated = stats.repeated(REPEATED_STATEMENT_THRESHOLD)
+    log_line = {'method': request.method, 'path': request.path, 'endpoint': request.endpoint,
+                'status': response.status_code, 'queries': stats.count,
+                'db_ms': round(stats.duration * 1000, 2), 'duration_ms': round(elapsed * 1000, 2),
+                'repeated_statements': len(stats.repeated())}
+    if repeated:
+        log_line['possible_n_plus_1'] = [statement[:200] for statement in repeated]
+        log_event(logger, logging.WARNING, 'request', **log_line)
+    else:
+        log_event(logger, logging.INFO, 'request', **log_line)
+
+    budget = g.get('query_budget', current_app.config.get('QUERY_BUDGET'))
+    budgeted = stats.count - stats.unbudgeted
+    if budget is not None and budgeted > budget:
+        message = f'{request.method} {request.path} executed {budgeted} queries, the budget is {budget}'
+        if current_app.config.get('QUERY_BUDGET_STRICT'):
+            raise QueryBudgetExceeded(message)
+        logger.warning(message)
+    return response
+
+
+def setup_instrumentation(app):
+    with app.app_context():
+        for engine in db.engines.values():
+            event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+            event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+            event.listen(engine, 'handle_error', _handle_error)
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
@@ -0,0 +1,146 @@
+"""
+Trip status lifecycle: moves the trips through planning → ongoing → finished by their dates.
+
+    planning            → ongoing   start_date <= now < end_date
+    planning, ongoing   → finished  end_date <= now
+
+Cancelled trips never change. The same rule as the seed data (api/seed.py), applied with a few
+set based UPDATEs per pass instead of computing the status on every read:
+
+    UPDATE trips SET status = 'ongoing'
+    WHERE id IN (SELECT id FROM trips WHERE status = 'planning' AND start_date <= now AND end_date > now LIMIT 1000)
+
+status + start_date is the prefix of the index ix_trips_status_start_date_id, so each pass only
+reads the trips that have to change. Batches of LIFECYCLE_BATCH_SIZE rows, one transaction each,
+keep the locks short after a long pause (the first pass of a new database). On PostgreSQL the
+UPDATE skips the rows locked by a host that is changing them and returns the ids it changed.
+Without UPDATE ... RETURNING (SQLite) the candidates are updated one by one with the conditions
+repeated, and only the ids whose UPDATE matched a row count as changed: when the workers of two
+processes sweep at the same time, each trip is announced by the one that changed it.
+
+Every changed trip sends trip_changed (caches) and a trip_status notification to its host and
+travelers. Runs as `flask update-trip-statuses` (cron) or in a thread of every worker each
+LIFECYCLE_INTERVAL seconds (0 disables it). stats() has the rows and seconds of the last passes
+(GET /api/_health/lifecycle).
+"""
+import logging
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from api.models import db, Trips
+from api.notifications import dispatcher
+from api.signals import trip_changed
+
+
+logger = logging.getLogger('api.lifecycle')
+
+
+def transitions(now):
+    """ (new status, conditions) in the order they are applied """
+    trips = Trips.__table__.c
+    return (('finished', (trips.status.in_(('planning', 'ongoing')), trips.start_date <= now, trips.end_date <= now)),
+            ('ongoing', (trips.status == 'planning', trips.start_date <= now, trips.end_date > now)))
+
+
+class LifecycleScheduler:
+    def __init__(self, interval=600, batch_size=1000, history=20):
+        self.app = None
+        self.interval = interval
+        self.batch_size = batch_size
+        self.passes = deque(maxlen=history)  # The last passes, newest last
+        self.counters = {'passes': 0, 'errors': 0, 'ongoing': 0, 'finished': 0}
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.app = app
+        self.interval = app.config.get('LIFECYCLE_INTERVAL', self.interval)
+        self.batch_size = app.config.get('LIFECYCLE_BATCH_SIZE', self.batch_size)
+
+    def ensure_worker(self):
+        """ Starts the periodic job of this process, called before every request (a pid check) """
+        if not self.interval:
+            return
+        # Threads don't survive the fork of the gunicorn workers, start one per process
+        if self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid != os.getpid() or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='trip-lifecycle', daemon=True)
+                self._thread.start()
+                self._pid = os.getpid()
+
+    def _run(self):
+        while True:
+            try:
+                with self.app.app_context():
+                    self.run_pass()
+            except Exception:
+                self.counters['errors'] += 1
+                logger.exception('Trip lifecycle pass failed')
+            time.sleep(self.interval)
+
+    def run_pass(self, now=None):
+        """ Applies every transition, returns {'started_at', 'seconds', 'changed': {status: rows}} """
+        now = now or datetime.utcnow()
+        started = time.perf_counter()
+        changed = {}
+        for status, conditions in transitions(now):
+            changed[status] = 0
+            while True:
+                trip_ids = self._update(status, conditions)
+                self._announce(trip_ids, status)
+                changed[status] += len(trip_ids)
+                if len(trip_ids) < self.batch_size:
+                    break
+        result = {'started_at': now, 'seconds': round(time.perf_counter() - started, 4), 'changed': changed}
+        self.passes.append(result)
+        self.counters['passes'] += 1
+        for status, rows in changed.items():
+            self.counters[status] += rows
+        if any(changed.values()):
+            logger.info('Trip lifecycle: %s in %.3fs', changed, result['seconds'])
+        return result
+
+    def _update(self, status, conditions):
+        """ Moves up to batch_size trips to status in one transaction, returns their ids """
+        table = Trips.__table__
+        candidates = db.select(table.c.id).where(*conditions).limit(self.batch_size)
+        if db.session.get_bind().dialect.name == 'postgresql':
+            query = (db.update(table).where(table.c.id.in_(candidates.with_for_update(skip_locked=True)))
+                     .values(status=status).returning(table.c.id))
+            trip_ids = db.session.execute(query).scalars().all()
+        else:
+            # No UPDATE ... RETURNING: read the ids, then keep those this process changed (rowcount), another
+            # worker may have read the same ids and updated them first
+            query = db.update(table).where(table.c.id == db.bindparam('trip_id'), *conditions).values(status=status)
+            trip_ids = [trip_id for trip_id in db.session.execute(candidates).scalars().all()
+                        if db.session.execute(query, {'trip_id': trip_id}).rowcount == 1]
+        db.session.commit()
+        return trip_ids
+
+    def _announce(self, trip_ids, status):
+        if not trip_ids:
+            return
+        for trip_id in trip_ids:
+            trip_changed.send(self.app, trip_id=trip_id, change='status')
+            dispatcher.notify('trip_status', trip_id, status=status)
+        # Waiting for the queue to drain keeps a big batch from overflowing it (dropped events)
+        dispatcher.flush(timeout=60)
+
+    def stats(self):
+        last = self.passes[-1] if self.passes else None
+        return dict(self.counters, interval=self.interval, batch_size=self.batch_size,
+                    worker_alive=self._thread is not None and self._thread.is_alive(),
+                    last_pass=last, recent_seconds=[item['seconds'] for item in self.passes])
+
+
+lifecycle = LifecycleScheduler()
+
+
+def setup_lifecycle(app):
+    lifecycle.init_app(app)
+    app.before_request(lifecycle.ensure_worker)
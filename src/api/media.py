@@ -0,0 +1,273 @@
+"""
+Thumbnails of the photos of users and trips.
+
+Every uploaded photo is also kept on local disk under the SHA-256 of its bytes (the
+Users.photo_hash / Trips.photo_hash column) and resized to WebP derivatives:
+
+    GET /api/media/<hash>/thumb   160 px    avatars
+    GET /api/media/<hash>/card    480 px    cards of the trip feed
+    GET /api/media/<hash>/large   1280 px   detail page
+
+The content never changes for a hash, so the responses are cacheable forever (immutable).
+Derivatives are made by a pool of MEDIA_WORKERS processes (Pillow holds the GIL while it
+resizes) right after the upload, or on the first request when missing. When the original is
+not on this disk (another machine, evicted) it is downloaded again from the photo URL.
+
+    MEDIA_DIR/<hash[:2]>/<hash>/original, thumb.webp, card.webp, large.webp
+
+The directory is shared by the workers and kept under MEDIA_CACHE_SIZE bytes: reads touch the
+mtime of the file and, when the size goes over the limit, the least recently used files are
+deleted until it is 10% under. Hashes that no user or trip has are remembered for MISS_TTL
+seconds, so requests for unknown photos answer 404 without asking the database each time.
+"""
+import hashlib
+import logging
+import multiprocessing
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image, ImageOps
+from api.http_client import http_clients
+from api.models import db, Users, Trips
+
+
+logger = logging.getLogger('api.media')
+
+SIZES = {'thumb': 160, 'card': 480, 'large': 1280}
+WEBP_QUALITY = 80
+HASH = re.compile(r'^[0-9a-f]{64}$')
+TOUCH_INTERVAL = 3600  # Seconds, mtime is the LRU clock and one write per hour per file is enough
+MISS_TTL = 60  # Seconds an unknown hash is answered without the database
+MAX_MISSES = 10000
+
+
+def render(original, target, width, quality=WEBP_QUALITY):
+    """ Runs in the process pool: writes the WebP of original that fits in width x width """
+    with Image.open(original) as image:
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((width, width), Image.LANCZOS)
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'transparency' in image.info or image.mode in ('LA', 'PA') else 'RGB')
+        temporary = f'{target}.{os.getpid()}.tmp'
+        image.save(temporary, 'WEBP', quality=quality, method=4)
+    os.replace(temporary, target)
+    return os.path.getsize(target)
+
+
+class StagedOriginal:
+    """ Copy of an upload written to disk while it streams, hashed on the way """
+
+    def __init__(self, store):
+        self.store = store
+        handle, self.path = tempfile.mkstemp(prefix='upload-', dir=store.directory)
+        self.file = os.fdopen(handle, 'wb')
+        self.digest = hashlib.sha256()
+        self.size = 0
+
+    async def wrap(self, chunks):
+        async for chunk in chunks:
+            self.file.write(chunk)
+            self.digest.update(chunk)
+            self.size += len(chunk)
+            yield chunk
+
+    def commit(self):
+        """ Moves the file to its content address, returns the hash """
+        self.file.close()
+        content_hash = self.digest.hexdigest()
+        self.store.add(content_hash, 'original', self.path, self.size)
+        return content_hash
+
+    def discard(self):
+        self.file.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class MediaStore:
+    def __init__(self, directory=None, max_bytes=1024 ** 3, workers=2, eager=True):
+        self.directory = directory or os.path.join(tempfile.gettempdir(), 'media')
+        self.max_bytes = max_bytes
+        self.workers = workers
+        self.eager = eager
+        self._pool = None
+        self._pending = {}  # (hash, size) → Future, one render per derivative at a time
+        self._lock = threading.Lock()
+        self._estimated = None  # Bytes on disk as known by this worker, recounted when evicting
+        self._misses = OrderedDict()  # Unknown hash → time.monotonic() of the lookup, oldest first
+        self.hits = 0
+        self.renders = 0
+        self.evicted = 0
+
+    def init_app(self, app):
+        self.directory = app.config.get('MEDIA_DIR') or self.directory
+        self.max_bytes = app.config.get('MEDIA_CACHE_SIZE', self.max_bytes)
+        self.workers = app.config.get('MEDIA_WORKERS', self.workers)
+        self.eager = app.config.get('MEDIA_EAGER', self.eager)
+        os.makedirs(self.directory, exist_ok=True)
+
+    def path(self, content_hash, name):
+        filename = 'original' if name == 'original' else f'{name}.webp'
+        return os.path.join(self.directory, content_hash[:2], content_hash, filename)
+
+    def pool(self):
+        # Created on the first use, after gunicorn forked the worker
+        with self._lock:
+            if self._pool is None:
+                # forkserver: the workers don't inherit the threads and connections of the app
+                context = (multiprocessing.get_context('forkserver')
+                           if 'forkserver' in multiprocessing.get_all_start_methods() else None)
+                self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+        return self._pool
+
+    def stage(self):
+        return StagedOriginal(self)
+
+    def add(self, content_hash, name, source, size):
+        target = self.path(content_hash, name)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(source, target)
+        if name == 'original':
+            self._misses.pop(content_hash, None)
+        self._grew(size)
+
+    def _grew(self, size):
+        if self._estimated is None:
+            self._estimated = self.disk_usage()
+        self._estimated += size
+        if self._estimated > self.max_bytes:
+            self.evict()
+
+    def disk_usage(self):
+        return sum(size for _, _, size in self._files())
+
+    def _files(self):
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue  # Evicted by another worker meanwhile
+                yield stat.st_mtime, path, stat.st_size
+
+    def evict(self):
+        """ Deletes the least recently used files until the directory is 10% under the limit """
+        files = sorted(self._files())
+        total = sum(size for _, _, size in files)
+        target = self.max_bytes * 0.9
+        for _, path, size in files:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                self.evicted += 1
+            except FileNotFoundError:
+                pass
+            total -= size
+        self._estimated = total
+
+    def touch(self, path):
+        """ Marks path as used now, returns False if it doesn't exist """
+        try:
+            mtime = os.stat(path).st_mtime
+        except FileNotFoundError:
+            return False
+        now = time.time()
+        if now - mtime > TOUCH_INTERVAL:
+            try:
+                os.utime(path, (now, now))
+            except FileNotFoundError:
+                return False
+        return True
+
+    def schedule(self, content_hash):
+        """ Queues every derivative of a new original, without waiting """
+        if self.eager:
+            for name in SIZES:
+                self._render(content_hash, name)
+
+    def _render(self, content_hash, name):
+        key = (content_hash, name)
+        pool = self.pool()
+        with self._lock:
+            future = self._pending.get(key)
+            if future is None:
+                target = self.path(content_hash, name)
+                future = pool.submit(render, self.path(content_hash, 'original'), target, SIZES[name])
+                future.add_done_callback(lambda done: self._rendered(key, done))
+                self._pending[key] = future
+        return future
+
+    def _rendered(self, key, future):
+        with self._lock:
+            self._pending.pop(key, None)
+        if future.exception() is not None:
+            logger.warning('Thumbnail %s/%s failed: %r', *key, future.exception())
+            return
+        self.renders += 1
+        self._grew(future.result())
+
+    def derivative(self, content_hash, name, timeout=30):
+        """ Path of the derivative, rendered now if needed; None if the photo is unknown """
+        target = self.path(content_hash, name)
+        if self.touch(target):
+            self.hits += 1
+            return target
+        if not self.touch(self.path(content_hash, 'original')) and not self.fetch_original(content_hash):
+            return None
+        try:
+            self._render(content_hash, name).result(timeout)
+        except Exception:
+            # Not an image Pillow can read, or evicted by another worker before the render
+            logger.warning('Thumbnail %s/%s could not be rendered', content_hash, name, exc_info=True)
+            return None
+        return target
+
+    def fetch_original(self, content_hash):
+        """ Downloads the photo with that hash from its URL (the storage), True if it matches """
+        missed = self._misses.get(content_hash)
+        if missed is not None and time.monotonic() - missed < MISS_TTL:
+            return False
+        url = (db.session.execute(db.select(Users.photo).where(Users.photo_hash == content_hash).limit(1)).scalar()
+               or db.session.execute(db.select(Trips.photo).where(Trips.photo_hash == content_hash).limit(1)).scalar())
+        if not url:
+            self._missed(content_hash)
+            return False
+        staged = self.stage()
+        try:
+            http_clients.run(self._download(url, staged))
+        except Exception:
+            staged.discard()
+            logger.warning('Original of %s could not be downloaded from %s', content_hash, url, exc_info=True)
+            return False
+        if staged.digest.hexdigest() != content_hash:
+            staged.discard()
+            logger.warning('%s does not have the content of %s anymore', url, content_hash)
+            return False
+        staged.commit()
+        return True
+
+    def _missed(self, content_hash):
+        with self._lock:
+            self._misses[content_hash] = time.monotonic()
+            self._misses.move_to_end(content_hash)
+            while len(self._misses) > MAX_MISSES:
+                self._misses.popitem(last=False)
+
+    async def _download(self, url, staged):
+        async with http_clients.client().stream('GET', url) as response:
+            response.raise_for_status()
+            async for _ in staged.wrap(response.aiter_bytes()):
+                pass
+
+
+media_store = MediaStore()
+
+
+def setup_media(app):
+    media_store.init_app(app)
@@ -0,0 +1,126 @@
+"""
+Request metrics in the Prometheus text format: GET /metrics.
+
+    http_requests_total{method, endpoint, status}          requests answered (error rate: status=~"5..")
+    http_request_duration_seconds{method, endpoint}         histogram, until the response is returned
+    http_response_size_bytes{endpoint}                      histogram of the bodies with a known length
+    http_request_db_seconds{endpoint}                       histogram of the time in SQL (api/instrumentation.py)
+    http_request_db_queries{endpoint}                       histogram of the SQL statements per request
+    http_request_exceptions_total{endpoint, exception}      unhandled exceptions (answered with a 500)
+
+endpoint is the Flask endpoint (api.get_trip), never the path, so the number of series stays
+bounded; requests that match no route are counted as "none". The time of streamed bodies
+(?stream=1 exports) is not included, only until the first byte.
+
+Every worker of gunicorn is a process with its own counters. prometheus_client keeps them in
+mmap files under PROMETHEUS_MULTIPROC_DIR (set and emptied at start by src/gunicorn.conf.py) and
+/metrics adds up the files of all the workers, whichever answers the scrape. Without that
+variable (flask run) the counters live in the memory of the process.
+
+With METRICS_TOKEN set, /metrics asks for "Authorization: Bearer <METRICS_TOKEN>".
+The internal endpoints of the api (/api/_health/*, @monitoring_required) accept the same header
+or the JWT of an admin, and answer 401 to everyone else even without METRICS_TOKEN.
+"""
+import hmac
+import os
+import time
+from functools import wraps
+from flask import Response, g, got_request_exception, request
+from flask_jwt_extended import current_user, verify_jwt_in_request
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram,
+                               generate_latest, multiprocess)
+from api.instrumentation import current_stats
+from api.utils import APIException
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+REQUESTS = Counter('http_requests_total', 'Requests answered', ('method', 'endpoint', 'status'))
+LATENCY = Histogram('http_request_duration_seconds', 'Time to answer a request', ('method', 'endpoint'),
+                    buckets=LATENCY_BUCKETS)
+RESPONSE_SIZE = Histogram('http_response_size_bytes', 'Size of the response bodies', ('endpoint',),
+                          buckets=SIZE_BUCKETS)
+DB_TIME = Histogram('http_request_db_seconds', 'Time spent in the database per request', ('endpoint',),
+                    buckets=LATENCY_BUCKETS)
+DB_QUERIES = Histogram('http_request_db_queries', 'SQL statements per request', ('endpoint',),
+                       buckets=QUERY_BUCKETS)
+EXCEPTIONS = Counter('http_request_exceptions_total', 'Unhandled exceptions', ('endpoint', 'exception'))
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.enabled = True
+        self.token = None
+        # Labelled children by label values, .labels() costs more than the observation itself
+        self._children = {}
+
+    def init_app(self, app):
+        self.enabled = app.config.get('METRICS_ENABLED', self.enabled)
+        self.token = app.config.get('METRICS_TOKEN')
+        if not self.enabled:
+            return
+        app.before_request(self.start)
+        app.after_request(self.record)
+        got_request_exception.connect(self.exception, app, weak=False)
+        app.add_url_rule('/metrics', 'metrics', self.view)
+
+    def _child(self, metric, *labels):
+        key = (metric, labels)
+        child = self._children.get(key)
+        if child is None:
+            child = self._children[key] = metric.labels(*labels)
+        return child
+
+    def start(self):
+        g.metrics_started = time.perf_counter()
+
+    def record(self, response):
+        started = g.pop('metrics_started', None)
+        if started is None:
+            return response
+        endpoint = request.endpoint or 'none'
+        self._child(REQUESTS, request.method, endpoint, str(response.status_code)).inc()
+        self._child(LATENCY, request.method, endpoint).observe(time.perf_counter() - started)
+        if response.content_length is not None:
+            self._child(RESPONSE_SIZE, endpoint).observe(response.content_length)
+        stats = current_stats()
+        if stats is not None:
+            self._child(DB_TIME, endpoint).observe(stats.duration)
+            self._child(DB_QUERIES, endpoint).observe(stats.count)
+        return response
+
+    def exception(self, sender, exception, **extra):
+        self._child(EXCEPTIONS, request.endpoint or 'none', type(exception).__name__).inc()
+
+    def has_token(self):
+        return bool(self.token) and hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {self.token}')
+
+    def view(self):
+        if self.token and not self.has_token():
+            return Response('Unauthorized\n', status=401, mimetype='text/plain')
+        registry = REGISTRY
+        if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+            registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+        return Response(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
+
+
+request_metrics = RequestMetrics()
+
+
+def monitoring_required(view):
+    """ For the internal endpoints: "Authorization: Bearer <METRICS_TOKEN>" or the JWT of an admin """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not request_metrics.has_token():
+            verify_jwt_in_request()
+            if not current_user.is_admin:
+                raise APIException('Only administrators can see the internal endpoints', status_code=403)
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def setup_metrics(app):
+    request_metrics.init_app(app)
@@ -1,5 +1,6 @@
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
+from api.serializers import Schema
 
 
 db = SQLAlchemy()
@@ -8,16 +9,21 @@ db = SQLAlchemy()
 class Users(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     email = db.Column(db.String(120), unique=True, nullable=False) 
-    password = db.Column(db.String(80), nullable=False)
+    password = db.Column(db.String(255), nullable=False)  # Hash, see api/credentials.py
     first_name = db.Column(db.String(50))
     last_name = db.Column(db.String(50))
     gender = db.Column(db.Enum("male", "female", "non_binary", "other", name='gender'))
     age = db.Column(db.Integer)
     photo = db.Column(db.String(300))  
+    photo_hash = db.Column(db.String(64))  # SHA-256 of the uploaded photo, /api/media/<hash>/<size> (api/media.py)
     biography = db.Column(db.String(500)) 
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     is_active = db.Column(db.Boolean(), nullable=False, default=True)
     is_admin = db.Column(db.Boolean(), nullable=False, default=False)
+    # Counter for the unread badge, maintained by api/notifications.py when notifications are written or read
+    unread_notifications = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+    __table_args__ = (db.Index('ix_users_photo_hash', 'photo_hash'),)
 
  
    
@@ -25,17 +31,11 @@ class Users(db.Model):
         return f'<User {self.id} - {self.email}>'
 
     def serialize(self):
-        return {'id': self.id,
-            'email': self.email,
-            'first_name': self.first_name,
-            'last_name': self.last_name,
-            'gender': self.gender,
-            'age': self.age,
-            'photo': self.photo,
-            'biography': self.biography,
-            'created_at': self.created_at.strftime("%d %m %y"),
-            'is_active': self.is_active,
-            'is_admin': self.is_admin}
+        return Users.schema.dump(self)
+
+
+Users.schema = Schema(Users, ('id', 'email', 'first_name', 'last_name', 'gender', 'age', 'photo', 'photo_hash',
+                              'biography', 'created_at', 'is_active', 'is_admin'))
 
 
 class Trips(db.Model):
@@ -46,6 +46,7 @@ class Trips(db.Model):
     available_seats = db.Column(db.Integer)
     description = db.Column(db.String(200), nullable=False)
     photo = db.Column(db.String(255))  # Imagen opcional
+    photo_hash = db.Column(db.String(64))  # Miniaturas en /api/media/<hash>/<size> (api/media.py)
     budget = db.Column(db.Integer, nullable=False)
     budget_currency = db.Column(db.String(), nullable=False)
     age_min = db.Column(db.Integer)
@@ -53,24 +54,28 @@ class Trips(db.Model):
     status = db.Column(db.Enum('planning', 'finished', 'ongoing', 'cancelled', name='status'), nullable=False) # Enum con estado inicial
     host_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)  # Clave foránea a Users
     host_to = db.relationship('Users', foreign_keys=[host_id], backref=db.backref('host_to', lazy='select'))
-   
+    # Indexes used by the filters and the keyset pagination of GET /api/trips (see api/trip_search.py)
+    __table_args__ = (db.Index('ix_trips_start_date_id', 'start_date', 'id'),
+                      db.Index('ix_trips_status_start_date_id', 'status', 'start_date', 'id'),
+                      db.Index('ix_trips_budget', 'budget'),
+                      db.Index('ix_trips_age_band', 'age_min', 'age_max'),
+                      db.Index('ix_trips_available_seats', 'available_seats'),
+                      db.Index('ix_trips_host_id', 'host_id'),
+                      db.Index('ix_trips_photo_hash', 'photo_hash'))
+
     def __repr__(self):
         return f'<Trip {self.id} - {self.destination} ({self.start_date})>'
 
     def serialize(self):
-        return {'id': self.id,
-            'host_id': self.host_id,
-            'destination': self.destination,
-            'start_date': self.start_date.strftime("%d %m %y"),
-            'end_date': self.end_date.strftime("%d %m %y"),
-            'available_seats': self.available_seats,
-            'description': self.description,
-            'photo': self.photo,
-            'budget': self.budget,
-            'budget_currency': self.budget_currency,
-            'age_min': self.age_min,
-            'age_max': self.age_max,
-            'status': self.status}
+        return Trips.schema.dump(self)
+
+
+Trips.schema = Schema(Trips, ('id', 'host_id', 'destination', 'start_date', 'end_date', 'available_seats', 'description',
+                              'photo', 'photo_hash', 'budget', 'budget_currency', 'age_min', 'age_max', 'status'))
+
+
+# Destination filter is a case insensitive prefix match, lower(destination) LIKE 'prefix%'
+db.Index('ix_trips_destination_lower', db.func.lower(Trips.destination))
 
 
 class Favorites(db.Model):
@@ -79,14 +84,18 @@ class Favorites(db.Model):
     trip_to = db.relationship("Trips", foreign_keys=[trip_id], backref=db.backref('favorite_to', lazy='select'))
     user_id = db.Column(db.Integer, db.ForeignKey("users.id"))
     user_to = db.relationship("Users", foreign_keys=[user_id], backref=db.backref('favorite_to', lazy='select'))
+    # The unique index also answers "which of these trips are favorites of the user" (see api/favorites.py)
+    __table_args__ = (db.UniqueConstraint('user_id', 'trip_id', name='uq_favorites_user_trip'),
+                      db.Index('ix_favorites_trip_id', 'trip_id'))
 
     def __repr__(self):
         return f'<Favorite {self.id} - User {self.user_id} - Trip {self.trip_id}>'
 
     def serialize(self):
-        return {'id': self.id,
-            'trip_id': self.trip_id,
-            'user_id': self.user_id}
+        return Favorites.schema.dump(self)
+
+
+Favorites.schema = Schema(Favorites, ('id', 'trip_id', 'user_id'))
 
 
 class Notifications(db.Model):
@@ -96,16 +105,19 @@ class Notifications(db.Model):
     date = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
     user_to = db.relationship("Users", foreign_keys=[user_id], backref=db.backref('notification_to', lazy='select'))
+    # Inbox pages are read newest first by user, the partial index only holds the unread ones
+    __table_args__ = (db.Index('ix_notifications_user_date_id', 'user_id', 'date', 'id'),
+                      db.Index('ix_notifications_unread', 'user_id', 'date', 'id',
+                               postgresql_where=db.text('NOT read'), sqlite_where=db.text('read = 0')))
 
     def __repr__(self):
         return f'<Notification {self.id} - User {self.user_id} - Read {self.read}>'
 
     def serialize(self):
-        return {'id': self.id,
-            'user_id': self.user_id,
-            'message': self.message,
-            'read': self.read,
-            'date': self.date.strftime()}
+        return Notifications.schema.dump(self)
+
+
+Notifications.schema = Schema(Notifications, ('id', 'user_id', 'message', 'read', 'date'))
 
 
 class Travelers(db.Model):
@@ -116,15 +128,16 @@ class Travelers(db.Model):
     trip_to = db.relationship("Trips", foreign_keys=[trip_id], backref=db.backref('traveler_to', lazy='select'))
     traveler_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False) 
     traveler_to = db.relationship("Users", foreign_keys=[traveler_id], backref=db.backref('traveler_to', lazy='select'))
+    # One request per user and trip, see api/reservations.py
+    __table_args__ = (db.UniqueConstraint('trip_id', 'traveler_id', name='uq_travelers_trip_traveler'),
+                      # Trips of a user (api/recommendations.py)
+                      db.Index('ix_travelers_traveler_id', 'traveler_id'))
 
     def __repr__(self):
         return f'<Traveler {self.id} - Trip {self.trip_id} - Traveler {self.traveler_id} - Status {self.status}>'
     # Método serialize para convertir el objeto a un formato JSON
     def serialize(self):
-        return {'id': self.id,
-            'trip_id': self.trip_id,
-            'traveler_id': self.traveler_id,
-            'status': self.status, 
-            'created_at': self.created_at.strftime()}
+        return Travelers.schema.dump(self)
 
 
+Travelers.schema = Schema(Travelers, ('id', 'trip_id', 'traveler_id', 'status', 'created_at'))
@@ -0,0 +1,245 @@
+"""
+Notification fan-out.
+Request handlers only enqueue an event (a few microseconds, no SQL). A background thread of
+the same process takes the events in batches, finds every user affected by each trip (the
+host and all the travelers) with one query per batch and writes all the notifications with
+one executemany INSERT.
+
+Backpressure: the queue holds NOTIFICATIONS_MAX_QUEUE events, when it is full enqueue()
+returns False and the event is counted as dropped instead of blocking the request.
+stats() exposes the queue depth and the counters (GET /api/_health/notifications).
+
+Unread badge: Users.unread_notifications is incremented in the same transaction that writes
+the notifications and decremented by the rows each read actually marks, in the same UPDATE
+statement, so notifications written at the same moment are never wiped from it.
+unread_count() is a primary key lookup, cached for UNREAD_COUNT_TTL seconds; recount_unread()
+(with the partial index on unread rows) corrects any drift.
+"""
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from sqlalchemy import bindparam, tuple_
+from api.cache import MemoryBackend
+from api.models import db, Users, Trips, Travelers, Notifications
+from api.pagination import decode_cursor, encode_cursor, page_size
+
+
+logger = logging.getLogger('api.notifications')
+
+UNREAD_COUNT_TTL = 10
+_unread_counts = MemoryBackend(max_entries=10000)
+
+MESSAGES = {
+    'trip_status': 'El viaje a {destination} ahora está {status}',
+    'traveler_applied': 'Hay una nueva solicitud para tu viaje a {destination}',
+    'traveler_status': 'Tu solicitud para el viaje a {destination} fue {status}',
+}
+STATUS_NAMES = {'planning': 'en planificación', 'ongoing': 'en curso', 'finished': 'finalizado',
+                'cancelled': 'cancelado', 'approved': 'aprobada', 'declined': 'rechazada', 'pending': 'pendiente'}
+
+
+class NotificationEvent:
+    """ kind is a key of MESSAGES. Without user_ids the recipients are the host and the travelers
+    of the trip, except actor_id (the user that caused the event) """
+    __slots__ = ('kind', 'trip_id', 'actor_id', 'user_ids', 'data', 'date')
+
+    def __init__(self, kind, trip_id, actor_id=None, user_ids=None, **data):
+        self.kind = kind
+        self.trip_id = trip_id
+        self.actor_id = actor_id
+        self.user_ids = user_ids
+        self.data = data
+        self.date = datetime.utcnow()
+
+
+class NotificationDispatcher:
+    def __init__(self, max_queue=10000, batch_size=500, flush_interval=0.2):
+        self.app = None
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(max_queue)
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self.counters = {'enqueued': 0, 'dropped': 0, 'delivered': 0, 'batches': 0, 'errors': 0}
+
+    def init_app(self, app):
+        self.app = app
+        self.max_queue = app.config.get('NOTIFICATIONS_MAX_QUEUE', self.max_queue)
+        self.batch_size = app.config.get('NOTIFICATIONS_BATCH_SIZE', self.batch_size)
+        self._queue = queue.Queue(self.max_queue)
+        atexit.register(self.flush, 5)
+
+    def _ensure_worker(self):
+        # Threads don't survive the fork of the gunicorn workers, start one per process
+        if self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid != os.getpid() or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='notifications', daemon=True)
+                self._thread.start()
+                self._pid = os.getpid()
+
+    def enqueue(self, event):
+        """ Returns False when the queue is full (the event is dropped) """
+        self._ensure_worker()
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            self.counters['dropped'] += 1
+            logger.warning('Notification queue full, dropped %s event for trip %s', event.kind, event.trip_id)
+            return False
+        self.counters['enqueued'] += 1
+        return True
+
+    def notify(self, kind, trip_id, actor_id=None, user_ids=None, **data):
+        return self.enqueue(NotificationEvent(kind, trip_id, actor_id, user_ids, **data))
+
+    def flush(self, timeout=None):
+        """ Waits until every queued event was written, returns False on timeout """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if self._thread is None or not self._thread.is_alive():
+                return False
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def stats(self):
+        return dict(self.counters, queue_depth=self._queue.qsize(), max_queue=self.max_queue,
+                    worker_alive=self._thread is not None and self._thread.is_alive())
+
+    def _next_batch(self):
+        events = [self._queue.get()]
+        deadline = time.monotonic() + self.flush_interval
+        while len(events) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                events.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return events
+
+    def _run(self):
+        while True:
+            events = self._next_batch()
+            try:
+                with self.app.app_context():
+                    self.counters['delivered'] += self.deliver(events)
+                    self.counters['batches'] += 1
+            except Exception:
+                self.counters['errors'] += 1
+                logger.exception('Could not deliver %s notification events', len(events))
+            finally:
+                for _ in events:
+                    self._queue.task_done()
+
+    def deliver(self, events):
+        """ Writes the notifications of a batch of events, returns the number of rows """
+        trip_ids = {event.trip_id for event in events}
+        trips = {row.id: row for row in db.session.execute(
+            db.select(Trips.id, Trips.destination, Trips.host_id).where(Trips.id.in_(trip_ids)))}
+        travelers = {}
+        for trip_id, traveler_id in db.session.execute(
+                db.select(Travelers.trip_id, Travelers.traveler_id).where(Travelers.trip_id.in_(trip_ids))):
+            travelers.setdefault(trip_id, set()).add(traveler_id)
+
+        rows = []
+        for event in events:
+            trip = trips.get(event.trip_id)
+            if trip is None:
+                continue
+            recipients = event.user_ids
+            if recipients is None:
+                recipients = travelers.get(trip.id, set()) | {trip.host_id}
+            data = dict(event.data)
+            if 'status' in data:
+                data['status'] = STATUS_NAMES.get(data['status'], data['status'])
+            message = MESSAGES[event.kind].format(destination=trip.destination, **data)
+            rows.extend({'message': message, 'read': False, 'date': event.date, 'user_id': user_id}
+                        for user_id in recipients if user_id != event.actor_id)
+        if rows:
+            db.session.execute(db.insert(Notifications), rows)
+            per_user = Counter(row['user_id'] for row in rows)
+            db.session.execute(db.update(Users.__table__)
+                               .where(Users.__table__.c.id == bindparam('user_id'))
+                               .values(unread_notifications=Users.__table__.c.unread_notifications + bindparam('count')),
+                               [{'user_id': user_id, 'count': count} for user_id, count in per_user.items()])
+        db.session.commit()
+        for user_id in {row['user_id'] for row in rows}:
+            _unread_counts.delete(user_id)
+        return len(rows)
+
+
+dispatcher = NotificationDispatcher()
+
+
+def mark_read(user_id, ids=None):
+    """ Marks the notifications `ids` (all of them if None) of the user as read with one UPDATE """
+    query = db.update(Notifications).where(Notifications.user_id == user_id, Notifications.read.is_(False))
+    if ids is not None:
+        query = query.where(Notifications.id.in_(ids))
+    result = db.session.execute(query.values(read=True).execution_options(synchronize_session=False))
+    # Subtract what this UPDATE marked: the dispatcher may be adding to the counter meanwhile, and
+    # a recount (or 0 for "all") would drop the notifications it commits between both statements
+    if result.rowcount:
+        counter = Users.__table__.c.unread_notifications
+        unread = db.case((counter > result.rowcount, counter - result.rowcount), else_=0)
+        db.session.execute(db.update(Users).where(Users.id == user_id).values(unread_notifications=unread)
+                           .execution_options(synchronize_session=False))
+    db.session.commit()
+    _unread_counts.delete(user_id)
+    return result.rowcount
+
+
+def recount_unread(first_user_id=None):
+    """ Recomputes the unread counters with one set based UPDATE, for rows written without the dispatcher """
+    unread = (db.select(db.func.count(Notifications.id))
+              .where(Notifications.user_id == Users.id, Notifications.read.is_(False))
+              .scalar_subquery())
+    query = db.update(Users).values(unread_notifications=unread)
+    if first_user_id is not None:
+        query = query.where(Users.id >= first_user_id)
+    db.session.execute(query.execution_options(synchronize_session=False))
+    db.session.commit()
+    _unread_counts.clear()
+
+
+def unread_count(user_id):
+    count = _unread_counts.get(user_id)
+    if count is None:
+        count = db.session.execute(db.select(Users.unread_notifications).where(Users.id == user_id)).scalar() or 0
+        _unread_counts.set(user_id, count, UNREAD_COUNT_TTL)
+    return count
+
+
+def inbox(user_id, args):
+    """ One page of notifications, newest first. ?unread=1 only returns the unread ones """
+    limit = page_size(args)
+    query = db.select(*Notifications.schema.columns()).where(Notifications.user_id == user_id)
+    if args.get('unread', '').lower() in ('1', 'true', 'yes'):
+        query = query.where(Notifications.read.is_(False))
+    cursor = args.get('cursor')
+    if cursor:
+        date, notification_id = decode_cursor(cursor, datetime, int)
+        query = query.where(tuple_(Notifications.date, Notifications.id) < tuple_(date, notification_id))
+    query = query.order_by(Notifications.date.desc(), Notifications.id.desc()).limit(limit + 1)
+    rows = db.session.execute(query).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].date, rows[-1].id)
+    return Notifications.schema.dump_rows(rows), next_cursor
+
+
+def setup_notifications(app):
+    dispatcher.init_app(app)
@@ -0,0 +1,42 @@
+"""
+Keyset (cursor) pagination helpers.
+A cursor is an opaque, url-safe token that stores the sort key of the last row of a page,
+so the next page is a range scan on an index instead of an OFFSET that grows with the table.
+"""
+import base64
+import json
+from datetime import datetime
+from api.utils import APIException
+
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+
+def encode_cursor(*values):
+    payload = [value.isoformat() if isinstance(value, datetime) else value for value in values]
+    raw = json.dumps(payload, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token, *types):
+    """ Returns the values stored by encode_cursor() converted to the given types """
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        payload = json.loads(raw)
+        if len(payload) != len(types):
+            raise ValueError(token)
+        return tuple(datetime.fromisoformat(value) if kind is datetime else kind(value)
+                     for kind, value in zip(types, payload))
+    except (ValueError, TypeError):
+        raise APIException('Invalid cursor', status_code=400)
+
+
+def page_size(args, default=DEFAULT_PAGE_SIZE, maximum=MAX_PAGE_SIZE):
+    try:
+        limit = int(args.get('limit', default))
+    except ValueError:
+        raise APIException('limit must be an integer', status_code=400)
+    if limit < 1:
+        raise APIException('limit must be greater than 0', status_code=400)
+    return min(limit, maximum)
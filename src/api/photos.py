@@ -0,0 +1,176 @@
+"""
+Upload of the photos of users and trips (Users.photo, Trips.photo).
+
+    PUT /api/users/photo         photo of the authenticated user
+    PUT /api/trips/<id>/photo    photo of a trip, only its host
+
+The body is the image itself (Content-Type image/jpeg, image/png or image/webp, up to
+PHOTO_MAX_SIZE bytes), sent on to the storage as it arrives with a PUT to STORAGE_URL/<key>
+through the pooled async client (api/http_client.py), never kept whole in memory. The public
+URL (STORAGE_PUBLIC_URL/<key>) is saved in the photo column.
+
+The storage is any server that accepts PUT of objects: S3 compatible buckets, WebDAV, or
+benchmarks/fake_storage.py in development. Under WSGI the upload keeps the worker busy until the
+storage answers; under ASGI (src/asgi.py) it only awaits on the event loop.
+"""
+import asyncio
+import logging
+import uuid
+import httpx
+from flask import current_app
+from api.http_client import http_clients
+from api.media import media_store
+from api.models import db, Users, Trips
+from api.signals import trip_changed
+from api.utils import APIException
+
+
+logger = logging.getLogger('api.photos')
+
+# Content-Type → (extension, first bytes of the file)
+PHOTO_TYPES = {'image/jpeg': ('jpg', (b'\xff\xd8\xff',)),
+               'image/png': ('png', (b'\x89PNG\r\n\x1a\n',)),
+               'image/webp': ('webp', (b'RIFF',))}
+SIGNATURE_SIZE = 12
+READ_SIZE = 64 * 1024
+
+
+class StorageError(Exception):
+    pass
+
+
+class HTTPStorage:
+    def __init__(self, url, public_url=None, token=None):
+        self.url = url.rstrip('/')
+        self.public_url = (public_url or url).rstrip('/')
+        self.token = token
+
+    async def put(self, key, chunks, content_type, length=None):
+        """ Streams the async iterable chunks to the object key, returns its public URL """
+        headers = {'Content-Type': content_type}
+        if length is not None:
+            headers['Content-Length'] = str(length)  # Without it the body goes chunked
+        if self.token:
+            headers['Authorization'] = f'Bearer {self.token}'
+        try:
+            response = await http_clients.client().put(f'{self.url}/{key}', content=chunks, headers=headers)
+        except httpx.HTTPError as error:
+            raise StorageError(f'Storage unavailable: {error!r}') from error
+        if response.status_code >= 300:
+            raise StorageError(f'Storage answered {response.status_code} to PUT {key}')
+        return f'{self.public_url}/{key}'
+
+
+class PhotoUploads:
+    def __init__(self):
+        self.storage = None
+        self.max_size = 10 * 1024 * 1024
+
+    def init_app(self, app):
+        url = app.config.get('STORAGE_URL')
+        self.storage = None
+        if url:
+            self.storage = HTTPStorage(url, app.config.get('STORAGE_PUBLIC_URL'), app.config.get('STORAGE_TOKEN'))
+        self.max_size = app.config.get('PHOTO_MAX_SIZE', self.max_size)
+
+    def check(self, content_type, length):
+        """ Validates the headers before reading the body, returns the normalized Content-Type """
+        if self.storage is None:
+            raise APIException('Photo storage is not configured (STORAGE_URL)', status_code=503)
+        content_type = (content_type or '').split(';')[0].strip().lower()
+        if content_type not in PHOTO_TYPES:
+            raise APIException(f'Content-Type must be one of {", ".join(PHOTO_TYPES)}', status_code=415)
+        if length is not None and length > self.max_size:
+            raise APIException(f'The photo can be up to {self.max_size} bytes', status_code=413)
+        return content_type
+
+    async def _checked(self, chunks, content_type):
+        """ Passes the chunks through, failing on a body that is not the declared image or is too big """
+        size = 0
+        head = b''
+        async for chunk in chunks:
+            size += len(chunk)
+            if size > self.max_size:
+                raise APIException(f'The photo can be up to {self.max_size} bytes', status_code=413)
+            if len(head) < SIGNATURE_SIZE:
+                head += chunk[:SIGNATURE_SIZE]
+                if len(head) >= SIGNATURE_SIZE and not _valid_signature(head, content_type):
+                    raise APIException(f'The body is not a {content_type} image', status_code=400)
+            if chunk:
+                yield chunk
+        if not _valid_signature(head, content_type):
+            raise APIException(f'The body is not a {content_type} image', status_code=400)
+
+    async def upload(self, kind, object_id, chunks, content_type, length=None):
+        """ Streams the photo of users/<id> or trips/<id> to the storage and, on the way, to the local
+        copy the thumbnails are made from (api/media.py). Returns (URL, content hash) """
+        key = f'{kind}/{object_id}/{uuid.uuid4().hex}.{PHOTO_TYPES[content_type][0]}'
+        staged = media_store.stage()
+        try:
+            url = await self.storage.put(key, staged.wrap(self._checked(chunks, content_type)), content_type, length)
+        except StorageError as error:
+            staged.discard()
+            logger.warning(str(error))
+            raise APIException('The photo could not be stored, try again later', status_code=502) from error
+        except BaseException:
+            staged.discard()
+            raise
+        content_hash = await asyncio.to_thread(staged.commit)
+        media_store.schedule(content_hash)
+        return url, content_hash
+
+
+def _valid_signature(head, content_type):
+    if content_type == 'image/webp':
+        return head[:4] == b'RIFF' and head[8:12] == b'WEBP'
+    return any(head.startswith(signature) for signature in PHOTO_TYPES[content_type][1])
+
+
+photo_uploads = PhotoUploads()
+
+
+def authorize(kind, object_id, user_id):
+    """ Only the user changes its photo and only the host the photo of a trip """
+    if kind == 'trips':
+        host_id = db.session.execute(db.select(Trips.host_id).where(Trips.id == object_id)).scalar()
+        if host_id is None:
+            raise APIException('Trip not found', status_code=404)
+        if host_id != user_id:
+            raise APIException('No tienes permiso para modificar este viaje', status_code=403)
+    elif object_id != user_id:
+        raise APIException('You can only change your own photo', status_code=403)
+
+
+def save_photo(kind, object_id, url, content_hash):
+    """ Stores the URL and the content hash (thumbnails) in the row and returns it serialized """
+    row = db.session.get(Trips if kind == 'trips' else Users, object_id)
+    if row is None:
+        raise APIException('Not found', status_code=404)
+    row.photo = url
+    row.photo_hash = content_hash
+    db.session.commit()
+    if kind == 'trips':
+        trip_changed.send(current_app._get_current_object(), trip_id=object_id, change='updated')
+    return row.serialize()
+
+
+async def read_stream(stream, size=READ_SIZE):
+    """ Async iterator over a blocking file object (the WSGI input), each read in a thread """
+    while True:
+        chunk = await asyncio.to_thread(stream.read, size)
+        if not chunk:
+            return
+        yield chunk
+
+
+def upload_from_request(request, kind, object_id, user_id):
+    """ Upload of a WSGI view: validates, streams request.stream to the storage and saves the URL """
+    content_type = photo_uploads.check(request.content_type, request.content_length)
+    authorize(kind, object_id, user_id)
+    url, content_hash = http_clients.run(photo_uploads.upload(kind, object_id, read_stream(request.stream),
+                                                              content_type, request.content_length))
+    return save_photo(kind, object_id, url, content_hash)
+
+
+def setup_photos(app):
+    photo_uploads.init_app(app)
@@ -0,0 +1,216 @@
+"""
+Token bucket rate limiting for the api blueprint.
+
+A limit like '5/minute per email' is a bucket of 5 tokens refilled at 5 per minute for every
+email; a request takes one token and gets 429 Too Many Requests with Retry-After when the
+bucket is empty. Keys:
+    ip     client address (RATE_LIMIT_PROXIES = number of proxies in front of the app that
+           append to X-Forwarded-For, 1 on Heroku and Render)
+    email  "email" of the JSON body, for login and register
+
+Limits are declared on the views with @rate_limit(...) and can be replaced per endpoint with
+app.config['RATE_LIMITS'] = {'api.login': ['10/minute per ip']}. RATE_LIMIT_DEFAULT applies
+one more limit to every endpoint of the blueprint (none by default).
+
+Stores: MemoryStore (per process, default) and RedisStore, shared by every worker when
+RATE_LIMIT_URL (or CACHE_URL) is redis://... The check is a dictionary lookup and a little
+arithmetic under a lock, see benchmarks/bench_rate_limit.py.
+"""
+import logging
+import math
+import re
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app, jsonify, request
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+
+logger = logging.getLogger('api.rate_limit')
+
+UNITS = {'second': 1, 'minute': 60, 'hour': 3600, 'day': 86400}
+_LIMIT = re.compile(r'^\s*(\d+)\s*/\s*(second|minute|hour|day)\s*(?:per\s+(ip|email))?\s*$')
+
+
+class Limit:
+    __slots__ = ('text', 'capacity', 'rate', 'key')
+
+    def __init__(self, text):
+        match = _LIMIT.match(text)
+        if match is None:
+            raise ValueError(f'Invalid rate limit {text!r}, use "<count>/<second|minute|hour|day> [per ip|email]"')
+        count, unit, key = match.groups()
+        self.text = text
+        self.capacity = int(count)
+        self.rate = int(count) / UNITS[unit]  # Tokens per second
+        self.key = key or 'ip'
+
+
+class MemoryStore:
+    def __init__(self, max_entries=100000):
+        self.max_entries = max_entries
+        self._buckets = OrderedDict()  # key → [tokens, updated, rate, capacity], least recently used first
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, capacity, cost=1):
+        """ Returns (allowed, seconds until there are enough tokens) """
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                # The least recently used bucket goes first, it is the one most likely refilled by now
+                while len(self._buckets) >= self.max_entries:
+                    self._buckets.popitem(last=False)
+                bucket = self._buckets[key] = [capacity, now, rate, capacity]
+            else:
+                self._buckets.move_to_end(key)
+                bucket[0] = min(capacity, bucket[0] + (now - bucket[1]) * rate)
+                bucket[1] = now
+            if bucket[0] >= cost:
+                bucket[0] -= cost
+                return True, 0
+            return False, (cost - bucket[0]) / rate
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+class RedisStore:
+    # Atomic refill + take, with the clock of Redis so every worker agrees on the time
+    SCRIPT = """
+    local rate = tonumber(ARGV[1])
+    local capacity = tonumber(ARGV[2])
+    local cost = tonumber(ARGV[3])
+    local clock = redis.call('TIME')
+    local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+    local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+    local tokens = tonumber(state[1]) or capacity
+    local updated = tonumber(state[2]) or now
+    tokens = math.min(capacity, tokens + (now - updated) * rate)
+    local allowed = 0
+    local retry = 0
+    if tokens >= cost then
+        tokens = tokens - cost
+        allowed = 1
+    else
+        retry = (cost - tokens) / rate
+    end
+    redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+    redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / rate * 1000))
+    return {allowed, tostring(retry)}
+    """
+
+    def __init__(self, url, prefix='ratelimit:'):
+        if redis is None:
+            raise RuntimeError('RATE_LIMIT_URL=redis://... requires the redis package')
+        self.prefix = prefix
+        self._client = redis.Redis.from_url(url)
+        self._script = self._client.register_script(self.SCRIPT)
+
+    def take(self, key, rate, capacity, cost=1):
+        try:
+            allowed, retry = self._script(keys=[self.prefix + key], args=[rate, capacity, cost])
+        except redis.RedisError:
+            # Better to let the requests in than to take the API down with Redis
+            logger.warning('Rate limit store unavailable, request allowed', exc_info=True)
+            return True, 0
+        return bool(allowed), float(retry)
+
+    def clear(self):
+        for key in self._client.scan_iter(self.prefix + '*'):
+            self._client.delete(key)
+
+
+def make_store(url=None):
+    if url and url.startswith(('redis://', 'rediss://')):
+        return RedisStore(url)
+    return MemoryStore()
+
+
+def rate_limit(*limits):
+    """ Declares the limits of a view: @rate_limit('10/minute per ip', '5/minute per email') """
+    parsed = [Limit(text) for text in limits]
+
+    def decorator(view):
+        view.rate_limits = parsed
+        return view
+    return decorator
+
+
+class RateLimiter:
+    def __init__(self, store=None):
+        self.store = store or MemoryStore()
+        self.enabled = True
+        self.proxies = 0
+        self.default = []
+        self.overrides = {}
+        self._endpoints = {}  # endpoint → [(bucket prefix, Limit)], resolved on the first request
+        self.rejected = 0
+
+    def init_app(self, app):
+        self.store = make_store(app.config.get('RATE_LIMIT_URL') or app.config.get('CACHE_URL'))
+        self.enabled = app.config.get('RATE_LIMIT_ENABLED', True)
+        self.proxies = app.config.get('RATE_LIMIT_PROXIES', 0)
+        default = app.config.get('RATE_LIMIT_DEFAULT')
+        self.default = [Limit(text) for text in default.split(',')] if default else []
+        self.overrides = {endpoint: [Limit(text) for text in limits]
+                          for endpoint, limits in app.config.get('RATE_LIMITS', {}).items()}
+        self._endpoints = {}
+
+    def _limits(self, endpoint):
+        limits = self._endpoints.get(endpoint)
+        if limits is None:
+            view = current_app.view_functions.get(endpoint)
+            own = self.overrides.get(endpoint, getattr(view, 'rate_limits', []))
+            limits = [('default', limit) for limit in self.default] + [(endpoint, limit) for limit in own]
+            self._endpoints[endpoint] = limits
+        return limits
+
+    def client_ip(self):
+        if self.proxies:
+            forwarded = request.headers.get('X-Forwarded-For')
+            if forwarded:
+                hops = forwarded.split(',')
+                if len(hops) >= self.proxies:
+                    # The entries before the ones appended by our proxies can be forged by the client
+                    return hops[-self.proxies].strip()
+        return request.remote_addr or 'unknown'
+
+    def _key(self, limit):
+        if limit.key == 'email':
+            data = request.get_json(silent=True)
+            email = data.get('email') if isinstance(data, dict) else None
+            return email.strip().lower() if isinstance(email, str) and email.strip() else None
+        return self.client_ip()
+
+    def check(self):
+        """ before_request of the blueprint, returns the 429 response when a bucket is empty """
+        if not self.enabled or request.method == 'OPTIONS':
+            return None
+        limits = self._limits(request.endpoint)
+        if not limits:
+            return None
+        for prefix, limit in limits:
+            key = self._key(limit)
+            if key is None:
+                continue
+            allowed, retry_after = self.store.take(f'{prefix}:{limit.key}:{key}', limit.rate, limit.capacity)
+            if not allowed:
+                self.rejected += 1
+                response = jsonify(message='Too many requests, try again later', limit=limit.text)
+                response.status_code = 429
+                response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+                return response
+        return None
+
+
+rate_limiter = RateLimiter()
+
+
+def setup_rate_limit(app):
+    rate_limiter.init_app(app)
@@ -0,0 +1,255 @@
+"""
+Trip recommendations (GET /api/recommendations).
+
+The trips open to new travelers (status planning) live in a CandidateMatrix: one NumPy array
+per attribute (dates, age band, seats, budget, currency, destination...) so scoring every
+candidate for a user is a handful of vectorized operations instead of a loop in Python.
+
+    eligible: the age of the user is in the age band, there are seats, the trip has not started,
+              the user is not the host, hasn't joined it or marked it as favorite already
+    score:    0.35 dates (overlap with ?date_from/?date_to, or how soon it starts)
+            + 0.35 budget (closeness to ?budget or to the budgets of the user's favorites)
+            + 0.30 destination (share of the user's favorites with that destination)
+
+The matrix is loaded on the first request and kept in the process. trip_changed marks trips
+as dirty and the next request reloads only those rows; removed trips are flagged dead and the
+matrix is rebuilt when they pile up or after RECOMMENDATIONS_MAX_AGE seconds (writes of other
+processes). Reloads work on copies and publish the arrays and their codes together as one
+snapshot, so a request scoring the previous one never sees them half updated.
+"""
+import logging
+import math
+import threading
+import time
+from datetime import datetime
+import numpy as np
+from api.models import db, Users, Trips, Travelers, Favorites
+from api.signals import trip_changed
+from api.trip_search import _date_arg, _int_arg
+from api.utils import APIException
+
+
+logger = logging.getLogger('api.recommendations')
+
+WEIGHTS = {'dates': 0.35, 'budget': 0.35, 'destination': 0.30}
+MAX_RECOMMENDATIONS = 50
+EPOCH = datetime(1970, 1, 1)
+
+
+def _days(value):
+    return (value - EPOCH).total_seconds() / 86400
+
+
+class CandidateMatrix:
+    COLUMNS = {'id': np.int64, 'host_id': np.int64, 'start': np.float64, 'end': np.float64,
+               'age_min': np.float64, 'age_max': np.float64, 'seats': np.int32, 'budget': np.float64,
+               'currency': np.int32, 'destination': np.int32, 'alive': np.bool_}
+
+    def __init__(self, max_age=600, rebuild_after=5000):
+        self.max_age = max_age
+        self.rebuild_after = rebuild_after
+        self._lock = threading.Lock()
+        self._built_at = None
+        self._dirty = set()
+        self.size = 0
+        self.dead = 0
+        self.arrays = {name: np.empty(0, dtype) for name, dtype in self.COLUMNS.items()}
+        self.positions = {}
+        self.currencies = {}
+        self.destinations = {}
+        # (size, arrays, positions, currencies, destinations) read by top(), replaced and never modified
+        self.snapshot = (0, self.arrays, self.positions, self.currencies, self.destinations)
+
+    def _query(self):
+        return db.select(Trips.id, Trips.host_id, Trips.start_date, Trips.end_date, Trips.age_min, Trips.age_max,
+                         Trips.available_seats, Trips.budget, Trips.budget_currency,
+                         Trips.destination).where(Trips.status == 'planning')
+
+    def _code(self, codes, value):
+        return codes.setdefault(value, len(codes))
+
+    def _values(self, row):
+        return (row.id, row.host_id, _days(row.start_date), _days(row.end_date),
+                row.age_min if row.age_min is not None else 0,
+                row.age_max if row.age_max is not None else math.inf,
+                row.available_seats or 0, row.budget, self._code(self.currencies, row.budget_currency),
+                self._code(self.destinations, row.destination.strip().lower()), True)
+
+    def build(self):
+        started = time.perf_counter()
+        self.currencies = {}
+        self.destinations = {}
+        rows = [self._values(row) for row in db.session.execute(self._query().execution_options(yield_per=5000))]
+        columns = list(zip(*rows)) if rows else [()] * len(self.COLUMNS)
+        self.arrays = {name: np.array(values, dtype=dtype) for (name, dtype), values in zip(self.COLUMNS.items(), columns)}
+        self.size = len(rows)
+        self.dead = 0
+        self.positions = {row[0]: position for position, row in enumerate(rows)}
+        self._dirty = set()
+        self._publish()
+        self._built_at = time.monotonic()
+        logger.info('Recommendation matrix built: %s trips in %.2fs', self.size, time.perf_counter() - started)
+
+    def _append(self, values):
+        if self.size == len(self.arrays['id']):
+            # Grow by doubling so appends are amortized O(1)
+            capacity = max(16, self.size * 2)
+            for name, array in self.arrays.items():
+                grown = np.zeros(capacity, array.dtype)
+                grown[:self.size] = array[:self.size]
+                self.arrays[name] = grown
+        self.positions[values[0]] = self.size
+        self._write(self.size, values)
+        self.size += 1
+
+    def _write(self, position, values):
+        for array, value in zip(self.arrays.values(), values):
+            array[position] = value
+
+    def _publish(self):
+        self.snapshot = (self.size, self.arrays, self.positions, self.currencies, self.destinations)
+
+    def _refresh(self, chunk_size=500):
+        # Copied and removed in place (single C calls): mark_dirty keeps adding without the lock
+        dirty = list(self._dirty)
+        self._dirty -= set(dirty)
+        # The published snapshot keeps the old arrays and codes, the changes go to copies
+        self.arrays = {name: array.copy() for name, array in self.arrays.items()}
+        self.positions = dict(self.positions)
+        self.currencies = dict(self.currencies)
+        self.destinations = dict(self.destinations)
+        for start in range(0, len(dirty), chunk_size):
+            chunk = dirty[start:start + chunk_size]
+            found = {row.id: row for row in db.session.execute(self._query().where(Trips.id.in_(chunk)))}
+            for trip_id in chunk:
+                position = self.positions.get(trip_id)
+                row = found.get(trip_id)
+                if row is not None and position is not None:
+                    self._write(position, self._values(row))
+                elif row is not None:
+                    self._append(self._values(row))
+                elif position is not None:
+                    # Deleted or not open anymore
+                    self.arrays['alive'][position] = False
+                    del self.positions[trip_id]
+                    self.dead += 1
+        self._publish()
+
+    def mark_dirty(self, trip_id=None):
+        """ Reloads the trip on the next request, every trip when trip_id is None """
+        if trip_id is None:
+            self._built_at = None
+        elif self._built_at is not None:
+            self._dirty.add(trip_id)
+
+    def ensure_ready(self):
+        with self._lock:
+            if (self._built_at is None or time.monotonic() - self._built_at > self.max_age
+                    or self.dead + len(self._dirty) > max(self.rebuild_after, self.size // 4)):
+                self.build()
+            elif self._dirty:
+                self._refresh()
+
+    def top(self, profile, limit):
+        """ [(trip_id, score)] of the best `limit` eligible trips for the profile (see user_profile()) """
+        size, arrays, positions, currencies, destinations = self.snapshot
+        array = {name: values[:size] for name, values in arrays.items()}
+        now = _days(datetime.utcnow())
+
+        eligible = array['alive'] & (array['start'] > now) & (array['seats'] >= profile['seats'])
+        eligible &= array['host_id'] != profile['user_id']
+        if profile['age'] is not None:
+            eligible &= (array['age_min'] <= profile['age']) & (array['age_max'] >= profile['age'])
+
+        length = array['end'] - array['start'] + 1
+        if profile['date_from'] is not None or profile['date_to'] is not None:
+            window_start = _days(profile['date_from']) if profile['date_from'] else now
+            window_end = _days(profile['date_to']) + 1 if profile['date_to'] else math.inf
+            overlap = np.minimum(array['end'] + 1, window_end) - np.maximum(array['start'], window_start)
+            eligible &= overlap > 0
+            dates = np.clip(overlap / np.minimum(length, window_end - window_start), 0, 1)
+        else:
+            # Without dates, sooner trips first
+            dates = 1 / (1 + np.maximum(array['start'] - now, 0) / 30)
+
+        # Budgets are only compared within the same currency, neutral (0.5) without a reference
+        references = np.full(len(currencies), np.nan)
+        for currency, budget in profile['budgets'].items():
+            if currency is None:
+                references[:] = budget
+            elif currency in currencies:
+                references[currencies[currency]] = budget
+        reference = references[array['currency']] if len(references) else np.full(size, np.nan)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            budget = np.exp(-np.abs(np.log(np.maximum(array['budget'], 1) / reference)))
+        budget = np.where(np.isnan(budget), 0.5, budget)
+
+        affinity = np.zeros(len(destinations))
+        for destination, share in profile['destinations'].items():
+            if destination in destinations:
+                affinity[destinations[destination]] = share
+        destination = affinity[array['destination']] if len(affinity) else np.zeros(size)
+
+        score = WEIGHTS['dates'] * dates + WEIGHTS['budget'] * budget + WEIGHTS['destination'] * destination
+        excluded = [positions[trip_id] for trip_id in profile['exclude'] if trip_id in positions]
+        eligible[excluded] = False
+        score = np.where(eligible, score, -np.inf)
+
+        count = min(limit, int(eligible.sum()))
+        if count == 0:
+            return []
+        best = np.argpartition(-score, count - 1)[:count]
+        best = best[np.lexsort((array['id'][best], -score[best]))]
+        return [(int(array['id'][position]), float(score[position])) for position in best]
+
+
+candidate_matrix = CandidateMatrix()
+
+
+def user_profile(user_id, args):
+    """ What the scoring needs to know about the user: age, trips to skip and the preferences
+    given in the query string or learned from the favorites """
+    age = db.session.execute(db.select(Users.age).where(Users.id == user_id)).scalar()
+    favorites = db.session.execute(db.select(Trips.id, Trips.budget, Trips.budget_currency, Trips.destination)
+                                   .join(Favorites, Favorites.trip_id == Trips.id)
+                                   .where(Favorites.user_id == user_id)).all()
+    joined = db.session.execute(db.select(Travelers.trip_id).where(Travelers.traveler_id == user_id)).scalars()
+
+    budgets = {}
+    budget = _int_arg(args, 'budget')
+    if budget is not None:
+        budgets[args.get('currency') or None] = budget
+    else:
+        by_currency = {}
+        for row in favorites:
+            by_currency.setdefault(row.budget_currency, []).append(row.budget)
+        budgets = {currency: float(np.median(values)) for currency, values in by_currency.items()}
+    destinations = {}
+    for row in favorites:
+        name = row.destination.strip().lower()
+        destinations[name] = destinations.get(name, 0) + 1 / len(favorites)
+
+    seats = _int_arg(args, 'seats')
+    return {'user_id': user_id, 'age': age, 'seats': max(seats or 1, 1),
+            'date_from': _date_arg(args, 'date_from'), 'date_to': _date_arg(args, 'date_to'),
+            'budgets': budgets, 'destinations': destinations,
+            'exclude': {row.id for row in favorites} | set(joined)}
+
+
+def recommend(user_id, args):
+    """ Returns [(trip_id, score)] best first, ?limit= up to MAX_RECOMMENDATIONS """
+    limit = _int_arg(args, 'limit') or 10
+    if not 1 <= limit <= MAX_RECOMMENDATIONS:
+        raise APIException(f'limit must be between 1 and {MAX_RECOMMENDATIONS}', status_code=400)
+    profile = user_profile(user_id, args)
+    candidate_matrix.ensure_ready()
+    return candidate_matrix.top(profile, limit)
+
+
+def _on_trip_changed(sender, trip_id=None, **extra):
+    candidate_matrix.mark_dirty(trip_id)
+
+
+def setup_recommendations(app):
+    candidate_matrix.max_age = app.config.get('RECOMMENDATIONS_MAX_AGE', candidate_matrix.max_age)
+    trip_changed.connect(_on_trip_changed, weak=False)
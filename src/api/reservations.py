@@ -0,0 +1,101 @@
+"""
+Seat reservations for Travelers.
+A seat is claimed with a conditional UPDATE (available_seats >= n) that the database applies
+atomically, never with a read-modify-write in Python, so concurrent approvals can't oversell
+a trip. Approvals for a trip run in one transaction that starts with that UPDATE: the row lock
+on the trip (the database lock on SQLite) orders concurrent approvals of the same trip.
+"""
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+from api.models import db, Trips, Travelers
+from api.notifications import dispatcher
+from api.signals import trip_changed
+from api.utils import APIException
+
+
+def claim_seats(trip_id, wanted):
+    """ Takes up to `wanted` seats of the trip, returns how many were taken. Must run in a transaction """
+    while wanted > 0:
+        result = db.session.execute(db.update(Trips)
+                                    .where(Trips.id == trip_id, Trips.available_seats >= wanted)
+                                    .values(available_seats=Trips.available_seats - wanted)
+                                    .execution_options(synchronize_session=False))
+        if result.rowcount == 1:
+            return wanted
+        # Not enough seats for all of them, retry with what is left (it may change between statements)
+        available = db.session.execute(db.select(Trips.available_seats).where(Trips.id == trip_id)).scalar()
+        if not available or available <= 0:
+            return 0
+        wanted = min(wanted, available)
+    return 0
+
+
+def release_seats(trip_id, count):
+    if count > 0:
+        db.session.execute(db.update(Trips).where(Trips.id == trip_id)
+                           .values(available_seats=Trips.available_seats + count)
+                           .execution_options(synchronize_session=False))
+
+
+def join_trip(trip_id, user_id):
+    """ Creates the pending request of the user, returns (traveler, created). Idempotent """
+    trip = db.session.execute(db.select(Trips.id, Trips.host_id, Trips.status).where(Trips.id == trip_id)).first()
+    if trip is None:
+        raise APIException('Trip not found', status_code=404)
+    if trip.host_id == user_id:
+        raise APIException('El anfitrión no puede unirse a su propio viaje', status_code=400)
+    if trip.status != 'planning':
+        raise APIException('Solo se puede solicitar unirse a viajes en planificación', status_code=409)
+    traveler = Travelers(trip_id=trip_id, traveler_id=user_id, status='pending')
+    db.session.add(traveler)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # The unique constraint on (trip_id, traveler_id) says the request already exists
+        db.session.rollback()
+        existing = db.session.execute(db.select(Travelers).where(Travelers.trip_id == trip_id,
+                                                                 Travelers.traveler_id == user_id)).scalar()
+        return existing, False
+    # GET /trips/<id>?expand=travelers lists the pending requests too
+    trip_changed.send(current_app._get_current_object(), trip_id=trip_id, change='travelers')
+    dispatcher.notify('traveler_applied', trip_id, actor_id=user_id, user_ids=[trip.host_id])
+    return traveler, True
+
+
+def approve_travelers(trip_id, host_id, traveler_ids):
+    """ Approves the pending requests of the users in traveler_ids while there are seats.
+    Returns {traveler_id: 'approved' | 'no_seats' | 'not_pending'} """
+    host = db.session.execute(db.select(Trips.host_id).where(Trips.id == trip_id)).scalar()
+    if host is None:
+        raise APIException('Trip not found', status_code=404)
+    if host != host_id:
+        raise APIException('No tienes permiso para aprobar viajeros de este viaje', status_code=403)
+    traveler_ids = list(dict.fromkeys(traveler_ids))
+    results = {traveler_id: 'not_pending' for traveler_id in traveler_ids}
+    if not traveler_ids:
+        return results
+
+    claimed = claim_seats(trip_id, len(traveler_ids))
+    pending = db.session.execute(db.select(Travelers.id, Travelers.traveler_id)
+                                 .where(Travelers.trip_id == trip_id,
+                                        Travelers.traveler_id.in_(traveler_ids),
+                                        Travelers.status == 'pending')
+                                 .order_by(Travelers.created_at, Travelers.id)).all()
+    approved = pending[:claimed]
+    if approved:
+        db.session.execute(db.update(Travelers)
+                           .where(Travelers.id.in_([row.id for row in approved]))
+                           .values(status='approved')
+                           .execution_options(synchronize_session=False))
+    release_seats(trip_id, claimed - len(approved))
+    db.session.commit()
+
+    for row in pending[claimed:]:
+        results[row.traveler_id] = 'no_seats'
+    for row in approved:
+        results[row.traveler_id] = 'approved'
+    if approved:
+        approved_ids = [row.traveler_id for row in approved]
+        trip_changed.send(current_app._get_current_object(), trip_id=trip_id, change='travelers')
+        dispatcher.notify('traveler_status', trip_id, user_ids=approved_ids, status='approved')
+    return results
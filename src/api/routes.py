@@ -1,20 +1,47 @@
 """
 This module takes care of starting the API Server, Loading the DB and Adding the endpoints
 """
-from flask import Flask, request, jsonify, url_for, Blueprint
+from flask import Flask, request, jsonify, url_for, Blueprint, current_app, send_file
 from api.utils import generate_sitemap, APIException
 from flask_cors import CORS
-from api.models import db, Users
+from api.models import db, Users, Trips, Travelers, Favorites
+from api.trip_search import search_trips, export_trips_query
+from api.trip_batch import parse_trip, parse_items, create_trips, update_trips
+from api.streaming import wants_stream, ndjson_response
+from api.credentials import authenticate, hash_password
+from api.instrumentation import query_budget
+from api.trip_detail import load_trip_detail, parse_expand, embeds_users
+from api.cache import response_cache
+from api.signals import trip_changed
+from api.notifications import dispatcher, mark_read, unread_count, inbox
+from api.reservations import join_trip, approve_travelers
+from api.favorites import add_favorite, remove_favorite, favorited_trip_ids
+from api.text_search import text_search
+from api.recommendations import recommend
+from api.auth import revocations, revokes_tokens
+from api.rate_limit import rate_limiter, rate_limit
+from api.compression import compressor
+from api.photos import upload_from_request
+from api.media import media_store, SIZES, HASH
+from api.lifecycle import lifecycle
+from api.logs import log_event
+from api.metrics import monitoring_required
+from api.static_files import IMMUTABLE_MAX_AGE
+import logging
+import time
 from flask_jwt_extended import create_access_token
 from flask_jwt_extended import jwt_required
-from flask_jwt_extended import get_jwt_identity
 from flask_jwt_extended import get_jwt
+from flask_jwt_extended import current_user
 import requests
 
 
 
 api = Blueprint('api', __name__)
+logger = logging.getLogger('api.routes')
 CORS(api)  # Allow CORS requests to this API
+api.before_request(rate_limiter.check)  # Token buckets declared with @rate_limit, 429 + Retry-After
+api.after_request(compressor.compress)  # gzip/br/zstd negotiated with Accept-Encoding
 
 
 @api.route('/hello', methods=['POST', 'GET'])
@@ -23,20 +50,59 @@ def handle_hello():
     response_body['message'] = "Hello! I'm a message that came from the backend, check the network tab on the google inspector and you will see the GET request"
     return response_body, 200
 
+# GET /_health/db → Estado del pool de conexiones y latencia de un SELECT 1 (uso interno, monitoreo)
+# Los /_health/* piden "Authorization: Bearer <METRICS_TOKEN>" o el token de un administrador
+@api.route('/_health/db', methods=['GET'])
+@monitoring_required
+def health_db():
+    response_body = {}
+    pool = db.engine.pool
+    response_body['pool'] = {'class': type(pool).__name__, 'status': pool.status()}
+    # NullPool and the SQLite pools don't keep counters
+    for name in ('size', 'checkedin', 'checkedout', 'overflow'):
+        if hasattr(pool, name):
+            response_body['pool'][name] = getattr(pool, name)()
+    started = time.perf_counter()
+    try:
+        db.session.execute(db.text('SELECT 1'))
+    except Exception as error:
+        db.session.rollback()
+        response_body['status'] = 'error'
+        response_body['message'] = str(error.__class__.__name__)
+        return response_body, 503
+    response_body['status'] = 'ok'
+    response_body['latency_ms'] = round((time.perf_counter() - started) * 1000, 2)
+    return response_body, 200
+
+
+# GET /_health/notifications → Profundidad de la cola de notificaciones y contadores del worker
+@api.route('/_health/notifications', methods=['GET'])
+@monitoring_required
+def health_notifications():
+    return dispatcher.stats(), 200
+
+
+# GET /_health/lifecycle → Viajes que el planificador pasó a en curso/finalizado y duración de cada pasada
+@api.route('/_health/lifecycle', methods=['GET'])
+@monitoring_required
+def health_lifecycle():
+    return lifecycle.stats(), 200
+
+
 @api.route('/register', methods=['POST'])
+@rate_limit('5/minute per ip', '3/hour per email')
 def register_user():
     response_body = {}
     data = request.json
 
 
-    row = Users(email=data['email'], password=data['password'])
+    row = Users(email=data['email'], password=hash_password(data['password']))
     db.session.add(row)
     db.session.commit()
 
     user = row.serialize()
     claims = {'user_id': user['id']}
-
-    print(claims)
+    log_event(logger, logging.INFO, 'user_registered', user_id=user['id'])
 
     access_token = create_access_token(identity=user["email"], additional_claims=claims)
     response_body['message'] = 'User registered successfully'
@@ -46,21 +112,23 @@ def register_user():
 
 
 @api.route("/login", methods=["POST"])
+@rate_limit('10/minute per ip', '5/minute per email')
 def login():
     response_body = {}
     data = request.json
-    print("soy data de login", data)
     email = data.get("email", None)
     password = data.get("password", None)
-    row = db.session.execute(db.select(Users).where(Users.email==email, Users.password==password, Users.is_active)).scalar()
+    # authenticate() busca por email (indexado), verifica el hash y lo actualiza si es necesario
+    row = authenticate(email, password) if email and password else None
     # if the request is successful, row should return something (therefore is true), ifnot it will return none
     if not row:
+        log_event(logger, logging.INFO, 'login_failed')
         response_body['message'] = "Bad email or password"
         return response_body, 401
     user = row.serialize()
     claims = {'user_id': user['id'],
               'is_admin': user['is_admin']}
-    print(claims)
+    log_event(logger, logging.INFO, 'login', user_id=user['id'], is_admin=user['is_admin'])
 
     access_token = create_access_token(identity=email, additional_claims=claims)
     response_body['message'] = 'User logged!'
@@ -68,6 +136,15 @@ def login():
     response_body['results'] = user
     return response_body, 200
 
+# POST /logout → Revoca el token actual (en todos los workers si hay CACHE_URL de Redis)
+@api.route('/logout', methods=['POST'])
+@jwt_required()
+def logout():
+    token = get_jwt()
+    revocations.revoke_token(token['jti'], token.get('exp'))
+    return {'message': 'Logged out'}, 200
+
+
 @api.route('/users/<int:user_id>', methods=['GET'])
 def user_id(user_id):
    user = Users.query.get(user_id)
@@ -76,86 +153,179 @@ def user_id(user_id):
    
 
 @api.route('/users', methods=['GET'])
+@query_budget(1)
 def users():
+    # ?stream=1 o Accept: application/x-ndjson → exportación completa, una línea JSON por usuario
+    # ?fields=id,email → solo se leen de la base de datos las columnas pedidas
+    fields = Users.schema.fields_from(request.args)
+    query = db.select(*Users.schema.columns(fields)).order_by(Users.id)
+    if wants_stream(request):
+        return ndjson_response(query, Users.schema.row_dumper(fields))
     response_body = { }
-    rows = db.session.execute(db.select(Users)).scalars() 
- 
-    results = [ row.serialize() for row in rows ]
+    rows = db.session.execute(query)
+    results = Users.schema.dump_rows(rows, fields)
     response_body["message"] = f'Listado de Usuarios'
     response_body["results"] = results
     return(response_body), 200
 
+# PUT /users → Editar el usuario actual. Cambiar el email o la contraseña revoca todos sus tokens
+# (también el de esta petición, ver api/auth.py): la respuesta trae un access_token nuevo
 @api.route('/users', methods=['PUT'])
 @jwt_required()
 def edit_user():
     response_body = {}
     data = request.json
     user_id = get_jwt()['user_id']
-    print("soy el data de edit user", data)
-    print("soy el userid de edit", user_id)
+    # Solo los nombres de los campos, el cuerpo puede traer la contraseña
+    log_event(logger, logging.DEBUG, 'user_edit', user_id=user_id, fields=sorted(data))
     row = Users.query.get(user_id)
-    print("soy el print de row serialize", row.serialize())
     if not row:
         response_body['message'] = 'User not found'
         return response_body, 404
     row.first_name = data.get('first_name', row.first_name)  # Use .get() to avoid KeyError
     row.last_name = data.get('last_name', row.last_name)
     row.email = data.get('email', row.email)
-    row.password = data.get('password', row.password)
+    if data.get('password'):
+        row.password = hash_password(data['password'])
     row.gender = data.get('gender', row.gender)
     row.age = data.get('age', row.age)
-    row.photo = data.get('photo', row.photo)
+    if data.get('photo', row.photo) != row.photo:
+        row.photo, row.photo_hash = data['photo'], None  # A URL from elsewhere has no thumbnails
     row.biography = data.get('biography', row.biography)
-    row.is_admin = data.get('is_admin', row.is_admin)
+    # Solo un administrador puede dar o quitar permisos de administrador
+    if current_user.is_admin:
+        row.is_admin = data.get('is_admin', row.is_admin)
 
+    revoked = revokes_tokens(row)
     db.session.commit()
     response_body['message'] = 'User edited'
+    if revoked:
+        # Issued after the revocation cutoff, so it keeps the user logged in on this client
+        response_body['access_token'] = create_access_token(
+            identity=row.email, additional_claims={'user_id': row.id, 'is_admin': row.is_admin})
     response_body['results'] = row.serialize()
     return response_body, 200
 
 
 
 
-# PUT /trips/{id} → Editar un viaje (solo anfitrión del viaje) me falta  escrito por :Sarto
+# PUT /trips/{id} → Editar un viaje (solo anfitrión del viaje), solo cambian los campos enviados
+@api.route('/trips/<int:trip_id>', methods=['PUT'])
+@jwt_required()
+def edit_trip(trip_id):
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        raise APIException('The body must be a trip', status_code=400)
+    body, status = update_trips([dict(data, id=trip_id)], get_jwt()['user_id'], current_user.is_admin)
+    result = body['results'][0]
+    if 'errors' in result:
+        return {'message': 'Trip not edited', 'errors': result['errors']}, result['status']
+    response_body = {'message': 'Trip edited', 'results': db.session.get(Trips, trip_id).serialize()}
+    return response_body, 200
 
 
-# POST /trips → Crear un viaje (solo anfitriones)
+# POST /trips → Crear un viaje (solo anfitriones). El id es opcional, por defecto lo da la base de datos
 @api.route('/trips', methods=['POST'])
 def post_trip():
     response_body = {}
-    data = request.json
+    data = request.get_json(silent=True) or {}
+    values, errors = parse_trip(data, {})
+    if 'host_id' not in data:
+        errors['host_id'] = 'is required'
+    if errors:
+        return {'message': 'Invalid trip', 'errors': errors}, 400
     # Crear una nueva instancia de Trips
-    row = Trips(
-        id = data['id'],
-        destination=data['destination'],
-        start_date=datetime.strptime(data['start_date'], "%Y-%m-%d"),
-        end_date=datetime.strptime(data['end_date'], "%Y-%m-%d"),
-        available_seats=data['available_seats'],
-        description=data['description'],
-        photo=data.get('photo',''),  
-        budget=data['budget'],
-        budget_currency=data['budget_currency'],
-        age_min=data.get('age_min'),  
-        age_max=data.get('age_max'), 
-        status=data['status'],
-        host_id=data['host_id']
-    )
+    row = Trips(**values, host_id=data['host_id'])
+    if data.get('id') is not None:
+        row.id = data['id']
     # Añadir y commitear la nueva instancia a la base de datos
     db.session.add(row)
     db.session.commit()
+    trip_changed.send(current_app._get_current_object(), trip_id=row.id, change='created')
     # Serializar el objeto Trips para la respuesta
     trip = row.serialize()
-    claims = {'trip_id': trip['id']}
-    print(claims)
     response_body['message'] = 'Trip created successfully'
     response_body['results'] = trip
     return jsonify(response_body), 200
 
 
+# POST /trips/batch → Crear hasta 500 viajes {"trips": [...], "atomic": true}, resultado por viaje
+# Sin host_id el anfitrión es el usuario, solo un administrador puede crear viajes de otro anfitrión
+@api.route('/trips/batch', methods=['POST'])
+@jwt_required()
+def post_trips_batch():
+    items, atomic = parse_items(request.get_json(silent=True))
+    return create_trips(items, get_jwt()['user_id'], current_user.is_admin, atomic)
+
+
+# PATCH /trips/batch → Editar hasta 500 viajes {"trips": [{"id": 1, ...}], "atomic": true} (solo anfitrión)
+@api.route('/trips/batch', methods=['PATCH'])
+@jwt_required()
+def patch_trips_batch():
+    items, atomic = parse_items(request.get_json(silent=True))
+    return update_trips(items, get_jwt()['user_id'], current_user.is_admin, atomic)
+
+
+# PUT /trips/{id}/status → Cambiar el estado de un viaje (solo anfitrión del viaje), notifica a los viajeros
+@api.route('/trips/<int:trip_id>/status', methods=['PUT'])
+@jwt_required()
+def update_trip_status(trip_id):
+    response_body = {}
+    status = request.json.get('status')
+    if status not in ('planning', 'finished', 'ongoing', 'cancelled'):
+        response_body['message'] = 'status must be one of planning, ongoing, finished, cancelled'
+        return response_body, 400
+    trip = db.session.get(Trips, trip_id)
+    if not trip:
+        response_body['message'] = 'Trip not found'
+        return response_body, 404
+    user_id = get_jwt()['user_id']
+    if trip.host_id != user_id:
+        response_body['message'] = 'No tienes permiso para modificar este viaje'
+        return response_body, 403
+    if trip.status != status:
+        trip.status = status
+        db.session.commit()
+        trip_changed.send(current_app._get_current_object(), trip_id=trip_id, change='status')
+        dispatcher.notify('trip_status', trip_id, actor_id=user_id, status=status)
+    response_body['message'] = 'Trip status updated'
+    response_body['results'] = trip.serialize()
+    return response_body, 200
+
+
+# POST /trips/{id}/join → Solicitar unirse a un viaje (queda pendiente de aprobación del anfitrión)
+@api.route('/trips/<int:trip_id>/join', methods=['POST'])
+@jwt_required()
+def join(trip_id):
+    traveler, created = join_trip(trip_id, get_jwt()['user_id'])
+    response_body = {'message': 'Request sent' if created else 'Request already exists',
+                     'results': traveler.serialize()}
+    return response_body, 201 if created else 200
+
+
+# POST /trips/{id}/travelers/approve → Aprobar solicitudes {"traveler_ids": [...]} (solo anfitrión)
+# Cada aprobación ocupa una plaza, las que no tienen plaza quedan pendientes
+@api.route('/trips/<int:trip_id>/travelers/approve', methods=['POST'])
+@jwt_required()
+def approve(trip_id):
+    response_body = {}
+    traveler_ids = (request.get_json(silent=True) or {}).get('traveler_ids')
+    if not isinstance(traveler_ids, list) or not all(isinstance(item, int) for item in traveler_ids):
+        response_body['message'] = 'traveler_ids must be a list of user ids'
+        return response_body, 400
+    results = approve_travelers(trip_id, get_jwt()['user_id'], traveler_ids)
+    response_body['message'] = 'Travelers processed'
+    response_body['results'] = results
+    return response_body, 200
+
+
 # GET /trips/{id} → Ver detalles de un viaje
+# expand=host,travelers,favorites_count,travelers_count → todo en una sola llamada (máximo 2 consultas SQL)
 @api.route('/trips/<int:trip_id>', methods=['GET'])
+@query_budget(2)
+@response_cache.cached('trips:detail', user_data=embeds_users)
 def get_trip(trip_id):
-    trip = Trips.query.get(trip_id)
+    trip = load_trip_detail(trip_id, parse_expand(request.args))
     if not trip:
         response_body = {
             "error": "Trip not found"
@@ -164,27 +334,98 @@ def get_trip(trip_id):
 
     response_body = {
         "message": "Trip retrieved successfully",
-        "results": trip.serialize()
+        "results": trip
     }
     return jsonify(response_body), 200
 
 
-# GET /trips → Listar todos los viajes disponibles (para viajeros)
+# GET /trips → Listar los viajes disponibles (para viajeros)
+# Campos: fields=id,destination,start_date (por defecto todos)
+# Filtros: destination, date_from, date_to, budget_min, budget_max, age_min, age_max, status, seats
+# Paginación: limit y cursor (usar el next_cursor de la respuesta anterior)
+# Con token cada viaje trae is_favorite (una consulta más para toda la página)
 @api.route('/trips', methods=['GET'])
+@jwt_required(optional=True)
+@query_budget(2)
+@response_cache.cached('trips:list', per_user=True)
 def get_trips():
-    trips = Trips.query.all()
+    fields = Trips.schema.fields_from(request.args)
+    if wants_stream(request):
+        return ndjson_response(export_trips_query(request.args, fields), Trips.schema.row_dumper(fields))
+    rows, next_cursor = search_trips(request.args, fields)
+    results = Trips.schema.dump_rows(rows, fields)
+    user_id = get_jwt().get('user_id')
+    if user_id is not None:
+        favorites = favorited_trip_ids(user_id, [row.cursor_id for row in rows])
+        for row, result in zip(rows, results):
+            result['is_favorite'] = row.cursor_id in favorites
     response_body = {
         "message": "Trips retrieved successfully",
-        "results": [trip.serialize() for trip in trips]
+        "results": results,
+        "next_cursor": next_cursor
     }
     return jsonify(response_body), 200
 
+
+# GET /trips/search?q=madrid playa → Buscar por destino y descripción, los mejores primero (tolera errores de escritura)
+# Acepta fields, limit, cursor y los mismos filtros que GET /trips
+@api.route('/trips/search', methods=['GET'])
+@response_cache.cached('trips:search')
+def get_trips_search():
+    fields = Trips.schema.fields_from(request.args)
+    rows, next_cursor = text_search(request.args, fields)
+    response_body = {
+        "message": "Trips retrieved successfully",
+        "results": Trips.schema.dump_rows(rows, fields),
+        "next_cursor": next_cursor
+    }
+    return jsonify(response_body), 200
+
+
+# PUT /trips/{id}/favorite → Marcar como favorito, DELETE → quitarlo. Repetirlos no cambia nada
+@api.route('/trips/<int:trip_id>/favorite', methods=['PUT'])
+@jwt_required()
+def put_favorite(trip_id):
+    created = add_favorite(get_jwt()['user_id'], trip_id)
+    response_body = {'message': 'Favorite added' if created else 'Already a favorite',
+                     'results': {'trip_id': trip_id, 'is_favorite': True}}
+    return response_body, 201 if created else 200
+
+
+@api.route('/trips/<int:trip_id>/favorite', methods=['DELETE'])
+@jwt_required()
+def delete_favorite(trip_id):
+    removed = remove_favorite(get_jwt()['user_id'], trip_id)
+    response_body = {'message': 'Favorite removed' if removed else 'Not a favorite',
+                     'results': {'trip_id': trip_id, 'is_favorite': False}}
+    return response_body, 200
+
+
+# GET /favorites/lookup?trip_ids=1,2,3 → {"1": true, "2": false, ...} en una sola consulta (máximo 100 ids)
+@api.route('/favorites/lookup', methods=['GET'])
+@jwt_required()
+@query_budget(1)
+def lookup_favorites():
+    response_body = {}
+    try:
+        trip_ids = [int(item) for item in request.args.get('trip_ids', '').split(',') if item.strip()]
+    except ValueError:
+        response_body['message'] = 'trip_ids must be a comma separated list of trip ids'
+        return response_body, 400
+    if len(trip_ids) > 100:
+        response_body['message'] = 'trip_ids accepts up to 100 ids'
+        return response_body, 400
+    favorites = favorited_trip_ids(get_jwt()['user_id'], trip_ids)
+    response_body['message'] = 'Favorites retrieved successfully'
+    response_body['results'] = {str(trip_id): trip_id in favorites for trip_id in trip_ids}
+    return response_body, 200
+
 # DELETE /trips/{id} → Cancelar un viaje (solo anfitrión del viaje)
 @api.route('/trips/<int:trip_id>', methods=['DELETE'])
 @jwt_required()  
 def delete_trip(trip_id):
    
-    user_id = get_jwt_identity()
+    user_id = get_jwt()['user_id']
 
     trip = Trips.query.get(trip_id)
     if not trip:
@@ -201,8 +442,12 @@ def delete_trip(trip_id):
         return jsonify(response_body), 403 
 
    
+    # Las solicitudes y favoritos del viaje se borran en la misma transacción
+    db.session.execute(db.delete(Travelers).where(Travelers.trip_id == trip_id))
+    db.session.execute(db.delete(Favorites).where(Favorites.trip_id == trip_id))
     db.session.delete(trip)
     db.session.commit()
+    trip_changed.send(current_app._get_current_object(), trip_id=trip_id, change='deleted')
 
     response_body = {
         "message": "Trip deleted successfully"
@@ -210,5 +455,101 @@ def delete_trip(trip_id):
     return jsonify(response_body), 200
 
 
-#https://cloudinary.com/
+# GET /recommendations → Viajes recomendados para el usuario, los mejores primero, con su puntuación
+# Parámetros opcionales: limit (máximo 50), date_from, date_to, budget, currency, seats, fields
+@api.route('/recommendations', methods=['GET'])
+@jwt_required()
+@query_budget(5)
+def get_recommendations():
+    fields = Trips.schema.fields_from(request.args)
+    scores = dict(recommend(get_jwt()['user_id'], request.args))
+    rows = db.session.execute(db.select(*Trips.schema.columns(fields), Trips.id.label('trip_id'))
+                              .where(Trips.id.in_(list(scores)))).all() if scores else []
+    rows.sort(key=lambda row: -scores[row.trip_id])
+    results = Trips.schema.dump_rows(rows, fields)
+    for row, result in zip(rows, results):
+        result['score'] = round(scores[row.trip_id], 4)
+    response_body = {
+        "message": "Recommendations retrieved successfully",
+        "results": results
+    }
+    return jsonify(response_body), 200
+
+
+# GET /notifications → Bandeja de entrada del usuario, más recientes primero (?unread=1, limit, cursor)
+@api.route('/notifications', methods=['GET'])
+@jwt_required()
+@query_budget(1)
+def get_notifications():
+    results, next_cursor = inbox(get_jwt()['user_id'], request.args)
+    response_body = {'message': 'Notifications retrieved successfully',
+                     'results': results,
+                     'next_cursor': next_cursor}
+    return response_body, 200
+
+
+# GET /notifications/unread-count → Contador para el badge de la cabecera
+@api.route('/notifications/unread-count', methods=['GET'])
+@jwt_required()
+@query_budget(1)
+def get_unread_count():
+    response_body = {'message': 'Unread notifications',
+                     'results': {'unread': unread_count(get_jwt()['user_id'])}}
+    return response_body, 200
+
+
+# POST /notifications/read-all → Marcar todas como leídas
+@api.route('/notifications/read-all', methods=['POST'])
+@jwt_required()
+def read_all_notifications():
+    response_body = {'message': 'Notifications marked as read',
+                     'results': {'updated': mark_read(get_jwt()['user_id'])}}
+    return response_body, 200
+
+
+# PUT /notifications/read → Marcar como leídas las notificaciones {"ids": [1, 2, 3]} (todas si no hay ids)
+@api.route('/notifications/read', methods=['PUT'])
+@jwt_required()
+def read_notifications():
+    response_body = {}
+    ids = (request.get_json(silent=True) or {}).get('ids')
+    if ids is not None and not (isinstance(ids, list) and all(isinstance(item, int) for item in ids)):
+        response_body['message'] = 'ids must be a list of integers'
+        return response_body, 400
+    response_body['message'] = 'Notifications marked as read'
+    response_body['results'] = {'updated': mark_read(get_jwt()['user_id'], ids)}
+    return response_body, 200
+
+
+# PUT /users/photo y PUT /trips/{id}/photo → Subir la foto, el cuerpo es la imagen (Content-Type image/jpeg, png o webp)
+# Se envía al almacenamiento (STORAGE_URL) a medida que llega, ver api/photos.py. Con ASGI (src/asgi.py) no ocupa un worker
+@api.route('/users/photo', methods=['PUT'])
+@jwt_required()
+def put_user_photo():
+    user_id = get_jwt()['user_id']
+    response_body = {'message': 'Photo uploaded', 'results': upload_from_request(request, 'users', user_id, user_id)}
+    return response_body, 200
+
+
+@api.route('/trips/<int:trip_id>/photo', methods=['PUT'])
+@jwt_required()
+def put_trip_photo(trip_id):
+    response_body = {'message': 'Photo uploaded',
+                     'results': upload_from_request(request, 'trips', trip_id, get_jwt()['user_id'])}
+    return response_body, 200
+
+# GET /media/{hash}/{size} → Miniatura WebP de una foto subida (size: thumb 160px, card 480px, large 1280px)
+# El contenido de un hash no cambia nunca: se cachea un año en el navegador (immutable)
+@api.route('/media/<content_hash>/<size>', methods=['GET'])
+def get_media(content_hash, size):
+    if size not in SIZES or not HASH.match(content_hash):
+        return {'message': f'size must be one of {", ".join(SIZES)}'}, 404
+    path = media_store.derivative(content_hash, size)
+    if path is None:
+        return {'message': 'Photo not found'}, 404
+    response = send_file(path, mimetype='image/webp', etag=f'{content_hash}-{size}', conditional=True,
+                         max_age=IMMUTABLE_MAX_AGE)
+    response.cache_control.immutable = True
+    return response
+
 #endpoint load image
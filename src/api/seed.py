@@ -0,0 +1,198 @@
+"""
+Fake data generator used by `flask insert-test-data` and the benchmarks.
+Builds coherent Users → Trips → Travelers / Favorites / Notifications graphs and writes them
+in batches: one executemany INSERT (COPY on PostgreSQL) and one commit per batch, so seeding
+100k users takes seconds instead of one round trip and one commit per row.
+"""
+import csv
+import io
+import random
+import time
+from datetime import datetime, timedelta
+from itertools import islice
+from api.models import db, Users, Trips, Favorites, Notifications, Travelers
+from api.credentials import hash_password
+from api.notifications import recount_unread
+
+
+FIRST_NAMES = ('Ana', 'Luis', 'María', 'Carlos', 'Lucía', 'Javier', 'Sofía', 'Diego', 'Valentina', 'Pablo',
+               'Camila', 'Andrés', 'Daniela', 'Miguel', 'Paula', 'Sergio', 'Laura', 'Jorge', 'Elena', 'Tomás')
+LAST_NAMES = ('García', 'Rodríguez', 'Martínez', 'López', 'González', 'Pérez', 'Sánchez', 'Ramírez', 'Torres',
+              'Flores', 'Rivera', 'Gómez', 'Díaz', 'Cruz', 'Morales', 'Ortiz', 'Gutiérrez', 'Chávez', 'Ramos', 'Vargas')
+DESTINATIONS = ('Madrid', 'Barcelona', 'Lisboa', 'París', 'Roma', 'Berlín', 'Ámsterdam', 'Praga', 'Viena', 'Atenas',
+                'Cusco', 'Cartagena', 'Buenos Aires', 'Ciudad de México', 'Bogotá', 'Santiago', 'Montevideo',
+                'Tokio', 'Bangkok', 'Bali', 'Marrakech', 'El Cairo', 'Nueva York', 'Miami', 'Caracas')
+ACTIVITIES = ('mochilero', 'gastronómico', 'de playa', 'de montaña', 'cultural', 'de fiesta', 'en bicicleta',
+              'de fotografía', 'de buceo', 'de senderismo')
+CURRENCIES = ('EUR', 'USD', 'EUR', 'USD', 'MXN', 'COP')
+GENDERS = ('male', 'female', 'non_binary', 'other', None)
+TRAVELER_STATUSES = ('approved', 'approved', 'pending', 'pending', 'declined', 'cancelled')
+
+
+def batched(rows, size):
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+
+def _next_id(model):
+    return (db.session.execute(db.select(db.func.max(model.id))).scalar() or 0) + 1
+
+
+def _copy(model, batch):
+    """ COPY ... FROM STDIN, the fastest way to load rows into PostgreSQL """
+    columns = list(batch[0])
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in batch:
+        writer.writerow(['' if row[name] is None else row[name] for name in columns])
+    buffer.seek(0)
+    cursor = db.session.connection().connection.cursor()
+    cursor.copy_expert(f'COPY {model.__tablename__} ({", ".join(columns)}) FROM STDIN WITH (FORMAT csv)', buffer)
+
+
+def insert_rows(model, rows, batch_size=5000, use_copy=None):
+    """ Inserts dicts from the iterable `rows`, one transaction per batch. Returns the number of rows """
+    if use_copy is None:
+        use_copy = db.session.get_bind().dialect.name == 'postgresql'
+    total = 0
+    for batch in batched(rows, batch_size):
+        if use_copy:
+            _copy(model, batch)
+        else:
+            db.session.execute(db.insert(model), batch)
+        db.session.commit()
+        total += len(batch)
+    return total
+
+
+def _fix_sequences(*models):
+    # Rows are inserted with explicit ids, move the PostgreSQL sequences past them
+    if db.session.get_bind().dialect.name != 'postgresql':
+        return
+    for model in models:
+        table = model.__tablename__
+        db.session.execute(db.text(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), (SELECT MAX(id) FROM {table}))"))
+    db.session.commit()
+
+
+class DatasetGenerator:
+    def __init__(self, users=1000, trips=2000, travelers_per_trip=3, favorites_per_user=5,
+                 notifications_per_user=3, password=None, seed=42):
+        self.users = users
+        self.trips = trips
+        self.travelers_per_trip = travelers_per_trip
+        self.favorites_per_user = favorites_per_user
+        self.notifications_per_user = notifications_per_user
+        self.password = password
+        self.rng = random.Random(seed)
+        self.now = datetime.utcnow().replace(microsecond=0)
+
+    def user_rows(self, first_id):
+        rng = self.rng
+        for user_id in range(first_id, first_id + self.users):
+            first_name = rng.choice(FIRST_NAMES)
+            yield {'id': user_id,
+                   'email': f'user{user_id}@test.com',
+                   'password': self.password,
+                   'first_name': first_name,
+                   'last_name': rng.choice(LAST_NAMES),
+                   'gender': rng.choice(GENDERS),
+                   'age': rng.randint(18, 70),
+                   'photo': None,
+                   'biography': f'Hola, soy {first_name} y me encantan los viajes {rng.choice(ACTIVITIES)}.',
+                   'created_at': self.now - timedelta(days=rng.randint(0, 730), seconds=rng.randint(0, 86400)),
+                   'is_active': rng.random() > 0.02,
+                   'is_admin': False}
+
+    def trip_rows(self, first_id, user_ids):
+        rng = self.rng
+        for trip_id in range(first_id, first_id + self.trips):
+            destination = rng.choice(DESTINATIONS)
+            start_date = self.now.replace(hour=0, minute=0, second=0) + timedelta(days=rng.randint(-120, 365))
+            end_date = start_date + timedelta(days=rng.randint(2, 21))
+            if rng.random() < 0.05:
+                status = 'cancelled'
+            elif end_date <= self.now:
+                status = 'finished'
+            elif start_date <= self.now:
+                status = 'ongoing'
+            else:
+                status = 'planning'
+            age_min = rng.choice((18, 18, 21, 25, 30, 40))
+            yield {'id': trip_id,
+                   'destination': destination,
+                   'start_date': start_date,
+                   'end_date': end_date,
+                   'available_seats': rng.randint(0, 12),
+                   'description': f'Viaje {rng.choice(ACTIVITIES)} a {destination}',
+                   'photo': None,
+                   'budget': rng.randrange(200, 5000, 50),
+                   'budget_currency': rng.choice(CURRENCIES),
+                   'age_min': age_min,
+                   'age_max': age_min + rng.choice((10, 15, 20, 30)),
+                   'status': status,
+                   'host_id': rng.choice(user_ids)}
+
+    def traveler_rows(self, trip_hosts, user_ids):
+        rng = self.rng
+        for trip_id, host_id in trip_hosts:
+            for traveler_id in set(rng.sample(user_ids, min(self.travelers_per_trip, len(user_ids)))) - {host_id}:
+                yield {'status': rng.choice(TRAVELER_STATUSES),
+                       'created_at': self.now - timedelta(days=rng.randint(0, 90)),
+                       'trip_id': trip_id,
+                       'traveler_id': traveler_id}
+
+    def favorite_rows(self, user_ids, trip_ids):
+        rng = self.rng
+        for user_id in user_ids:
+            for trip_id in rng.sample(trip_ids, min(self.favorites_per_user, len(trip_ids))):
+                yield {'trip_id': trip_id, 'user_id': user_id}
+
+    def notification_rows(self, user_ids):
+        rng = self.rng
+        for user_id in user_ids:
+            for _ in range(self.notifications_per_user):
+                destination = rng.choice(DESTINATIONS)
+                yield {'message': rng.choice((f'Tu solicitud para {destination} fue aprobada',
+                                              f'Nuevo viajero en tu viaje a {destination}',
+                                              f'El viaje a {destination} empieza pronto')),
+                       'read': rng.random() < 0.6,
+                       'date': self.now - timedelta(minutes=rng.randint(0, 60 * 24 * 60)),
+                       'user_id': user_id}
+
+    def run(self, batch_size=5000, report=None):
+        """ Inserts the whole dataset, returns {table: (rows, seconds)} """
+        stats = {}
+        if self.password is None:
+            self.password = hash_password('123456')  # Same password for everybody, hash it only once
+
+        def timed(model, rows):
+            started = time.perf_counter()
+            count = insert_rows(model, rows, batch_size)
+            stats[model.__tablename__] = (count, time.perf_counter() - started)
+            if report:
+                report(model.__tablename__, *stats[model.__tablename__])
+
+        first_user = _next_id(Users)
+        user_ids = list(range(first_user, first_user + self.users))
+        timed(Users, self.user_rows(first_user))
+        trip_hosts = []
+
+        def remember_hosts(rows):
+            for row in rows:
+                trip_hosts.append((row['id'], row['host_id']))
+                yield row
+        if user_ids and self.trips:
+            timed(Trips, remember_hosts(self.trip_rows(_next_id(Trips), user_ids)))
+        _fix_sequences(Users, Trips)
+        trip_ids = [trip_id for trip_id, _ in trip_hosts]
+        if trip_ids:
+            timed(Travelers, self.traveler_rows(trip_hosts, user_ids))
+            timed(Favorites, self.favorite_rows(user_ids, trip_ids))
+        timed(Notifications, self.notification_rows(user_ids))
+        recount_unread(first_user)
+        return stats
@@ -0,0 +1,105 @@
+"""
+Schema driven serialization shared by all the models.
+A Schema knows which attributes of a model are public and how to format them. It can dump an
+ORM object (Model.serialize()) or, much cheaper, plain row tuples coming from a select() of
+only the requested columns (?fields=id,destination,start_date).
+"""
+import json
+from datetime import date
+from functools import lru_cache
+from flask.json.provider import DefaultJSONProvider
+from sqlalchemy import Date, DateTime
+from api.utils import APIException
+
+try:
+    import orjson
+except ImportError:  # orjson has no wheels for some platforms, fall back to the json module
+    orjson = None
+
+
+DATE_FORMAT = "%d %m %y"
+
+
+@lru_cache(maxsize=8192)
+def _format_day(ordinal):
+    return date.fromordinal(ordinal).strftime(DATE_FORMAT)
+
+
+def format_date(value):
+    """ Formats a date/datetime with DATE_FORMAT, each calendar day is formatted only once """
+    if value is None:
+        return None
+    return _format_day(value.toordinal())
+
+
+class Schema:
+    def __init__(self, model, fields):
+        self.model = model
+        self.fields = tuple(fields)
+        self._formatters = {}
+        for name in self.fields:
+            if isinstance(getattr(model, name).type, (Date, DateTime)):
+                self._formatters[name] = format_date
+
+    def fields_from(self, args):
+        """ Reads ?fields=a,b,c and returns the requested field names (all of them by default) """
+        requested = args.get('fields')
+        if not requested:
+            return self.fields
+        names = tuple(name.strip() for name in requested.split(',') if name.strip())
+        unknown = [name for name in names if name not in self.fields]
+        if unknown or not names:
+            raise APIException(f'Unknown fields: {", ".join(unknown)}. Valid fields: {", ".join(self.fields)}', status_code=400)
+        return names
+
+    def columns(self, names=None):
+        return [getattr(self.model, name) for name in (names or self.fields)]
+
+    def dump(self, obj, names=None):
+        formatters = self._formatters
+        result = {}
+        for name in names or self.fields:
+            value = getattr(obj, name)
+            formatter = formatters.get(name)
+            result[name] = value if formatter is None else formatter(value)
+        return result
+
+    def row_dumper(self, names=None):
+        """ Returns a function that converts a row tuple with the columns of `names` into a dict.
+        Extra trailing values in the row (cursor keys, ...) are ignored. """
+        names = tuple(names or self.fields)
+        formatted = [(index, self._formatters[name]) for index, name in enumerate(names) if name in self._formatters]
+        if not formatted:
+            return lambda row: dict(zip(names, row))
+
+        def dump_row(row):
+            values = list(row[:len(names)])
+            for index, formatter in formatted:
+                values[index] = formatter(values[index])
+            return dict(zip(names, values))
+        return dump_row
+
+    def dump_rows(self, rows, names=None):
+        dump_row = self.row_dumper(names)
+        return [dump_row(row) for row in rows]
+
+
+def dumps(obj):
+    """ Encodes obj with the fastest JSON backend available, returns bytes """
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(',', ':')).encode()
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """ jsonify() with orjson when it is installed, same output as the default provider otherwise """
+
+    def dumps(self, obj, **kwargs):
+        if orjson is None:
+            return super().dumps(obj, **kwargs)
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        if kwargs.get('sort_keys', self.sort_keys):
+            option |= orjson.OPT_SORT_KEYS
+        if kwargs.get('indent'):
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=self.default, option=option).decode()
@@ -0,0 +1,21 @@
+"""
+Application signals (blinker, the same library Flask uses for its own signals).
+Handlers that write trips send trip_changed after the commit, the caches and indexes that
+depend on trips subscribe to it to invalidate exactly what changed.
+
+    trip_changed.send(current_app._get_current_object(), trip_id=trip.id, change='created')
+
+change is one of 'created', 'updated', 'status', 'deleted' or 'travelers' (a request to join
+the trip or its approval, which also takes seats).
+favorites_changed is sent with user_id and trip_id when a user adds or removes a favorite.
+user_changed is sent with user_id after the commit of any ORM change of a user (api/auth.py
+sees them all: API, admin, commands).
+"""
+from blinker import Namespace
+
+
+_signals = Namespace()
+
+trip_changed = _signals.signal('trip-changed')
+favorites_changed = _signals.signal('favorites-changed')
+user_changed = _signals.signal('user-changed')
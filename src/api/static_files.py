@@ -0,0 +1,165 @@
+"""
+Serving of the front end build (public/).
+
+The directory is scanned once: for every file we keep its path, size, mtime, mimetype, a
+content ETag and the precompressed variants next to it (file.js.br, file.js.gz, written by
+`flask precompress`), so a request doesn't touch the filesystem until the file is sent.
+
+    content hashed names (bundle.3f9a1c2e.js)  Cache-Control: public, max-age=1 year, immutable
+    index.html and everything else             Cache-Control: no-cache (revalidated with the ETag)
+
+Clients that send Accept-Encoding: br or gzip get the precompressed variant. With reload=True
+(development) files are stat()ed on every request and the directory is rescanned when a file
+is missing, so webpack rebuilds show up without restarting.
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import threading
+import time
+from flask import request, send_file
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+IMMUTABLE_MAX_AGE = 31536000
+# name.[contenthash].ext of webpack: a stem, then 8+ hex chars with letters and digits, so names
+# like 20230517.png or logo.12345678.png are not taken for hashes (a hash of only digits, ~2% of
+# the builds, is served with no-cache: slower, never stale)
+HASHED_NAME = re.compile(r'^[^.]+\.(?=[0-9a-f]*[a-f])(?=[0-9a-f]*[0-9])[0-9a-f]{8,}\.[A-Za-z0-9]+$')
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+COMPRESSIBLE = ('.js', '.css', '.html', '.svg', '.json', '.txt', '.map', '.ico', '.xml')
+
+
+class StaticFile:
+    __slots__ = ('path', 'mtime', 'size', 'etag', 'mimetype', 'immutable', 'variants')
+
+    def __init__(self, path, name):
+        stat = os.stat(path)
+        self.path = path
+        self.mtime = stat.st_mtime
+        self.size = stat.st_size
+        digest = hashlib.sha1()
+        with open(path, 'rb') as file:
+            for chunk in iter(lambda: file.read(1 << 16), b''):
+                digest.update(chunk)
+        self.etag = digest.hexdigest()[:20]
+        self.mimetype = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        self.immutable = HASHED_NAME.search(os.path.basename(name)) is not None
+        # Only variants at least as new as the file, a stale .gz would serve an old version
+        self.variants = {encoding: path + suffix for encoding, suffix in ENCODINGS
+                         if os.path.isfile(path + suffix) and os.stat(path + suffix).st_mtime >= self.mtime}
+
+
+def accepted_encodings(header):
+    """ Codings of an Accept-Encoding header the client accepts (q > 0) """
+    accepted = set()
+    for item in header.split(','):
+        coding, _, params = item.strip().partition(';')
+        quality = params.strip()
+        if quality.startswith('q='):
+            try:
+                if float(quality[2:]) == 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(coding.strip().lower())
+    return accepted
+
+
+class StaticFiles:
+    def __init__(self, directory, fallback='index.html', reload=False):
+        self.directory = os.path.realpath(directory)
+        self.fallback = fallback
+        self.reload = reload
+        self.files = {}
+        self._lock = threading.Lock()
+        self._scanned_at = 0
+        self.scan()
+
+    def scan(self):
+        files = {}
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                if name.endswith(tuple(suffix for _, suffix in ENCODINGS)):
+                    continue
+                path = os.path.join(root, name)
+                relative = os.path.relpath(path, self.directory).replace(os.sep, '/')
+                files[relative] = StaticFile(path, relative)
+        self.files = files
+        self._scanned_at = time.monotonic()
+
+    def lookup(self, name):
+        entry = self.files.get(name)
+        if not self.reload:
+            return entry
+        if entry is None:
+            # At most one rescan per second when the paths don't exist
+            with self._lock:
+                if time.monotonic() - self._scanned_at > 1:
+                    self.scan()
+            return self.files.get(name)
+        try:
+            if os.stat(entry.path).st_mtime != entry.mtime:
+                entry = self.files[name] = StaticFile(entry.path, name)
+        except FileNotFoundError:
+            self.files.pop(name, None)
+            return None
+        return entry
+
+    def response(self, name):
+        """ Response for the path `name`, the fallback (index.html of the SPA) when it doesn't exist """
+        entry = self.lookup(name) or self.lookup(self.fallback)
+        if entry is None:
+            return 'Not found', 404
+        path, etag, encoding = entry.path, entry.etag, None
+        if entry.variants:
+            accepted = accepted_encodings(request.headers.get('Accept-Encoding', ''))
+            for coding, _ in ENCODINGS:
+                if coding in accepted and coding in entry.variants:
+                    # Each representation needs its own strong ETag
+                    path, etag, encoding = entry.variants[coding], f'{entry.etag}-{coding}', coding
+                    break
+        # Without max_age send_file answers Cache-Control: no-cache
+        response = send_file(path, mimetype=entry.mimetype, etag=etag, last_modified=entry.mtime, conditional=True,
+                             max_age=IMMUTABLE_MAX_AGE if entry.immutable else None)
+        if entry.immutable:
+            response.cache_control.immutable = True
+        if encoding is not None:
+            response.headers['Content-Encoding'] = encoding
+        if entry.variants:
+            response.vary.add('Accept-Encoding')
+        return response
+
+
+def precompress(directory, minimum_size=1024, level=9):
+    """ Writes .gz (and .br when the brotli package is installed) next to the compressible
+    files of directory. Returns the list of (file, encoding, original size, compressed size) """
+    written = []
+    for root, _, names in os.walk(directory):
+        for name in names:
+            path = os.path.join(root, name)
+            if not name.endswith(COMPRESSIBLE) or os.path.getsize(path) < minimum_size:
+                continue
+            with open(path, 'rb') as file:
+                content = file.read()
+            compressors = [('gzip', '.gz', lambda data: gzip.compress(data, compresslevel=level, mtime=0))]
+            if brotli is not None:
+                compressors.append(('br', '.br', lambda data: brotli.compress(data, quality=11)))
+            for encoding, suffix, compress in compressors:
+                target = path + suffix
+                if os.path.isfile(target) and os.stat(target).st_mtime >= os.stat(path).st_mtime:
+                    continue
+                compressed = compress(content)
+                # Not worth it when it barely shrinks (images already compressed, tiny files)
+                if len(compressed) > len(content) * 0.9:
+                    continue
+                with open(target, 'wb') as file:
+                    file.write(compressed)
+                written.append((os.path.relpath(path, directory), encoding, len(content), len(compressed)))
+    return written
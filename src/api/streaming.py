@@ -0,0 +1,34 @@
+"""
+Streaming (NDJSON) responses for full table exports.
+Rows are read from the database with a server side cursor in batches of STREAM_BATCH_SIZE and
+written to the client one batch at a time, so the memory used by a worker does not depend on
+the size of the table.
+"""
+from flask import Response, stream_with_context
+from api.models import db
+from api.serializers import dumps
+
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+STREAM_BATCH_SIZE = 1000
+
+
+def wants_stream(request):
+    """ True if the client asked for ?stream=1 or sent Accept: application/x-ndjson """
+    if request.args.get('stream', '').lower() in ('1', 'true', 'yes'):
+        return True
+    return request.accept_mimetypes.best_match(['application/json', NDJSON_MIMETYPE]) == NDJSON_MIMETYPE
+
+
+def iter_ndjson(query, dump_row, batch_size=STREAM_BATCH_SIZE):
+    """ Yields one chunk of newline delimited JSON per batch of rows """
+    # yield_per makes the ORM use a server side cursor (stream_results) and buffer only one batch
+    result = db.session.execute(query.execution_options(yield_per=batch_size))
+    for partition in result.partitions():
+        yield b''.join(dumps(dump_row(row)) + b'\n' for row in partition)
+
+
+def ndjson_response(query, dump_row, batch_size=STREAM_BATCH_SIZE):
+    """ query selects plain columns and dump_row converts each row tuple to a dict (see Schema.row_dumper) """
+    # No Content-Length, the server sends the body with chunked transfer encoding
+    return Response(stream_with_context(iter_ndjson(query, dump_row, batch_size)), mimetype=NDJSON_MIMETYPE)
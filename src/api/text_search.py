@@ -0,0 +1,341 @@
+"""
+Ranked, typo tolerant search over the destination and the description of the trips (GET /api/trips/search).
+
+PostgreSQL: the migration 7c5e1d3a9b20 creates a GIN index on the weighted tsvector of both
+columns and a pg_trgm GIN index on the destination, both without accents. A search is one
+query: prefix full text matches OR destinations similar to the text, ranked by
+ts_rank_cd + similarity.
+
+Other databases (the SQLite of development): TripTextIndex, an inverted index in the memory
+of the process. Every term has a sorted array of trip ids per field, and a trigram → terms
+index of the vocabulary finds the terms close to a misspelled word (same similarity as
+pg_trgm). It is built on the first search, trips written by this process are re-indexed
+through trip_changed and it is rebuilt when it gets older than SEARCH_INDEX_MAX_AGE seconds,
+for the writes of other processes.
+"""
+import heapq
+import logging
+import math
+import re
+import threading
+import time
+import unicodedata
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from itertools import groupby
+from api.models import db, Trips
+from api.pagination import decode_cursor, encode_cursor, page_size
+from api.signals import trip_changed
+from api.trip_search import trip_filters
+from api.utils import APIException
+
+
+logger = logging.getLogger('api.text_search')
+
+MAX_TERMS = 8
+MAX_OFFSET = 1000
+SIMILARITY_THRESHOLD = 0.3  # pg_trgm.similarity_threshold
+PREFIX_SIMILARITY = 0.9
+MAX_VARIANTS = 10
+MAX_PREFIX_TERMS = 200
+
+# Must be the exact expression of the GIN index so PostgreSQL uses it
+SEARCH_VECTOR = ("setweight(to_tsvector('simple', trips_search_unaccent(coalesce(destination, ''))), 'A') || "
+                 "setweight(to_tsvector('simple', trips_search_unaccent(coalesce(description, ''))), 'B')")
+
+_WORD = re.compile(r'\w+')
+
+
+def tokenize(text):
+    """ Lower case words without accents, 'Ciudad de México' → ['ciudad', 'de', 'mexico'] """
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(char for char in text if not unicodedata.combining(char)).casefold()
+    return _WORD.findall(text)
+
+
+def trigrams(term):
+    padded = f'  {term} '
+    return {padded[index:index + 3] for index in range(len(padded) - 2)}
+
+
+class TripTextIndex:
+    FIELDS = {'destination': 1.0, 'description': 0.4}
+
+    def __init__(self, max_age=600, rebuild_after=5000):
+        self.max_age = max_age
+        self.rebuild_after = rebuild_after
+        self._lock = threading.Lock()
+        self._built_at = None
+        self._dirty = set()
+        self.documents = 0
+        self.postings = {field: {} for field in self.FIELDS}
+        self.vocabulary = []
+        self.trigrams = {}
+        # Trips changed after the build: trip_id → {field: terms}, None when deleted. Replaced,
+        # never mutated, so a search can use the dict it read while _refresh builds the next one
+        self.changed = {}
+
+    def _terms(self, destination, description):
+        return {'destination': set(tokenize(destination)), 'description': set(tokenize(description))}
+
+    def build(self):
+        started = time.perf_counter()
+        postings = {field: {} for field in self.FIELDS}
+        documents = 0
+        query = (db.select(Trips.id, Trips.destination, Trips.description)
+                 .order_by(Trips.id).execution_options(yield_per=5000))
+        for trip_id, destination, description in db.session.execute(query):
+            for field, terms in self._terms(destination, description).items():
+                field_postings = postings[field]
+                for term in terms:
+                    ids = field_postings.get(term)
+                    if ids is None:
+                        ids = field_postings[term] = array('I')
+                    ids.append(trip_id)
+            documents += 1
+        self.postings = postings
+        self.documents = documents
+        self.changed = {}
+        self._dirty = set()
+        self._index_vocabulary(set().union(*postings.values()))
+        self._built_at = time.monotonic()
+        logger.info('Trip search index built: %s trips, %s terms in %.2fs',
+                    documents, len(self.vocabulary), time.perf_counter() - started)
+
+    def _index_vocabulary(self, terms):
+        self.vocabulary = sorted(terms)
+        self.trigrams = {}
+        for term in self.vocabulary:
+            for gram in trigrams(term):
+                self.trigrams.setdefault(gram, []).append(term)
+
+    def _add_terms(self, terms):
+        known = set(self.vocabulary)
+        for term in terms - known:
+            self.vocabulary.insert(bisect_left(self.vocabulary, term), term)
+            for gram in trigrams(term):
+                self.trigrams.setdefault(gram, []).append(term)
+
+    def mark_dirty(self, trip_id=None):
+        """ Re-indexes the trip on the next search, every trip when trip_id is None """
+        if trip_id is None:
+            self._built_at = None
+        elif self._built_at is not None:
+            self._dirty.add(trip_id)
+
+    def _refresh(self):
+        # Copied and removed in place (single C calls): mark_dirty keeps adding without the lock
+        dirty = frozenset(self._dirty)
+        self._dirty -= dirty
+        found = db.session.execute(db.select(Trips.id, Trips.destination, Trips.description)
+                                   .where(Trips.id.in_(dirty))).all()
+        changed = dict(self.changed)
+        changed.update(dict.fromkeys(dirty))
+        for trip_id, destination, description in found:
+            terms = self._terms(destination, description)
+            changed[trip_id] = terms
+            self._add_terms(terms['destination'] | terms['description'])
+        self.changed = changed
+
+    def ensure_ready(self):
+        with self._lock:
+            if (self._built_at is None or time.monotonic() - self._built_at > self.max_age
+                    or len(self.changed) + len(self._dirty) > self.rebuild_after):
+                self.build()
+            elif self._dirty:
+                self._refresh()
+
+    def variants(self, token):
+        """ [(term, similarity)] of the vocabulary that can be what the user meant with token """
+        found = {}
+        if len(token) >= 3:
+            index = bisect_left(self.vocabulary, token)
+            while (index < len(self.vocabulary) and self.vocabulary[index].startswith(token)
+                   and len(found) < MAX_PREFIX_TERMS):
+                term = self.vocabulary[index]
+                found[term] = 1.0 if term == token else PREFIX_SIMILARITY
+                index += 1
+        else:
+            index = bisect_left(self.vocabulary, token)
+            if index < len(self.vocabulary) and self.vocabulary[index] == token:
+                found[token] = 1.0
+        grams = trigrams(token)
+        shared = Counter()
+        for gram in grams:
+            shared.update(self.trigrams.get(gram, ()))
+        for term, common in shared.items():
+            similarity = common / (len(grams) + len(trigrams(term)) - common)
+            if similarity >= SIMILARITY_THRESHOLD and similarity > found.get(term, 0):
+                found[term] = similarity
+        return heapq.nlargest(MAX_VARIANTS, found.items(), key=lambda item: item[1])
+
+    def _idf(self, frequency):
+        return math.log(1 + self.documents / max(frequency, 1))
+
+    def _entries(self, variants):
+        """ [(weight, ids)] of the postings of the variants of one token, best first """
+        entries = []
+        for term, similarity in variants:
+            for field, weight in self.FIELDS.items():
+                ids = self.postings[field].get(term)
+                if ids:
+                    entries.append((weight * similarity * self._idf(len(ids)), ids))
+        entries.sort(key=lambda entry: -entry[0])
+        return entries
+
+    def _changed_scores(self, variants, changed_terms):
+        """ trip_id → best weight of one token for the trips changed after the build """
+        scores = {}
+        for trip_id, terms in changed_terms.items():
+            if terms is None:
+                continue
+            best = max((weight * similarity * self._idf(len(self.postings[field].get(term, ())))
+                        for term, similarity in variants
+                        for field, weight in self.FIELDS.items() if term in terms[field]), default=None)
+            if best is not None:
+                scores[trip_id] = best
+        return scores
+
+    def _scores(self, entries, changed, changed_terms):
+        """ trip_id → best weight of one token, for every trip that matches it """
+        scores = {}
+        # Lowest weights first, every update overwrites them with the better ones (C loops only)
+        for weight, ids in reversed(entries):
+            scores.update(dict.fromkeys(ids, weight))
+        for trip_id in changed_terms:
+            scores.pop(trip_id, None)
+        scores.update(changed)
+        return scores
+
+    def _best_weight(self, entries, changed, changed_terms, trip_id):
+        if trip_id in changed_terms:
+            return changed.get(trip_id)
+        for weight, ids in entries:
+            index = bisect_left(ids, trip_id)
+            if index < len(ids) and ids[index] == trip_id:
+                return weight
+        return None
+
+    def _top_single(self, entries, changed, changed_terms, limit):
+        """ Best `limit` (trip_id, score) candidates of one token without scoring every match:
+        the entries are walked from the best weight down, in id order, until there are enough """
+        ranked = []
+        seen = set()
+        for weight, group in groupby(entries, key=lambda entry: entry[0]):
+            for trip_id in heapq.merge(*(ids for _, ids in group)):
+                if trip_id in seen or trip_id in changed_terms:
+                    continue
+                seen.add(trip_id)
+                ranked.append((trip_id, weight))
+                if len(ranked) == limit:
+                    break
+            if len(ranked) == limit:
+                break
+        ranked.extend(changed.items())
+        return ranked
+
+    def search(self, tokens, limit):
+        """ Ids of the best `limit` trips that match every token, best first """
+        # One snapshot for the whole search, _refresh may replace it meanwhile
+        changed_terms = self.changed
+        per_token = []
+        for token in dict.fromkeys(tokens):
+            variants = self.variants(token)
+            per_token.append((self._entries(variants), self._changed_scores(variants, changed_terms)))
+        # Rarest token first, the others only have to check its candidates
+        per_token.sort(key=lambda item: sum(len(ids) for _, ids in item[0]) + len(item[1]))
+        if not per_token:
+            return []
+        if len(per_token) == 1:
+            ranked = self._top_single(*per_token[0], changed_terms, limit)
+        else:
+            scores = self._scores(*per_token[0], changed_terms)
+            for entries, changed in per_token[1:]:
+                if not scores:
+                    break
+                if sum(len(ids) for _, ids in entries) > 8 * len(scores):
+                    # Few candidates left: look them up in the postings instead of loading them all
+                    next_scores = {}
+                    for trip_id, score in scores.items():
+                        weight = self._best_weight(entries, changed, changed_terms, trip_id)
+                        if weight is not None:
+                            next_scores[trip_id] = score + weight
+                else:
+                    token_scores = self._scores(entries, changed, changed_terms)
+                    next_scores = {trip_id: score + token_scores[trip_id]
+                                   for trip_id, score in scores.items() if trip_id in token_scores}
+                scores = next_scores
+            ranked = scores.items()
+        return [trip_id for trip_id, _ in heapq.nsmallest(limit, ranked, key=lambda item: (-item[1], item[0]))]
+
+text_index = TripTextIndex()
+
+
+def _postgresql_search(tokens, conditions, fields, offset, count):
+    vector = db.literal_column(f'({SEARCH_VECTOR})')
+    tsquery = db.func.to_tsquery('simple', ' & '.join(f'{token}:*' for token in tokens))
+    destination = db.func.trips_search_unaccent(db.func.lower(Trips.destination))
+    text = ' '.join(tokens)
+    rank = db.func.ts_rank_cd(vector, tsquery) + db.func.similarity(destination, text)
+    query = (db.select(*Trips.schema.columns(fields), Trips.id.label('cursor_id'))
+             .where(db.or_(vector.op('@@')(tsquery), destination.op('%')(text)), *conditions)
+             .order_by(rank.desc(), Trips.id).offset(offset).limit(count))
+    return db.session.execute(query).all()
+
+
+def _index_search(tokens, conditions, fields, offset, count, chunk_size=500):
+    text_index.ensure_ready()
+    wanted = offset + count
+    size = wanted
+    rows = []
+    checked = 0
+    while True:
+        ranked = text_index.search(tokens, size)
+        # The other filters run in SQL on the ranked ids, in chunks, until the page is full
+        for start in range(checked, len(ranked), chunk_size):
+            chunk = ranked[start:start + chunk_size]
+            found = {row.cursor_id: row for row in db.session.execute(
+                db.select(*Trips.schema.columns(fields), Trips.id.label('cursor_id'))
+                .where(Trips.id.in_(chunk), *conditions))}
+            rows.extend(found[trip_id] for trip_id in chunk if trip_id in found)
+            if len(rows) >= wanted:
+                return rows[offset:wanted]
+        if len(ranked) < size:
+            return rows[offset:wanted]
+        checked = len(ranked)
+        size *= 4
+
+
+def text_search(args, fields=None):
+    """ Returns (rows, next_cursor) for one page of the trips that match ?q=, best first.
+    Accepts the filters of GET /api/trips. The cursor is an offset, up to MAX_OFFSET results. """
+    tokens = list(dict.fromkeys(tokenize(args.get('q', ''))))[:MAX_TERMS]
+    if not tokens:
+        raise APIException('q is required', status_code=400)
+    limit = page_size(args)
+    offset = decode_cursor(args['cursor'], int)[0] if args.get('cursor') else 0
+    if not 0 <= offset <= MAX_OFFSET:
+        raise APIException('Invalid cursor', status_code=400)
+    conditions = trip_filters(args)
+    if db.session.get_bind().dialect.name == 'postgresql':
+        rows = _postgresql_search(tokens, conditions, fields, offset, limit + 1)
+    else:
+        rows = _index_search(tokens, conditions, fields, offset, limit + 1)
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        if offset + limit < MAX_OFFSET:
+            next_cursor = encode_cursor(offset + limit)
+    return rows, next_cursor
+
+
+def _on_trip_changed(sender, trip_id=None, change=None, **extra):
+    # Travelers don't change the destination nor the description
+    if change != 'travelers':
+        text_index.mark_dirty(trip_id)
+
+
+def setup_text_search(app):
+    text_index.max_age = app.config.get('SEARCH_INDEX_MAX_AGE', text_index.max_age)
+    trip_changed.connect(_on_trip_changed, weak=False)
@@ -0,0 +1,285 @@
+"""
+Validation and bulk writes of trips.
+
+    POST  /api/trips/batch  {"trips": [{...}, ...], "atomic": true}          creates up to MAX_BATCH_SIZE trips
+    PATCH /api/trips/batch  {"trips": [{"id": 1, ...}, ...], "atomic": true}  changes the given fields
+
+Every item is validated before anything is written; dates are parsed once per distinct string.
+Valid items go to the database with one executemany per statement and a single commit, so a
+batch of 500 trips costs one request and one transaction instead of 500 of each.
+With atomic (the default) one invalid item rejects the whole batch; with "atomic": false the
+valid items are written and the invalid ones reported.
+
+The result of every item is in `results`, in the order of the request:
+    {"index": 0, "status": 201, "id": 812}
+    {"index": 1, "status": 400, "errors": {"end_date": "must be on or after start_date"}}
+When an atomic batch is rejected the valid items answer 424 and nothing is written.
+
+The ids of new trips are taken before the INSERT (the sequence on PostgreSQL, MAX(id) + 1 on
+other databases) because executemany doesn't return the generated keys.
+"""
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import bindparam
+from sqlalchemy.exc import IntegrityError
+from api.models import db, Users, Trips
+from api.notifications import dispatcher
+from api.signals import trip_changed
+from api.trip_search import TRIP_STATUSES
+from api.utils import APIException
+
+
+MAX_BATCH_SIZE = 500
+ID_RETRIES = 3  # Concurrent batches can take the same MAX(id) + 1, the loser tries again
+REQUIRED = ('destination', 'start_date', 'end_date', 'description', 'budget', 'budget_currency')
+
+
+def _text(max_length=None, nullable=False):
+    def check(value, dates):
+        if value is None and nullable:
+            return None
+        if not isinstance(value, str) or (not nullable and not value.strip()):
+            raise ValueError('must be a non empty string')
+        if max_length and len(value) > max_length:
+            raise ValueError(f'must be at most {max_length} characters')
+        return value
+    return check
+
+
+def _integer(nullable=False):
+    def check(value, dates):
+        if value is None and nullable:
+            return None
+        if not isinstance(value, int) or isinstance(value, bool) or value < 0:
+            raise ValueError('must be an integer greater than or equal to 0')
+        return value
+    return check
+
+
+def _date(value, dates):
+    # dates memoizes the parsing, the trips of a batch share a handful of dates
+    if not isinstance(value, str):
+        raise ValueError('must be a date with format YYYY-MM-DD')
+    parsed = dates.get(value)
+    if parsed is None:
+        try:
+            parsed = dates[value] = datetime.strptime(value, "%Y-%m-%d")
+        except ValueError:
+            raise ValueError('must be a date with format YYYY-MM-DD')
+    return parsed
+
+
+def _status(value, dates):
+    if value not in TRIP_STATUSES:
+        raise ValueError(f'must be one of {", ".join(TRIP_STATUSES)}')
+    return value
+
+
+FIELDS = {'destination': _text(50),
+          'start_date': _date,
+          'end_date': _date,
+          'available_seats': _integer(nullable=True),
+          'description': _text(200),
+          'photo': _text(255, nullable=True),
+          'budget': _integer(),
+          'budget_currency': _text(),
+          'age_min': _integer(nullable=True),
+          'age_max': _integer(nullable=True),
+          'status': _status}
+
+
+def parse_trip(data, dates, current=None):
+    """ Validates the fields of a trip, returns (values, errors) with errors as {field: message}.
+    current is the row being updated: missing fields keep its values. Without it the trip is new,
+    the required fields must be there and status defaults to planning. id and host_id are left to the caller """
+    if not isinstance(data, dict):
+        return {}, {'trip': 'must be an object'}
+    values, errors = {}, {}
+    for name in data:
+        if name not in FIELDS and name not in ('id', 'host_id'):
+            errors[name] = 'unknown field'
+    for name, check in FIELDS.items():
+        if name not in data:
+            if current is None and name in REQUIRED:
+                errors[name] = 'is required'
+            continue
+        try:
+            values[name] = check(data[name], dates)
+        except ValueError as error:
+            errors[name] = str(error)
+    if current is None:
+        values.setdefault('status', 'planning')
+    merged = {**(current or {}), **values}
+    if 'start_date' not in errors and 'end_date' not in errors and merged.get('start_date') and merged.get('end_date'):
+        if merged['end_date'] < merged['start_date']:
+            errors['end_date'] = 'must be on or after start_date'
+    if merged.get('age_min') is not None and merged.get('age_max') is not None and merged['age_min'] > merged['age_max']:
+        errors.setdefault('age_max', 'must be greater than or equal to age_min')
+    return values, errors
+
+
+def parse_items(body):
+    """ Reads {"trips": [...], "atomic": true} """
+    if not isinstance(body, dict) or not isinstance(body.get('trips'), list) or not body['trips']:
+        raise APIException('trips must be a non empty list of trips', status_code=400)
+    if len(body['trips']) > MAX_BATCH_SIZE:
+        raise APIException(f'A batch can have up to {MAX_BATCH_SIZE} trips', status_code=413)
+    atomic = body.get('atomic', True)
+    if not isinstance(atomic, bool):
+        raise APIException('atomic must be true or false', status_code=400)
+    return body['trips'], atomic
+
+
+def _existing_users(user_ids):
+    if not user_ids:
+        return set()
+    return set(db.session.execute(db.select(Users.id).where(Users.id.in_(user_ids))).scalars())
+
+
+def _host_error(item, user_id, is_admin, users):
+    """ Only an admin can write trips of another host, and the host must exist """
+    host_id = item.get('host_id', user_id)
+    if host_id == user_id:
+        return None
+    if not is_admin:
+        return 403, 'only an admin can set the host of a trip'
+    if not isinstance(host_id, int) or host_id not in users:
+        return 400, 'user not found'
+    return None
+
+
+def _allocate_ids(count):
+    if db.session.get_bind().dialect.name == 'postgresql':
+        query = db.text("SELECT nextval(pg_get_serial_sequence('trips', 'id')) FROM generate_series(1, :count)")
+        return list(db.session.execute(query, {'count': count}).scalars())
+    first = (db.session.execute(db.select(db.func.max(Trips.id))).scalar() or 0) + 1
+    return list(range(first, first + count))
+
+
+def _outcome(results, atomic, written):
+    """ Response body and status of a batch """
+    failed = sum(1 for result in results if 'errors' in result)
+    if failed and atomic:
+        for result in results:
+            if 'errors' not in result:
+                result['status'] = 424  # Valid, not written because of the others
+                result.pop('changed', None)
+    if failed and (atomic or not written):
+        message = 'No trip was written, fix the errors' if atomic else 'No trip was valid'
+        return {'message': message, 'results': results}, 400
+    if failed:
+        return {'message': f'{written} trips written, {failed} with errors', 'results': results}, 207
+    return {'message': f'{written} trips written', 'results': results}, 200
+
+
+def create_trips(items, user_id, is_admin=False, atomic=True):
+    """ Validates and inserts the trips of a POST /api/trips/batch, returns (body, status) """
+    dates = {}
+    hosts = _existing_users({item['host_id'] for item in items
+                             if isinstance(item, dict) and isinstance(item.get('host_id'), int)} - {user_id})
+    results, rows = [], []
+    for index, item in enumerate(items):
+        values, errors = parse_trip(item, dates)
+        status = 400
+        if isinstance(item, dict) and 'id' in item:
+            errors['id'] = 'ids of new trips are given by the server'
+        if isinstance(item, dict):
+            host_error = _host_error(item, user_id, is_admin, hosts)
+            if host_error:
+                status, errors['host_id'] = host_error
+        if errors:
+            results.append({'index': index, 'status': status, 'errors': errors})
+            continue
+        rows.append(dict(values, host_id=item.get('host_id', user_id)))
+        results.append({'index': index, 'status': 201})
+    if (atomic and len(rows) < len(items)) or not rows:
+        return _outcome(results, atomic, 0)
+
+    for attempt in range(ID_RETRIES):
+        ids = _allocate_ids(len(rows))
+        for row, trip_id in zip(rows, ids):
+            row['id'] = trip_id
+        try:
+            db.session.execute(db.insert(Trips), rows)
+            db.session.commit()
+            break
+        except IntegrityError:
+            db.session.rollback()
+            if attempt == ID_RETRIES - 1:
+                raise APIException('The trips could not be created, try again', status_code=409)
+
+    created = iter(ids)
+    for result in results:
+        if 'errors' not in result:
+            result['id'] = next(created)
+    app = current_app._get_current_object()
+    for trip_id in ids:
+        trip_changed.send(app, trip_id=trip_id, change='created')
+    return _outcome(results, atomic, len(rows))
+
+
+def update_trips(items, user_id, is_admin=False, atomic=True):
+    """ Validates and applies the changes of a PATCH /api/trips/batch, returns (body, status) """
+    dates = {}
+    ids = {item['id'] for item in items if isinstance(item, dict) and isinstance(item.get('id'), int)}
+    # One query for the current rows, locked until the commit on databases with row locks
+    table = Trips.__table__
+    current = {row.id: row._asdict() for row in db.session.execute(
+        db.select(*table.columns).where(table.c.id.in_(ids)).with_for_update())} if ids else {}
+    hosts = _existing_users({item['host_id'] for item in items
+                             if isinstance(item, dict) and isinstance(item.get('host_id'), int)} - {user_id})
+    results, changes, seen = [], [], set()
+    for index, item in enumerate(items):
+        trip_id = item.get('id') if isinstance(item, dict) else None
+        row = current.get(trip_id)
+        if not isinstance(trip_id, int) or trip_id in seen:
+            result = {'index': index, 'status': 400, 'errors': {'id': 'must be the id of a trip, once per batch'}}
+        elif row is None:
+            result = {'index': index, 'status': 404, 'errors': {'id': 'trip not found'}}
+        elif row['host_id'] != user_id and not is_admin:
+            result = {'index': index, 'status': 403, 'errors': {'id': 'No tienes permiso para modificar este viaje'}}
+        else:
+            values, errors = parse_trip(item, dates, row)
+            status = 400
+            if 'host_id' in item:
+                host_error = _host_error(item, user_id, is_admin, hosts | {row['host_id']})
+                if host_error:
+                    status, errors['host_id'] = host_error
+                else:
+                    values['host_id'] = item['host_id']
+            if errors:
+                result = {'index': index, 'status': status, 'errors': errors}
+            else:
+                values = {name: value for name, value in values.items() if value != row[name]}
+                if 'photo' in values:
+                    values['photo_hash'] = None  # A URL from elsewhere has no thumbnails
+                changes.append((trip_id, values))
+                result = {'index': index, 'status': 200, 'id': trip_id, 'changed': sorted(values)}
+        if isinstance(trip_id, int):
+            seen.add(trip_id)
+        results.append(result)
+    if (atomic and len(changes) < len(items)) or not changes:
+        db.session.rollback()  # Releases the row locks
+        return _outcome(results, atomic, 0)
+
+    # One executemany per set of changed columns
+    groups = {}
+    for trip_id, values in changes:
+        if values:
+            groups.setdefault(tuple(sorted(values)), []).append(dict(values, b_id=trip_id))
+    for names, params in groups.items():
+        statement = (db.update(table).where(table.c.id == bindparam('b_id'))
+                     .values({name: bindparam(name) for name in names}))
+        db.session.execute(statement, params)
+    db.session.commit()
+
+    app = current_app._get_current_object()
+    for trip_id, values in changes:
+        if not values:
+            continue
+        if 'status' in values:
+            trip_changed.send(app, trip_id=trip_id, change='status')
+            dispatcher.notify('trip_status', trip_id, actor_id=user_id, status=values['status'])
+        else:
+            trip_changed.send(app, trip_id=trip_id, change='updated')
+    return _outcome(results, atomic, len(changes))
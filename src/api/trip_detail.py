@@ -0,0 +1,59 @@
+"""
+GET /api/trips/<id>?expand=host,travelers,favorites_count
+Loads a trip and the related data the detail page needs in at most two SQL statements:
+the trip joined with its host plus the counters as scalar subqueries, and one
+selectin query for the travelers with their user rows.
+"""
+from sqlalchemy.orm import joinedload, selectinload
+from api.models import db, Trips, Travelers, Favorites
+from api.utils import APIException
+
+
+EXPANDABLE = ('host', 'travelers', 'favorites_count', 'travelers_count')
+
+
+def parse_expand(args):
+    requested = [name.strip() for name in args.get('expand', '').split(',') if name.strip()]
+    unknown = [name for name in requested if name not in EXPANDABLE]
+    if unknown:
+        raise APIException(f'Unknown expand: {", ".join(unknown)}. Valid values: {", ".join(EXPANDABLE)}', status_code=400)
+    return set(requested)
+
+
+def embeds_users(args):
+    """ True when the expansions include profile data of users, for the response cache """
+    return bool(parse_expand(args) & {'host', 'travelers'})
+
+
+def load_trip_detail(trip_id, expand):
+    """ Returns the serialized trip with the requested expansions or None if it does not exist """
+    columns = [Trips]
+    if 'favorites_count' in expand:
+        columns.append(db.select(db.func.count(Favorites.id))
+                       .where(Favorites.trip_id == Trips.id)
+                       .scalar_subquery().label('favorites_count'))
+    if 'travelers_count' in expand:
+        columns.append(db.select(db.func.count(Travelers.id))
+                       .where(Travelers.trip_id == Trips.id, Travelers.status == 'approved')
+                       .scalar_subquery().label('travelers_count'))
+    query = db.select(*columns).where(Trips.id == trip_id)
+    if 'host' in expand:
+        query = query.options(joinedload(Trips.host_to))
+    if 'travelers' in expand:
+        query = query.options(selectinload(Trips.traveler_to).joinedload(Travelers.traveler_to))
+
+    row = db.session.execute(query).first()
+    if row is None:
+        return None
+    trip = row.Trips
+    result = trip.serialize()
+    if 'host' in expand:
+        result['host'] = trip.host_to.serialize()
+    if 'travelers' in expand:
+        result['travelers'] = [dict(traveler.serialize(), user=traveler.traveler_to.serialize())
+                               for traveler in trip.traveler_to]
+    if 'favorites_count' in expand:
+        result['favorites_count'] = row.favorites_count
+    if 'travelers_count' in expand:
+        result['travelers_count'] = row.travelers_count
+    return result
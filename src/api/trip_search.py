@@ -0,0 +1,100 @@
+"""
+Server side filtering for GET /api/trips.
+Every filter maps to an indexed column (see the indexes declared on Trips) and results are
+ordered by (start_date, id) so pages can be fetched with a keyset cursor.
+"""
+from datetime import datetime
+from sqlalchemy import tuple_
+from api.models import db, Trips
+from api.pagination import decode_cursor, encode_cursor, page_size
+from api.utils import APIException
+
+
+TRIP_STATUSES = ('planning', 'finished', 'ongoing', 'cancelled')
+
+
+def _int_arg(args, name):
+    value = args.get(name)
+    if value in (None, ''):
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise APIException(f'{name} must be an integer', status_code=400)
+
+
+def _date_arg(args, name):
+    value = args.get(name)
+    if value in (None, ''):
+        return None
+    try:
+        return datetime.strptime(value, "%Y-%m-%d")
+    except ValueError:
+        raise APIException(f'{name} must be a date with format YYYY-MM-DD', status_code=400)
+
+
+def _like_prefix(value):
+    escaped = value.lower().replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return escaped + '%'
+
+
+def trip_filters(args):
+    """ Translates the query string of GET /api/trips into a list of SQL conditions """
+    conditions = []
+    destination = args.get('destination', '').strip()
+    if destination:
+        conditions.append(db.func.lower(Trips.destination).like(_like_prefix(destination), escape='\\'))
+    date_from = _date_arg(args, 'date_from')
+    if date_from is not None:
+        conditions.append(Trips.start_date >= date_from)
+    date_to = _date_arg(args, 'date_to')
+    if date_to is not None:
+        conditions.append(Trips.start_date <= date_to)
+    budget_min = _int_arg(args, 'budget_min')
+    if budget_min is not None:
+        conditions.append(Trips.budget >= budget_min)
+    budget_max = _int_arg(args, 'budget_max')
+    if budget_max is not None:
+        conditions.append(Trips.budget <= budget_max)
+    # The age band of the trip has to overlap the requested band
+    age_min = _int_arg(args, 'age_min')
+    if age_min is not None:
+        conditions.append(db.or_(Trips.age_max.is_(None), Trips.age_max >= age_min))
+    age_max = _int_arg(args, 'age_max')
+    if age_max is not None:
+        conditions.append(db.or_(Trips.age_min.is_(None), Trips.age_min <= age_max))
+    status = args.get('status')
+    if status:
+        statuses = status.split(',')
+        if any(item not in TRIP_STATUSES for item in statuses):
+            raise APIException(f'status must be one of {", ".join(TRIP_STATUSES)}', status_code=400)
+        conditions.append(Trips.status.in_(statuses))
+    seats = _int_arg(args, 'seats')
+    if seats is not None:
+        conditions.append(Trips.available_seats >= seats)
+    return conditions
+
+
+def export_trips_query(args, fields=None):
+    """ Same filters as search_trips() but without pagination, used by the streaming export """
+    return db.select(*Trips.schema.columns(fields)).where(*trip_filters(args)).order_by(Trips.start_date, Trips.id)
+
+
+def search_trips(args, fields=None):
+    """ Returns (rows, next_cursor) for one page of trips matching the query string.
+    Rows are tuples that start with the columns of `fields`, dump them with Trips.schema. """
+    limit = page_size(args)
+    query = db.select(*Trips.schema.columns(fields), Trips.start_date.label('cursor_start_date'), Trips.id.label('cursor_id'))
+    query = query.where(*trip_filters(args))
+    cursor = args.get('cursor')
+    if cursor:
+        start_date, trip_id = decode_cursor(cursor, datetime, int)
+        query = query.where(tuple_(Trips.start_date, Trips.id) > tuple_(start_date, trip_id))
+    # One extra row tells us if there is a next page without a COUNT(*)
+    query = query.order_by(Trips.start_date, Trips.id).limit(limit + 1)
+    rows = db.session.execute(query).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].cursor_start_date, rows[-1].cursor_id)
+    return rows, next_cursor
@@ -2,7 +2,7 @@
 This module takes care of starting the API Server, Loading the DB and Adding the endpoints
 """
 import os
-from flask import Flask, request, jsonify, url_for, send_from_directory
+from flask import Flask, request, jsonify, url_for
 from flask_migrate import Migrate
 from flask_swagger import swagger
 from flask_jwt_extended import JWTManager
@@ -11,11 +11,28 @@ from api.routes import api
 from api.admin import setup_admin
 from api.commands import setup_commands
 from api.models import db
+from api.serializers import FastJSONProvider
+from api.instrumentation import setup_instrumentation
+from api.logs import setup_logging
+from api.metrics import setup_metrics
+from api.cache import setup_cache
+from api.notifications import setup_notifications
+from api.text_search import setup_text_search
+from api.recommendations import setup_recommendations
+from api.auth import setup_auth
+from api.rate_limit import setup_rate_limit
+from api.compression import setup_compression
+from api.http_client import setup_http_client
+from api.photos import setup_photos
+from api.media import setup_media
+from api.lifecycle import setup_lifecycle
+from api.static_files import StaticFiles
 
 ENV = "development" if os.getenv("FLASK_DEBUG") == "1" else "production"
 static_file_dir = os.path.join(os.path.dirname(os.path.realpath(__file__)), '../public/')
 app = Flask(__name__)
 app.url_map.strict_slashes = False
+app.json = FastJSONProvider(app)  # jsonify() with orjson when available
 # Database condiguration
 db_url = os.getenv("DATABASE_URL")
 if db_url is not None:
@@ -23,8 +40,73 @@ if db_url is not None:
 else:
     app.config['SQLALCHEMY_DATABASE_URI'] = "sqlite:////tmp/test.db"
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Connection pool of every worker process, see "Database connection pool" in the README to size it
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {'pool_pre_ping': os.getenv('DB_POOL_PRE_PING', '1') == '1'}
+if not app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'].update({
+        'pool_size': int(os.getenv('DB_POOL_SIZE', 2)),
+        'max_overflow': int(os.getenv('DB_MAX_OVERFLOW', 3)),
+        'pool_timeout': int(os.getenv('DB_POOL_TIMEOUT', 10)),
+        'pool_recycle': int(os.getenv('DB_POOL_RECYCLE', 1800))})
+# Max SQL statements per request, QUERY_BUDGET_STRICT=1 raises an error instead of logging a warning
+app.config['QUERY_BUDGET'] = int(os.getenv('QUERY_BUDGET')) if os.getenv('QUERY_BUDGET') else None
+app.config['QUERY_BUDGET_STRICT'] = os.getenv('QUERY_BUDGET_STRICT') == '1'
 MIGRATE = Migrate(app, db, compare_type=True)
 db.init_app(app)
+# JSON logs of the api.* loggers, only a LOG_SAMPLE_RATE share of the INFO lines of every request
+app.config['LOG_LEVEL'] = os.getenv('LOG_LEVEL', 'INFO')
+app.config['LOG_SAMPLE_RATE'] = float(os.getenv('LOG_SAMPLE_RATE', 0.1))
+setup_logging(app)
+setup_instrumentation(app)  # Query counter, Server-Timing header and N+1 detection
+# Prometheus metrics of every endpoint on /metrics, added up across the gunicorn workers
+app.config['METRICS_ENABLED'] = os.getenv('METRICS_ENABLED', '1') == '1'
+app.config['METRICS_TOKEN'] = os.getenv('METRICS_TOKEN')
+setup_metrics(app)
+# Response cache for the trip endpoints, CACHE_URL=redis://... shares it between workers
+app.config['CACHE_URL'] = os.getenv('CACHE_URL')
+app.config['CACHE_TTL'] = int(os.getenv('CACHE_TTL', 30))
+setup_cache(app)
+# Notifications are written by a background thread, the queue is bounded for backpressure
+app.config['NOTIFICATIONS_MAX_QUEUE'] = int(os.getenv('NOTIFICATIONS_MAX_QUEUE', 10000))
+setup_notifications(app)
+# Text search, without PostgreSQL it uses an index in memory rebuilt every SEARCH_INDEX_MAX_AGE seconds
+app.config['SEARCH_INDEX_MAX_AGE'] = int(os.getenv('SEARCH_INDEX_MAX_AGE', 600))
+setup_text_search(app)
+# Recommendations keep the open trips in NumPy arrays, rebuilt every RECOMMENDATIONS_MAX_AGE seconds
+app.config['RECOMMENDATIONS_MAX_AGE'] = int(os.getenv('RECOMMENDATIONS_MAX_AGE', 600))
+setup_recommendations(app)
+# Rate limits of the API, RATE_LIMIT_URL=redis://... (or CACHE_URL) shares the buckets between workers
+app.config['RATE_LIMIT_ENABLED'] = os.getenv('RATE_LIMIT_ENABLED', '1') == '1'
+app.config['RATE_LIMIT_PROXIES'] = int(os.getenv('RATE_LIMIT_PROXIES', 0))
+app.config['RATE_LIMIT_DEFAULT'] = os.getenv('RATE_LIMIT_DEFAULT')
+app.config['RATE_LIMIT_URL'] = os.getenv('RATE_LIMIT_URL')
+setup_rate_limit(app)
+# Compression of the API responses bigger than COMPRESS_MIN_SIZE bytes (br and zstd need their packages)
+app.config['COMPRESS_ENABLED'] = os.getenv('COMPRESS_ENABLED', '1') == '1'
+app.config['COMPRESS_MIN_SIZE'] = int(os.getenv('COMPRESS_MIN_SIZE', 1024))
+app.config['COMPRESS_LEVELS'] = {name: int(os.getenv(f'COMPRESS_LEVEL_{name.upper()}'))
+                                 for name in ('br', 'zstd', 'gzip') if os.getenv(f'COMPRESS_LEVEL_{name.upper()}')}
+setup_compression(app)
+# Outbound HTTP (httpx, pooled per worker) and photo uploads streamed to STORAGE_URL, see api/photos.py
+app.config['HTTP_CLIENT_TIMEOUT'] = float(os.getenv('HTTP_CLIENT_TIMEOUT', 30))
+app.config['HTTP_CLIENT_CONNECT_TIMEOUT'] = float(os.getenv('HTTP_CLIENT_CONNECT_TIMEOUT', 5))
+app.config['HTTP_CLIENT_MAX_CONNECTIONS'] = int(os.getenv('HTTP_CLIENT_MAX_CONNECTIONS', 20))
+setup_http_client(app)
+app.config['STORAGE_URL'] = os.getenv('STORAGE_URL')
+app.config['STORAGE_PUBLIC_URL'] = os.getenv('STORAGE_PUBLIC_URL')
+app.config['STORAGE_TOKEN'] = os.getenv('STORAGE_TOKEN')
+app.config['PHOTO_MAX_SIZE'] = int(os.getenv('PHOTO_MAX_SIZE', 10 * 1024 * 1024))
+setup_photos(app)
+# Thumbnails of the photos, rendered by MEDIA_WORKERS processes and cached in MEDIA_DIR (see api/media.py)
+app.config['MEDIA_DIR'] = os.getenv('MEDIA_DIR')
+app.config['MEDIA_CACHE_SIZE'] = int(os.getenv('MEDIA_CACHE_SIZE', 1024 ** 3))
+app.config['MEDIA_WORKERS'] = int(os.getenv('MEDIA_WORKERS', 2))
+app.config['MEDIA_EAGER'] = os.getenv('MEDIA_EAGER', '1') == '1'
+setup_media(app)
+# Trip statuses moved by their dates every LIFECYCLE_INTERVAL seconds, 0 leaves it to `flask update-trip-statuses`
+app.config['LIFECYCLE_INTERVAL'] = int(os.getenv('LIFECYCLE_INTERVAL', 600))
+app.config['LIFECYCLE_BATCH_SIZE'] = int(os.getenv('LIFECYCLE_BATCH_SIZE', 1000))
+setup_lifecycle(app)
 # Others configuration
 setup_admin(app)  # Add the admin
 setup_commands(app)  # Add the admin
@@ -32,6 +114,9 @@ app.register_blueprint(api, url_prefix='/api')  # Add all endpoints form the API
 
 app.config["JWT_SECRET_KEY"] = os.getenv('JWT_SECRET_KEY') # Change this!
 jwt = JWTManager(app)
+# Cached principal per token, revocation list and immediate deactivation (see api/auth.py)
+app.config['AUTH_PRINCIPAL_TTL'] = int(os.getenv('AUTH_PRINCIPAL_TTL', 60))
+setup_auth(app, jwt)
 
 # Handle/serialize errors like a JSON object
 @app.errorhandler(APIException)
@@ -39,22 +124,23 @@ def handle_invalid_usage(error):
     return jsonify(error.to_dict()), error.status_code
 
 
+# Front end build: file lookups and ETags cached in memory, hashed bundles immutable,
+# index.html revalidated and .br/.gz variants written by `flask precompress` (see api/static_files.py)
+static_files = StaticFiles(static_file_dir, reload=ENV == "development")
+
+
 # Generate sitemap with all your endpoints
 @app.route('/')
 def sitemap():
     if ENV == "development":
         return generate_sitemap(app)
-    return send_from_directory(static_file_dir, 'index.html')
+    return static_files.response('index.html')
 
 
 # Any other endpoint will try to serve it like a static file
 @app.route('/<path:path>', methods=['GET'])
 def serve_any_other_file(path):
-    if not os.path.isfile(os.path.join(static_file_dir, path)):
-        path = 'index.html'
-    response = send_from_directory(static_file_dir, path)
-    response.cache_control.max_age = 0  # Avoid cache memory
-    return response
+    return static_files.response(path)
 
 
 # This only runs if `$ python src/main.py` is executed
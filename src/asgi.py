@@ -0,0 +1,101 @@
+# ASGI entry point, an alternative to wsgi.py: $ uvicorn asgi:application --app-dir src
+# Read more about it in the README ("ASGI mode")
+import asyncio
+import re
+from asgiref.sync import sync_to_async
+from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
+from flask_jwt_extended import get_jwt, verify_jwt_in_request
+from flask_jwt_extended.exceptions import JWTExtendedException
+from jwt.exceptions import PyJWTError
+from app import app
+from api.http_client import http_clients
+from api.photos import photo_uploads, authorize, save_photo
+from api.serializers import dumps
+from api.utils import APIException
+
+
+# Served here without going through Flask: WsgiToAsgi reads the whole body before calling the
+# app, these stream it to the storage while it arrives and only await while they wait
+UPLOAD_ROUTE = re.compile(r'^/api/(?:(users)|(trips)/(\d+))/photo/?$')
+
+
+class ThreadedWsgiInstance(WsgiToAsgiInstance):
+    # asgiref runs the app with thread_sensitive=True, on one thread for every request of the worker:
+    # the Flask views must run side by side, each in a thread of the default pool of the loop
+    run_wsgi_app = sync_to_async(WsgiToAsgiInstance.__dict__['run_wsgi_app'].func, thread_sensitive=False)
+
+
+class ThreadedWsgiToAsgi(WsgiToAsgi):
+    async def __call__(self, scope, receive, send):
+        await ThreadedWsgiInstance(self.wsgi_application, self.duplicate_header_limit)(scope, receive, send)
+
+
+flask_application = ThreadedWsgiToAsgi(app)
+
+
+def _authorize(path, headers, kind, object_id):
+    """ JWT checks of @jwt_required (signature, revocation, active user) and permissions, in a thread """
+    with app.test_request_context(path, method='PUT', headers=headers):
+        verify_jwt_in_request()
+        user_id = get_jwt()['user_id']
+        object_id = user_id if kind == 'users' else object_id
+        authorize(kind, object_id, user_id)
+        return object_id
+
+
+def _save(kind, object_id, url, content_hash):
+    with app.app_context():
+        return save_photo(kind, object_id, url, content_hash)
+
+
+async def _body(receive):
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            raise APIException('Client disconnected', status_code=400)
+        if message.get('body'):
+            yield message['body']
+        if not message.get('more_body'):
+            return
+
+
+async def upload_photo(scope, receive, send, match):
+    kind = 'users' if match.group(1) else 'trips'
+    headers = [(name.decode('latin-1'), value.decode('latin-1')) for name, value in scope['headers']]
+    lookup = {name.lower(): value for name, value in headers}
+    length = int(lookup['content-length']) if lookup.get('content-length', '').isdigit() else None
+    try:
+        content_type = photo_uploads.check(lookup.get('content-type'), length)
+        object_id = await asyncio.to_thread(_authorize, scope['path'], headers, kind,
+                                            int(match.group(3)) if match.group(3) else None)
+        url, content_hash = await photo_uploads.upload(kind, object_id, _body(receive), content_type, length)
+        results = await asyncio.to_thread(_save, kind, object_id, url, content_hash)
+        status, body = 200, {'message': 'Photo uploaded', 'results': results}
+    except APIException as error:
+        status, body = error.status_code, error.to_dict()
+    except (JWTExtendedException, PyJWTError) as error:
+        status, body = 401, {'msg': str(error) or type(error).__name__}
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'application/json'), (b'access-control-allow-origin', b'*')]})
+    await send({'type': 'http.response.body', 'body': dumps(body)})
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await http_clients.aclose()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] == 'http' and scope['method'] == 'PUT':
+        match = UPLOAD_ROUTE.match(scope['path'])
+        if match:
+            return await upload_photo(scope, receive, send, match)
+    return await flask_application(scope, receive, send)
@@ -0,0 +1,20 @@
+# Passed to gunicorn with -c (Procfile, render.yaml): gunicorn only looks for ./gunicorn.conf.py in the launch directory
+# The workers keep their metrics in files of one directory, added up by GET /metrics (see api/metrics.py)
+import os
+import shutil
+import tempfile
+
+
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', os.path.join(tempfile.gettempdir(), 'prometheus-metrics'))
+
+
+def on_starting(server):
+    # The files of a previous run would add their counts to this one
+    directory = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
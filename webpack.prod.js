@@ -4,7 +4,9 @@ const Dotenv = require('dotenv-webpack');
 module.exports = merge(common, {
     mode: 'production',
     output: {
-        publicPath: '/'
+        publicPath: '/',
+        // The name changes with the content, so the server can cache it forever (src/api/static_files.py)
+        filename: 'bundle.[contenthash:8].js'
     },
     plugins: [
         new Dotenv({